@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the multi-method typing identification system.
+
+Generates a seeded population of synthetic typists, enrolls them the way
+typing_game stores profiles, and measures for every population size:
+profile load and index build time, feature extraction time, per-request
+latency (p50/p99) and accuracy of every identification method, ML
+training time and peak memory. ``--ml-classifiers`` retrains and measures
+the ML method once per classifier kind, to weigh the fast training modes
+against the SVC ensemble.
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python benchmark.py --users 10 100 1000 --output before.json
+    python benchmark.py --users 10 100 1000 --compare before.json
+    python benchmark.py --users 100 1000 --ml-classifiers svc linear rff
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import identify_app.app as identify_module
+
+TEXTS = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Pack my box with five dozen liquor jugs.",
+    "How vexingly quick daft zebras jump.",
+    "Sphinx of black quartz, judge my vow.",
+    "The five boxing wizards jump quickly.",
+    "A journey of a thousand miles begins with a single step.",
+]
+# Row/column of the digraph rhythm tables; anything else types like a space
+KEYS = 'abcdefghijklmnopqrstuvwxyz '
+METHODS = ('statistical', 'ngram', 'ml', 'cascade')
+# metric -> True if bigger is better, for --compare
+COMPARED_METRICS = {
+    'profile_load_s': False,
+    'index_build_s': False,
+    'feature_extraction_us': False,
+    'load_peak_mb': False,
+    'p50_ms': False,
+    'p99_ms': False,
+    'cached_p50_ms': False,
+    'peak_mb': False,
+    'train_s': False,
+    'fit_s': False,
+    'held_out_accuracy': True,
+    'accuracy': True,
+}
+
+# ===== SYNTHETIC TYPISTS =====
+class SyntheticTypist:
+    """A simulated typist with a personal speed, hold length and digraph rhythm.
+
+    Down-down latencies come from a population-wide table of digraph
+    difficulty, scaled by the typist's speed and their own per-digraph
+    habits, with per-keystroke noise on top.
+    """
+
+    def __init__(self, name, rng, digraph_base):
+        self.name = name
+        self.speed = rng.lognormal(0, 0.25)
+        self.hold = rng.normal(95, 15)
+        self.hold_jitter = rng.uniform(0.08, 0.2)
+        self.rhythm = digraph_base * rng.lognormal(0, 0.15, digraph_base.shape)
+        self.jitter = rng.uniform(0.05, 0.15)
+
+    def sample(self, rng, text, events=False):
+        """One typing sample of text in the typing_game sample format"""
+        codes = np.array([KEYS.find(c) for c in text.lower()])
+        codes[codes < 0] = len(KEYS) - 1
+        n = len(text)
+        holds = np.maximum(rng.normal(self.hold, self.hold * self.hold_jitter, n), 20)
+        dd = self.rhythm[codes[:-1], codes[1:]] * self.speed
+        dd = np.maximum(dd * (1 + rng.normal(0, self.jitter, n - 1)), 30)
+        downs = np.concatenate([[0.0], np.cumsum(dd)])
+        ups = downs + holds
+        sample = {
+            'text': text,
+            'hold_times': np.round(holds, 1).tolist(),
+            'flight_times': np.round(downs[1:] - ups[:-1], 1).tolist(),
+            'down_down_times': np.round(dd, 1).tolist(),
+            'ngram_data': ngram_data(text, downs)
+        }
+        if events:
+            timings = [{'key': c, 'time': round(float(t), 1), 'type': 'down'} for c, t in zip(text, downs)]
+            timings += [{'key': c, 'time': round(float(t), 1), 'type': 'up'} for c, t in zip(text, ups)]
+            sample['timings'] = sorted(timings, key=lambda e: e['time'])
+        return sample
+
+def ngram_data(text, downs):
+    """Down-to-down latencies of every letter digraph and trigraph in text"""
+    text = text.lower()
+    data = {'digraphs': {}, 'trigraphs': {}}
+    for i in range(len(text) - 1):
+        if text[i:i + 2].isalpha():
+            data['digraphs'].setdefault(text[i:i + 2], []).append(round(float(downs[i + 1] - downs[i]), 1))
+        if i < len(text) - 2 and text[i:i + 3].isalpha():
+            data['trigraphs'].setdefault(text[i:i + 3], []).append(round(float(downs[i + 2] - downs[i]), 1))
+    return data
+
+def make_population(n_users, rng):
+    digraph_base = 150 * rng.lognormal(0, 0.25, (len(KEYS), len(KEYS)))
+    return [SyntheticTypist(f'typist{i:06d}', rng, digraph_base) for i in range(n_users)]
+
+def write_population(data_dir, typists, n_samples, rng, events=False):
+    """Enroll every typist with n_samples samples, as typing_game profiles"""
+    for typist in typists:
+        samples = [typist.sample(rng, TEXTS[rng.integers(len(TEXTS))], events) for _ in range(n_samples)]
+        with open(os.path.join(data_dir, f'{typist.name}.json'), 'w') as f:
+            json.dump({'username': typist.name, 'samples': samples}, f)
+
+# ===== MEASUREMENTS =====
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def peak_mb(fn):
+    """Peak traced Python/NumPy allocation while fn runs, in MB"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def load_indexes():
+    identify_module.load_statistical_index()
+    identify_module.load_ngram_index()
+    identify_module.load_statistical_candidates()
+    identify_module.load_ngram_candidates()
+
+def fresh_store(data_dir):
+    store = identify_module.ProfileStore(data_dir)
+    identify_module.PROFILE_STORE = store
+    store.refresh(force=True)
+    return store
+
+def identify_latencies(method, queries):
+    latencies = []
+    results = []
+    for _, sample in queries:
+        start = time.perf_counter()
+        results.append(identify_module.identify_samples([sample], method)[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), results
+
+def measure_method(method, queries, memory_queries):
+    # Scoring cost is measured with an empty result cache, then the same
+    # queries again to time cache hits
+    identify_module.RESULT_CACHE.clear()
+    latencies, results = identify_latencies(method, queries)
+    cached, _ = identify_latencies(method, queries)
+    correct = sum(result.get('user') == name for (name, _), result in zip(queries, results))
+    identify_module.RESULT_CACHE.clear()
+    return {
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+        'mean_ms': round(float(latencies.mean()), 4),
+        'cached_p50_ms': round(float(np.percentile(cached, 50)), 4),
+        'accuracy': round(correct / len(queries), 4),
+        'peak_mb': round(peak_mb(lambda: [identify_module.identify_samples([s], method)
+                                          for _, s in memory_queries]), 3)
+    }
+
+def benchmark_population(n_users, args):
+    rng = np.random.default_rng([args.seed, n_users])
+    original = identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY
+    original_classifier = identify_module.ML_CLASSIFIER
+    with tempfile.TemporaryDirectory() as root:
+        data_dir = os.path.join(root, 'data')
+        os.makedirs(data_dir)
+        identify_module.MODEL_REGISTRY = identify_module.ModelRegistry(os.path.join(root, 'models'))
+        try:
+            typists = make_population(n_users, rng)
+            generate_s = timed(lambda: write_population(data_dir, typists, args.samples, rng, args.events))
+
+            load_s = timed(lambda: fresh_store(data_dir))
+            index_s = timed(load_indexes)
+            load_peak = peak_mb(lambda: (fresh_store(data_dir), load_indexes()))
+
+            queries = []
+            for _ in range(args.requests):
+                typist = typists[rng.integers(len(typists))]
+                queries.append((typist.name, typist.sample(rng, TEXTS[rng.integers(len(TEXTS))], args.events)))
+            memory_queries = queries[:max(1, len(queries) // 10)]
+
+            extraction_s = timed(lambda: [(identify_module.request_summary_vector(s),
+                                           identify_module.extract_ngram_features(s)) for _, s in queries])
+
+            result = {
+                'users': n_users,
+                'samples': n_users * args.samples,
+                'generate_s': round(generate_s, 4),
+                'profile_load_s': round(load_s, 4),
+                'index_build_s': round(index_s, 4),
+                'load_peak_mb': round(load_peak, 3),
+                'feature_extraction_us': round(extraction_s / len(queries) * 1e6, 2),
+                'candidates_active': identify_module.load_statistical_candidates() is not None,
+                'methods': {}
+            }
+
+            # The first classifier kind serves the ml and cascade methods;
+            # every further kind is retrained and reported as ml:<kind>
+            for i, kind in enumerate(args.ml_classifiers):
+                training = None
+                if n_users <= args.ml_max_users:
+                    identify_module.ML_CLASSIFIER = kind
+                    train_s = timed(identify_module.train_ml_models)
+                    training = identify_module.MODEL_REGISTRY.status()['training']
+                methods = METHODS if i == 0 else ('ml',)
+                for method in methods:
+                    if method == 'ml' and training is None:
+                        continue
+                    key = method if i == 0 or method != 'ml' else f'ml:{kind}'
+                    result['methods'][key] = measure_method(method, queries, memory_queries)
+                    if method == 'ml':
+                        result['methods'][key].update(
+                            classifier=kind, train_s=round(train_s, 4), fit_s=training['fit_s'],
+                            held_out_accuracy=training['ensemble_accuracy'])
+            return result
+        finally:
+            identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY = original
+            identify_module.ML_CLASSIFIER = original_classifier
+
+# ===== REPORTING =====
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def metric_rows(results):
+    """Yield ((users, method), metric, value) for every comparable number"""
+    for result in results['results']:
+        for metric, value in result.items():
+            if metric in COMPARED_METRICS:
+                yield (result['users'], None), metric, value
+        for method, stats in result['methods'].items():
+            for metric, value in stats.items():
+                if metric in COMPARED_METRICS and value is not None:
+                    yield (result['users'], method), metric, value
+
+def compare(results, baseline, tolerance):
+    """Print changes against a baseline run; returns the regressions found"""
+    base = {(key, metric): value for key, metric, value in metric_rows(baseline)}
+    regressions = []
+    print(f"\n📊 Compared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for key, metric, value in metric_rows(results):
+        old = base.get((key, metric))
+        if old is None:
+            continue
+        if COMPARED_METRICS[metric]:
+            worse = value < old - tolerance
+            change = f'{value - old:+.3f}'
+        else:
+            # Ignore noise on timings too small to measure reliably
+            worse = old > 0 and value > old * (1 + tolerance) and value - old > 1e-3
+            change = f'{(value / old - 1) * 100:+.1f}%' if old else 'n/a'
+        users, method = key
+        label = f"{users:>7} {method or '-':<12} {metric:<22}"
+        print(f"  {label} {old:>12.4f} -> {value:>12.4f} {change:>9} {'❌' if worse else ''}")
+        if worse:
+            regressions.append((key, metric, old, value))
+    return regressions
+
+def print_summary(result):
+    print(f"\n👥 {result['users']} users, {result['samples']} samples")
+    print(f"  load {result['profile_load_s']:.3f}s, indexes {result['index_build_s']:.3f}s, "
+          f"peak {result['load_peak_mb']:.1f} MB, extraction {result['feature_extraction_us']:.1f} µs/sample"
+          f"{', candidate index active' if result['candidates_active'] else ''}")
+    for method, stats in result['methods'].items():
+        train = (f", {stats['classifier']} trained in {stats['train_s']:.2f}s, "
+                 f"held-out {stats['held_out_accuracy']*100:.1f}%") if 'train_s' in stats else ''
+        print(f"  {method:<12} p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms  "
+              f"cached {stats['cached_p50_ms']:6.3f} ms  accuracy {stats['accuracy']*100:5.1f}%  peak {stats['peak_mb']:.1f} MB{train}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='population sizes to benchmark (up to 100000)')
+    parser.add_argument('--samples', type=int, default=5, help='enrolled samples per user')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per method')
+    parser.add_argument('--ml-max-users', type=int, default=2000,
+                        help='largest population the ML models are trained for')
+    parser.add_argument('--ml-classifiers', nargs='+', default=[identify_module.ML_CLASSIFIER],
+                        choices=['svc', 'sgd', 'linear', 'rff'],
+                        help='ML classifier kinds to train and compare (first one serves cascade)')
+    parser.add_argument('--events', action='store_true', help='include raw keystroke events in samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown (or accuracy drop) counted as a regression')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'created': identify_module.utc_now(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'ml_classifiers': args.ml_classifiers,
+            'args': vars(args)
+        },
+        'results': []
+    }
+    print("⏱️  Benchmarking the typing identification methods")
+    for n_users in args.users:
+        result = benchmark_population(n_users, args)
+        results['results'].append(result)
+        print_summary(result)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\n🎉 No regressions")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Code shared by typing_game and identify_app"""
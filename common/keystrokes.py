@@ -0,0 +1,113 @@
+"""Key codes and the application/x-keystrokes upload format.
+
+Both apps and the JS clients send a sample's key events as:
+
+  b'KST1'     magic
+  uint32      length of the JSON header
+  header      UTF-8 JSON object: the sample's other fields (username,
+              text, method, inputHistory, ...) and "event_count", the n
+              below
+  uint32[n]   time since the previous key event, in 0.1 ms
+  uint16[n]   key code: lowercased code point below WIRE_NAMED_BASE, or
+              WIRE_NAMED_BASE + the key's index in NAMED_KEYS
+  uint8[n]    1 for key down, 0 for key up
+
+Integers are little-endian. The event columns decode straight into the
+timing_arrays of a sample, and hold, flight and down-down times are
+derived from them, so clients send each key event once instead of as
+several JSON lists.
+"""
+
+import json
+import numpy as np
+
+# Non-character keys get codes above the Unicode range. The JS clients
+# list them in the same order.
+NAMED_KEYS = ('Shift', 'Backspace', 'Enter', 'Tab', 'Control', 'Alt', 'Meta',
+              'CapsLock', 'Escape', 'ArrowLeft', 'ArrowRight', 'ArrowUp', 'ArrowDown',
+              'Delete', 'Home', 'End')
+NAMED_KEY_BASE = 0x110000
+NAMED_KEY_CODES = {name.lower(): NAMED_KEY_BASE + i for i, name in enumerate(NAMED_KEYS)}
+
+KEYSTROKES_MIMETYPE = 'application/x-keystrokes'
+KEYSTROKES_MAGIC = b'KST1'
+WIRE_NAMED_BASE = 0xF000
+
+def encode_key(key):
+    """Integer code of a KeyboardEvent.key: lowercased code point, or a named key"""
+    if len(key) == 1:
+        return ord(key.lower())
+    # keystroke_sequence holds lowercased key names
+    return NAMED_KEY_CODES.get(key.lower(), 0)  # 0: unknown named key
+
+def decode_key(code):
+    code = int(code)
+    if code >= NAMED_KEY_BASE:
+        return NAMED_KEYS[code - NAMED_KEY_BASE]
+    return chr(code) if code else ''
+
+def wire_key_code(key):
+    """uint16 key code of a KeyboardEvent.key in the upload format"""
+    code = encode_key(key)
+    if code >= NAMED_KEY_BASE:
+        return code - NAMED_KEY_BASE + WIRE_NAMED_BASE
+    return code if code < WIRE_NAMED_BASE else 0
+
+def event_timing_features(times, keys, down):
+    """(hold, flight, down-down) times of key events, measured like the clients do
+
+    A key up pairs with the latest earlier key down of the same key; the
+    flight time runs from the previous paired key up to this key's down.
+    """
+    down = np.asarray(down, dtype=bool)
+    dd = np.diff(times[down])
+    # Group events by key, in time order within each key, and carry the
+    # position of the latest key down forward
+    order = np.lexsort((np.arange(len(keys)), keys))
+    grouped_keys = keys[order]
+    latest = np.maximum.accumulate(np.where(down[order], np.arange(len(order)), -1))
+    paired = ~down[order] & (latest >= 0)
+    paired &= grouped_keys[np.maximum(latest, 0)] == grouped_keys
+    ups, downs = order[paired], order[latest[paired]]
+    by_time = np.argsort(ups)
+    ups, downs = ups[by_time], downs[by_time]
+    hold = times[ups] - times[downs]
+    flight = times[downs[1:]] - times[ups[:-1]]
+    return hold, flight, dd
+
+def decode_keystrokes(body):
+    """Decode an upload into a sample dict with NumPy timing arrays
+
+    Raises ValueError for a malformed body.
+    """
+    if len(body) < 8 or body[:4] != KEYSTROKES_MAGIC:
+        raise ValueError('missing KST1 header')
+    start = 8 + int.from_bytes(body[4:8], 'little')
+    header = json.loads(body[8:start])
+    if not isinstance(header, dict):
+        raise ValueError('header is not a JSON object')
+    n = header.pop('event_count', None)
+    if not isinstance(n, int) or n < 0 or len(body) != start + 7 * n:
+        raise ValueError('event columns do not match event_count')
+
+    times = np.cumsum(np.frombuffer(body, '<u4', n, start), dtype=float) / 10
+    keys = np.frombuffer(body, '<u2', n, start + 4 * n).astype(np.uint32)
+    down = np.frombuffer(body, np.uint8, n, start + 6 * n)
+    named = keys >= WIRE_NAMED_BASE
+    index = keys[named] - WIRE_NAMED_BASE
+    keys[named] = np.where(index < len(NAMED_KEYS), NAMED_KEY_BASE + index, 0)
+    # Times are whole 0.1 ms; rounding drops the float noise of subtracting them
+    hold, flight, dd = (np.round(t, 1) for t in event_timing_features(times, keys, down))
+    header.update(hold_times=hold, flight_times=flight, down_down_times=dd,
+                  timing_arrays={'time': times, 'key': keys, 'down': down})
+    return header
+
+def encode_keystrokes(fields, events):
+    """Pack key events and scalar fields into an upload, as the JS clients do"""
+    header = json.dumps(dict(fields, event_count=len(events))).encode('utf-8')
+    times = np.round(np.array([e['time'] for e in events], dtype=float) * 10).astype(np.int64)
+    deltas = np.diff(np.maximum.accumulate(times), prepend=times[:1])
+    keys = np.array([wire_key_code(e['key']) for e in events], dtype='<u2')
+    down = np.array([e['type'] == 'down' for e in events], dtype=np.uint8)
+    return (KEYSTROKES_MAGIC + len(header).to_bytes(4, 'little') + header
+            + deltas.astype('<u4').tobytes() + keys.tobytes() + down.tobytes())
@@ -0,0 +1,128 @@
+"""Prometheus metrics and request timing shared by both apps.
+
+Request and per-stage latencies are kept in process memory and served in
+the Prometheus text format at /metrics. Stages are timed with
+Metrics.timed_stage(); within a request they are also collected for the
+optional Server-Timing header.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from flask import request, g, has_request_context
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """Thread-safe counters and latency histograms in Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., sum, count]
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def reset_lock(self):
+        """Replace the lock, in a process forked while another thread may have held it"""
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def record_stage(self, name, stage, seconds, **labels):
+        """Observe a stage's duration in histogram name and in Server-Timing"""
+        self.observe(name, seconds, stage=stage, **labels)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timed_stage(self, name, stage, **labels):
+        """Time a block as one stage, see record_stage()"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, stage, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self, gauges=()):
+        """Prometheus exposition text; gauges are (name, help, value) tuples"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(series)) for key, series in self.histograms.items())
+        described = set()
+
+        def header(name, kind, text):
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter', self.help.get(name, name))
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for (name, labels), series in histograms:
+            header(name, 'histogram', self.help.get(name, name))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{name}_sum{self._labels(labels)} {series[-2]}')
+            lines.append(f'{name}_count{self._labels(labels)} {series[-1]}')
+        for name, text, value in gauges:
+            header(name, 'gauge', text)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+def instrument_app(app, metrics, server_timing=lambda: False):
+    """Count and time every request of a Flask app.
+
+    server_timing is called per response, so the app's setting can change
+    at runtime; when it returns true the response gets a Server-Timing
+    header with the request's stage durations.
+    """
+    metrics.describe('http_requests_total', 'HTTP requests by endpoint and status')
+    metrics.describe('http_request_duration_seconds', 'HTTP request latency by endpoint')
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+        endpoint = request.endpoint or 'unknown'
+        metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+        if server_timing():
+            entries = [f'{stage};dur={seconds * 1000:.3f}'
+                       for stage, seconds in g.get('stage_timings', {}).items()]
+            entries.append(f'total;dur={elapsed * 1000:.3f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response
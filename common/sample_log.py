@@ -0,0 +1,44 @@
+"""Reading the append-only sample logs typing_game writes.
+
+Every user has a compacted profile, <user>.json, and an append-only log of
+newer samples, <user>.jsonl, holding one JSON sample per line. The
+profile's "compacted_log" records the inode and size of the log it has
+already absorbed; those bytes must be skipped when reading the log.
+"""
+
+import json
+import os
+
+def valid_username(username):
+    """Whether a client-supplied username is safe to use as a file name
+
+    Usernames name files in the data directory, so they must be a plain
+    file name that is not hidden and cannot step out of the directory.
+    """
+    return (isinstance(username, str) and bool(username) and not username.startswith('.')
+            and os.path.basename(username) == username)
+
+def compacted_log_offset(profile, log_stat):
+    """Bytes at the start of the log that the profile already contains"""
+    compacted = (profile or {}).get('compacted_log') or {}
+    if compacted.get('inode') == log_stat.st_ino:
+        return compacted.get('size', 0)
+    return 0
+
+def read_log_samples(path, offset):
+    """Parse the complete lines of a sample log from offset on.
+
+    Returns the samples and the offset just past the last complete line, so
+    a line still being written is picked up by the next call.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b'\n') + 1
+    samples = []
+    for line in chunk[:end].splitlines():
+        try:
+            samples.append(json.loads(line))
+        except ValueError:
+            continue  # torn line from a crashed writer
+    return samples, offset + end
@@ -1,16 +1,40 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, request, render_template, jsonify
 from flask_cors import CORS
 import os
+import sys
 import json
+import threading
+import time
+import queue
+import uuid
+import traceback
+import copy
+import hashlib
+import shutil
+import signal
+import socket
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+from collections import namedtuple, Counter, OrderedDict
+import importlib
 import numpy as np
-from scipy.spatial import distance
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.svm import SVC
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
 import pickle
-from werkzeug.datastructures import ContentSecurityPolicy
+from contextlib import contextmanager
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows: serve mode, which needs it, is unavailable anyway
+    fcntl = None
+
+# common/ at the repository root holds the code shared with typing_game
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.metrics import Metrics, instrument_app
+from common.sample_log import compacted_log_offset, read_log_samples, valid_username
+from common.keystrokes import NAMED_KEY_CODES, KEYSTROKES_MIMETYPE, encode_key, decode_keystrokes
 
 app = Flask(__name__)
 CORS(app)
@@ -20,377 +44,3461 @@ MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
 if not os.path.exists(MODELS_DIR):
     os.makedirs(MODELS_DIR)
 
+# Minimum seconds between two directory scans of the profile store
+PROFILE_REFRESH_INTERVAL = 1.0
+
+# Samples per chunk of a batch identification, and the largest temporary
+# array the statistical (samples x users x features) comparison may build
+BATCH_CHUNK_SIZE = 256
+BROADCAST_MAX_ELEMENTS = 1 << 22
+
+# Seconds of inactivity after which a streaming session is dropped, and
+# the most often stream requests look for such sessions
+STREAM_SESSION_TTL = 300
+STREAM_EXPIRY_INTERVAL = 10.0
+
+# Candidate generation: with at least CANDIDATE_MIN_USERS profiles, only the
+# CANDIDATE_K nearest profiles are scored exactly. CANDIDATE_INDEX is
+# 'kdtree', 'ivf' or 'auto' (KD-tree for low-dimensional vectors, IVF
+# otherwise); CANDIDATE_N_PROBE is the number of IVF lists searched.
+CANDIDATE_INDEX = os.environ.get('CANDIDATE_INDEX', 'auto')
+CANDIDATE_MIN_USERS = int(os.environ.get('CANDIDATE_MIN_USERS', 5000))
+CANDIDATE_K = int(os.environ.get('CANDIDATE_K', 200))
+CANDIDATE_N_PROBE = int(os.environ.get('CANDIDATE_N_PROBE', 16))
+
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+# Expose the sampling profiler at /debug/profile/start and /stop
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+
+# `python app.py serve`: number of pre-forked worker processes, their
+# address (also that of the plain `python app.py` server), and the tmpfs
+# directory the coordinator publishes profile generations to (the system
+# temp directory where /dev/shm is missing)
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1))
+SERVE_HOST = os.environ.get('SERVE_HOST', '127.0.0.1')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', 8001))
+SERVE_SHM_DIR = os.environ.get('SERVE_SHM_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# Comma-separated methods whose dependencies are imported at startup
+# rather than by their first request, e.g. 'ngram,ml'
+PREWARM_METHODS = [m for m in os.environ.get('PREWARM_METHODS', '').split(',') if m]
+
+# /verify: default acceptance thresholds per method, and a JSON file of
+# per-user overrides, {"username": {"method": threshold}}
+VERIFY_THRESHOLDS = {'statistical': 0.7, 'ngram': 0.6, 'ml': 0.5}
+VERIFY_THRESHOLDS_FILE = os.environ.get(
+    'VERIFY_THRESHOLDS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'verify_thresholds.json'))
+
+# Identification result cache: at most RESULT_CACHE_SIZE results, each
+# kept for RESULT_CACHE_TTL seconds (a size of 0 disables the cache)
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 10000))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 300))
+
+# Second classifier of the ML ensemble: 'svc' (batch RBF SVM), 'sgd'
+# (online linear), or one of the fast modes for large populations:
+# 'linear' (one-vs-rest logistic regression) and 'rff' (random Fourier
+# features approximating the SVM's RBF kernel, with an online linear model)
+ML_CLASSIFIER = os.environ.get('ML_CLASSIFIER', 'svc')
+# Random features used by the 'rff' classifier
+ML_RFF_COMPONENTS = int(os.environ.get('ML_RFF_COMPONENTS', 1024))
+# Cores used to fit the 'sgd', 'linear' and 'rff' classifiers (-1 = all)
+ML_N_JOBS = int(os.environ.get('ML_N_JOBS', -1))
+# Seconds after which incremental ML updates give way to a full retrain
+ML_FULL_RETRAIN_INTERVAL = float(os.environ.get('ML_FULL_RETRAIN_INTERVAL', 24 * 3600))
+
 @app.route('/')
 def index():
     return render_template('identify.html')
 
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+# ===== METHOD REGISTRY =====
+# scipy and scikit-learn are imported the first time a method that needs
+# them runs, not when the app starts, so a process serving only the
+# statistical method never loads them. Code reaches them through lazy
+# module proxies (``sparse.csr_matrix``, ``svm.SVC``). The candidate
+# indexes additionally load sklearn.neighbors once a population reaches
+# CANDIDATE_MIN_USERS.
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    @property
+    def loaded(self):
+        return self.module is not None
+
+    def load(self):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+sparse = LazyModule('scipy.sparse')
+neighbors = LazyModule('sklearn.neighbors')
+svm = LazyModule('sklearn.svm')
+linear_model = LazyModule('sklearn.linear_model')
+preprocessing = LazyModule('sklearn.preprocessing')
+feature_extraction = LazyModule('sklearn.feature_extraction')
+model_selection = LazyModule('sklearn.model_selection')
+kernel_approximation = LazyModule('sklearn.kernel_approximation')
+pipeline = LazyModule('sklearn.pipeline')
+multiclass = LazyModule('sklearn.multiclass')
+
+ML_MODULES = (sparse, neighbors, svm, linear_model, preprocessing, feature_extraction,
+              model_selection, kernel_approximation, pipeline, multiclass)
+# method -> modules it needs beyond numpy
+METHOD_MODULES = {
+    'statistical': (),
+    'ngram': (sparse,),
+    'ml': ML_MODULES,
+    'cascade': ML_MODULES,
+}
+
+def method_loaded(method):
+    return all(module.loaded for module in METHOD_MODULES[method])
+
+def load_method(method):
+    """Import everything a method needs"""
+    for module in METHOD_MODULES[method]:
+        module.load()
+
+def prewarm_methods(methods=None):
+    """Load the PREWARM_METHODS (or the given methods) ahead of their first request"""
+    for method in (PREWARM_METHODS if methods is None else methods):
+        if method not in METHOD_MODULES:
+            raise ValueError(f'Unknown method to prewarm: {method}')
+        load_method(method)
+
+# ===== METRICS =====
+# Metrics, stage timing and the request hooks are shared with typing_game
+# (see common/metrics.py); stages here are labelled with their method.
+METRICS = Metrics()
+METRICS.describe('identify_stage_duration_seconds',
+                 'Time spent in each identification stage, by method')
+METRICS.describe('identify_results_total', 'Identification results by method and outcome')
+METRICS.describe('identify_verify_total', 'Verification decisions by method and outcome')
+METRICS.describe('identify_cache_requests_total', 'Result cache lookups by method and result')
+METRICS.describe('identify_cache_evictions_total', 'Result cache entries dropped, by reason')
+instrument_app(app, METRICS, server_timing=lambda: SERVER_TIMING)
+
+def timed_stage(stage, method=''):
+    """Time a block as one stage of a method, for /metrics and Server-Timing"""
+    return METRICS.timed_stage('identify_stage_duration_seconds', stage, method=method)
+
+def record_stage(stage, seconds, method=''):
+    METRICS.record_stage('identify_stage_duration_seconds', stage, seconds, method=method)
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads at a fixed interval.
+
+    ``stop()`` returns the samples as collapsed stacks, one
+    ``frame;frame;... count`` line per distinct stack, the input format of
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return False
+        self.stacks = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = [f'{f.name} ({os.path.basename(f.filename)}:{f.lineno})'
+                         for f in traceback.extract_stack(frame)]
+                self.stacks[';'.join(stack)] += 1
+
+    def stop(self):
+        if self._thread is None:
+            return ''
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+PROFILER = SamplingProfiler()
+
+# ===== PROFILE STORE =====
+# typing_game keeps a compacted profile, <user>.json, plus an append-only
+# log of newer samples, <user>.jsonl, with one JSON sample per line. The
+# profile's "compacted_log" records the inode and size of the log it has
+# already absorbed; those bytes must be skipped when reading the log
+# (see common/sample_log.py).
+
+def file_stamp(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size) if st is not None else None
+
+class SufficientStats:
+    """Count, sum and sum of squares of a fixed-length feature vector.
+
+    Enough to recover each feature's mean and (population) std. Adding an
+    observation costs O(features) whatever the number already seen, and
+    two sets of observations merge by adding their statistics.
+    """
+
+    __slots__ = ('count', 'total', 'total_sq')
+
+    def __init__(self, size):
+        self.count = 0
+        self.total = np.zeros(size)
+        self.total_sq = np.zeros(size)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        stats = cls(rows.shape[1])
+        stats.count = rows.shape[0]
+        stats.total = rows.sum(axis=0)
+        stats.total_sq = np.square(rows).sum(axis=0)
+        return stats
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        self.total += values
+        self.total_sq += values * values
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        return self
+
+    def copy(self):
+        stats = SufficientStats(len(self.total))
+        stats.merge(self)
+        return stats
+
+    @property
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+    @property
+    def std(self):
+        mean = self.mean
+        return np.sqrt(np.maximum(self.total_sq / max(self.count, 1) - mean * mean, 0))
+
+class UserProfile:
+    """Sufficient statistics of all of one user's samples.
+
+    ``summary`` covers the six statistical summary features and
+    ``ngrams`` maps each n-gram (e.g. 'digraph_th') to statistics of the
+    per-sample [mean, std] of its timings. Memory grows with the user's
+    n-gram vocabulary, not with the number of samples.
+    """
+
+    __slots__ = ('summary', 'ngrams', 'ngram_samples')
+
+    def __init__(self):
+        self.summary = SufficientStats(6)
+        self.ngrams = {}
+        self.ngram_samples = 0  # samples with any n-gram features
+
+    def add_sample(self, sample):
+        self.add_samples([sample])
+
+    def add_samples(self, samples, ngram_features=None):
+        """Fold samples in; ngram_features are their already extracted features"""
+        for sample in samples:
+            hold = sample.get('hold_times')
+            flight = sample.get('flight_times')
+            dd = sample.get('down_down_times')
+            if all(values is not None and len(values) for values in (hold, flight, dd)):
+                self.summary.add(summary_vector({
+                    'hold': np.asarray(hold),
+                    'flight': np.asarray(flight),
+                    'dd': np.asarray(dd)
+                }))
+        if ngram_features is None:
+            ngram_features = extract_ngram_features_bulk(samples)
+        for features in ngram_features:
+            self.add_ngram_features(features)
+
+    def add_ngram_features(self, features):
+        if not features:
+            return
+        for key, value in features.items():
+            name, stat = key.rsplit('_', 1)
+            if stat == 'mean':
+                stats = self.ngrams.get(name)
+                if stats is None:
+                    stats = self.ngrams[name] = SufficientStats(2)
+                stats.add((value, features.get(f'{name}_std', 0.0)))
+        self.ngram_samples += 1
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        for name, stats in other.ngrams.items():
+            if name in self.ngrams:
+                self.ngrams[name].merge(stats)
+            else:
+                self.ngrams[name] = stats.copy()
+        self.ngram_samples += other.ngram_samples
+        return self
+
+    def copy(self):
+        return UserProfile().merge(self)
+
+class UserFileCache:
+    """Per-user state kept in step with the user files in a data directory.
+
+    ``refresh()`` only stats the directory: a log that grew in place is
+    read from where the last read stopped, and only users whose files
+    changed otherwise are re-parsed. Subclasses decide what an entry holds:
+    ``_new_entry()`` returns their fields, ``_add_samples()`` folds parsed
+    samples in and ``_extend_entry()`` returns the entry appended log
+    samples are added to. ``version`` is bumped whenever any entry changes
+    and can be used as a cache key by anything derived from the entries.
+    """
+
+    def __init__(self, data_dir, refresh_interval=0.0):
+        self.data_dir = data_dir
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._entries = {}  # file stem -> parsed user entry
+        self._derived = {}  # name -> value built for the current version
+        self._last_refresh = None
+        self._columnar = None
+        self._columnar_stamp = None
+        self._lock = threading.RLock()
+
+    def _new_entry(self):
+        raise NotImplementedError
+
+    def _add_samples(self, entry, samples):
+        raise NotImplementedError
+
+    def _extend_entry(self, cached):
+        raise NotImplementedError
+
+    def refresh(self, force=False):
+        """Re-read changed user files and return the current version"""
+        with self._lock:
+            now = time.monotonic()
+            if (not force and self._last_refresh is not None
+                    and now - self._last_refresh < self.refresh_interval):
+                return self.version
+            self._last_refresh = now
+
+            files = {}  # stem -> {'json': stat, 'jsonl': stat}
+            try:
+                dir_entries = list(os.scandir(self.data_dir))
+            except FileNotFoundError:
+                dir_entries = []
+            for dir_entry in dir_entries:
+                stem, ext = os.path.splitext(dir_entry.name)
+                if ext not in ('.json', '.jsonl'):
+                    continue
+                try:
+                    files.setdefault(stem, {})[ext[1:]] = dir_entry.stat()
+                except FileNotFoundError:
+                    continue
+
+            changed = False
+            for stem, stats in files.items():
+                changed = self._update_user(stem, stats) or changed
+
+            for stem in set(self._entries) - set(files):
+                del self._entries[stem]
+                changed = True
+
+            if changed:
+                self.version += 1
+                self._derived.clear()
+            return self.version
+
+    def user_entry(self, stem):
+        """Return one user's entry, refreshing only that user's files.
+
+        Costs the same however many users there are; returns None if the
+        user has no readable profile or log.
+        """
+        with self._lock:
+            stats = {}
+            for ext in ('json', 'jsonl'):
+                try:
+                    stats[ext] = os.stat(os.path.join(self.data_dir, f'{stem}.{ext}'))
+                except FileNotFoundError:
+                    continue
+            if stats:
+                changed = self._update_user(stem, stats)
+            else:
+                changed = self._entries.pop(stem, None) is not None
+            if changed:
+                self.version += 1
+                self._derived.clear()
+            return self._entries.get(stem)
+
+    def _update_user(self, stem, stats):
+        """Bring a user's entry up to date with its file stats; True if it changed"""
+        profile_stamp = file_stamp(stats.get('json'))
+        log_stat = stats.get('jsonl')
+        cached = self._entries.get(stem)
+        if cached is not None and cached['profile_stamp'] == profile_stamp:
+            if cached['log_stamp'] == file_stamp(log_stat):
+                return False
+            if (log_stat is not None and cached['log_inode'] == log_stat.st_ino
+                    and log_stat.st_size >= cached['log_offset']):
+                entry = self._append_log(cached, stem, log_stat)
+            else:
+                entry = self._load_user(stem, stats)
+        else:
+            entry = self._load_user(stem, stats)
+        if entry is None:
+            # Unreadable file: keep the previous entry and retry next time
+            return False
+        self._entries[stem] = entry
+        return (cached is None or entry['samples_seen'] != cached['samples_seen']
+                or entry['profile_stamp'] != cached['profile_stamp'])
+
+    def _load_user(self, stem, stats):
+        profile_stamp = file_stamp(stats.get('json'))
+        log_stat = stats.get('jsonl')
+        entry = dict(self._new_entry(),
+                     username=stem,
+                     samples_seen=0,
+                     profile_stamp=profile_stamp,
+                     log_stamp=None,
+                     log_inode=log_stat.st_ino if log_stat is not None else None,
+                     log_offset=0)
+
+        columnar = self._columnar_store()
+        if columnar is not None and columnar.covers(stem, profile_stamp, log_stat):
+            # Timing arrays come straight from the memory-mapped snapshot
+            entry['username'] = columnar.username(stem)
+            entry['log_offset'] = columnar.log_offset(stem)
+            self._read_samples(entry, columnar.user_samples(stem))
+            if log_stat is not None:
+                return self._append_log(entry, stem, log_stat)
+            return entry
+
+        try:
+            username, samples, source = read_user_files(self.data_dir, stem)
+        except (OSError, ValueError):
+            return None
+        entry.update(username=username,
+                     profile_stamp=tuple(source['profile_stamp']) if source['profile_stamp'] else None,
+                     log_stamp=file_stamp(log_stat),
+                     log_inode=source['log_inode'],
+                     log_offset=source['log_offset'])
+        self._read_samples(entry, samples)
+        return entry
+
+    def _columnar_store(self):
+        """The columnar snapshot in <data_dir>/timings, reopened when rebuilt"""
+        manifest = os.path.join(self.data_dir, COLUMNAR_DIRNAME, 'manifest.json')
+        try:
+            stamp = file_stamp(os.stat(manifest))
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._columnar_stamp:
+            self._columnar_stamp = stamp
+            self._columnar = None
+            if stamp is not None:
+                try:
+                    self._columnar = ColumnarStore(os.path.dirname(manifest))
+                except (OSError, ValueError, KeyError):
+                    self._columnar = None
+        return self._columnar
+
+    def _append_log(self, cached, stem, log_stat):
+        try:
+            samples, offset = read_log_samples(
+                os.path.join(self.data_dir, stem + '.jsonl'), cached['log_offset'])
+        except OSError:
+            return None
+        entry = self._extend_entry(cached)
+        entry.update(log_stamp=file_stamp(log_stat), log_offset=offset)
+        self._read_samples(entry, samples)
+        return entry
+
+    def _read_samples(self, entry, samples):
+        self._add_samples(entry, samples)
+        entry['samples_seen'] += len(samples)
+
+    def users(self):
+        """Refresh and return the usernames in file name order"""
+        return [entry['username'] for entry in self.entries()]
+
+    def entries(self):
+        """Refresh and return the parsed user entries in file name order"""
+        with self._lock:
+            self.refresh()
+            return [self._entries[stem] for stem in sorted(self._entries)]
+
+    def derived(self, name, builder):
+        """Return ``builder(entries)``, memoized until the entries change"""
+        with self._lock:
+            entries = self.entries()
+            if name not in self._derived:
+                self._derived[name] = builder(entries)
+            return self._derived[name]
+
+class ProfileStore(UserFileCache):
+    """In-memory cache of the user profiles in a data directory.
+
+    Every user's profile and sample log are parsed once and folded into a
+    UserProfile of sufficient statistics, so repeated requests cost no JSON
+    parsing and memory grows with users × n-gram vocabulary, not with the
+    number of samples. The per-sample rows ML training needs are kept by
+    TrainingRows instead.
+    """
+
+    def _new_entry(self):
+        return {'profile': UserProfile()}
+
+    def _add_samples(self, entry, samples):
+        entry['profile'].add_samples(samples)
+
+    def _extend_entry(self, cached):
+        # Copy rather than update in place: indexes built from the cached
+        # profile may still be in use
+        return dict(cached, profile=cached['profile'].copy())
+
+# ===== COLUMNAR TIMING STORE =====
+# A read-only snapshot of every user's timing arrays, built by
+# build_columnar_store() into <data_dir>/timings/:
+#
+#   <field>.<dtype> all samples' values of one field, contiguous (timings
+#                   are float32, event key codes uint32, down flags uint8)
+#   <group>.idx     int64 offsets; sample i is values[idx[i]:idx[i+1]]
+#   manifest.json   users, their sample rows and the source file stamps,
+#                   plus per-sample text and n-gram maps
+#
+# Columns are opened with numpy.memmap, so loading profiles is zero-copy
+# and every worker process shares the same page cache. Users whose JSON
+# profile or log changed since the snapshot are read from JSON as before;
+# log lines appended after the snapshot are read from the log.
+
+COLUMNAR_DIRNAME = 'timings'
+# column name -> (dtype, offsets group)
+COLUMNAR_FIELDS = {
+    'hold_times': ('float32', 'hold_times'),
+    'flight_times': ('float32', 'flight_times'),
+    'down_down_times': ('float32', 'down_down_times'),
+    'timing_time': ('float32', 'timings'),
+    'timing_key': ('uint32', 'timings'),
+    'timing_down': ('uint8', 'timings'),
+}
+# Non-character keys get codes above the Unicode range, see common/keystrokes.py
+# Keys pressed alongside letters; they never interrupt an n-gram
+MODIFIER_CODES = np.array([NAMED_KEY_CODES[name] for name in ('shift', 'control', 'alt', 'meta', 'capslock')])
+
+def valid_key_event(event):
+    """True for a raw key event with a string key and a finite numeric time"""
+    if not isinstance(event, dict) or not isinstance(event.get('key'), str):
+        return False
+    t = event.get('time')
+    return isinstance(t, (int, float)) and not isinstance(t, bool) and np.isfinite(t)
+
+def keystroke_arrays(sample):
+    """(times, key codes, down flags) of a sample's raw key events, or None"""
+    arrays = sample.get('timing_arrays')
+    if arrays is not None and len(arrays['time']):
+        return arrays['time'], arrays['key'], arrays['down']
+    events = sample.get('timings') or sample.get('keystroke_sequence')
+    if not isinstance(events, list):
+        return None
+    events = [e for e in events if valid_key_event(e)]
+    if not events:
+        return None
+    return (np.array([e['time'] for e in events], dtype=float),
+            np.array([encode_key(e['key']) for e in events], dtype=np.uint32),
+            np.array([e.get('type') == 'down' for e in events], dtype=np.uint8))
+
+def open_column(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)  # mmap cannot map empty files
+    return np.memmap(path, dtype=dtype, mode='r')
+
+class ColumnarStore:
+    """Memory-mapped view of a columnar timing snapshot"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        self.users = {user['stem']: user for user in self.manifest['users']}
+        self.columns = {name: open_column(os.path.join(path, f'{name}.{dtype}'), dtype)
+                        for name, (dtype, _) in COLUMNAR_FIELDS.items()}
+        groups = {group for _, group in COLUMNAR_FIELDS.values()}
+        self.offsets = {group: open_column(os.path.join(path, f'{group}.idx'), 'int64')
+                        for group in groups}
+
+    def covers(self, stem, profile_stamp, log_stat):
+        """True if the snapshot holds the user's current profile and log prefix"""
+        user = self.users.get(stem)
+        if user is None or user['profile_stamp'] != (list(profile_stamp) if profile_stamp else None):
+            return False
+        if log_stat is None:
+            return user['log_inode'] is None
+        return user['log_inode'] == log_stat.st_ino and log_stat.st_size >= user['log_offset']
+
+    def username(self, stem):
+        return self.users[stem]['username']
+
+    def log_offset(self, stem):
+        return self.users[stem]['log_offset']
+
+    def column(self, name, row):
+        group = COLUMNAR_FIELDS[name][1]
+        idx = self.offsets[group]
+        return self.columns[name][idx[row]:idx[row + 1]]
+
+    def user_samples(self, stem):
+        """The user's samples, with timing fields as zero-copy array views"""
+        user = self.users[stem]
+        samples = []
+        for row in range(user['first'], user['first'] + user['count']):
+            meta = self.manifest['samples'][row]
+            samples.append({
+                'text': meta['text'],
+                'ngram_data': meta['ngram_data'],
+                'hold_times': self.column('hold_times', row),
+                'flight_times': self.column('flight_times', row),
+                'down_down_times': self.column('down_down_times', row),
+                'timing_arrays': {
+                    'time': self.column('timing_time', row),
+                    'key': self.column('timing_key', row),
+                    'down': self.column('timing_down', row)
+                }
+            })
+        return samples
+
+def read_user_files(data_dir, stem):
+    """Read a user's profile and log; returns (username, samples, source stamps)"""
+    json_path = os.path.join(data_dir, stem + '.json')
+    log_path = os.path.join(data_dir, stem + '.jsonl')
+    profile = None
+    profile_stamp = None
+    if os.path.exists(json_path):
+        profile_stamp = file_stamp(os.stat(json_path))
+        with open(json_path, 'r') as f:
+            profile = json.load(f)
+        if not isinstance(profile, dict) or 'username' not in profile:
+            raise ValueError(f'{json_path} is not a user profile')
+    samples = list(profile.get('samples', [])) if profile else []
+    log_inode, log_offset = None, 0
+    if os.path.exists(log_path):
+        log_stat = os.stat(log_path)
+        log_inode = log_stat.st_ino
+        log_samples, log_offset = read_log_samples(log_path, compacted_log_offset(profile, log_stat))
+        samples.extend(log_samples)
+    source = {'profile_stamp': list(profile_stamp) if profile_stamp else None,
+              'log_inode': log_inode, 'log_offset': log_offset}
+    return (profile['username'] if profile else stem), samples, source
+
+def build_columnar_store(data_dir=None):
+    """Convert every JSON profile and log in data_dir into a columnar snapshot"""
+    data_dir = data_dir or DATA_DIR
+    stems = sorted({os.path.splitext(f)[0] for f in os.listdir(data_dir)
+                    if f.endswith(('.json', '.jsonl'))})
+    columns = {name: [] for name in COLUMNAR_FIELDS}
+    lengths = {group: [] for _, group in COLUMNAR_FIELDS.values()}
+    manifest = {'format': 1, 'built_at': utc_now(), 'users': [], 'samples': []}
+
+    for stem in stems:
+        username, samples, source = read_user_files(data_dir, stem)
+        manifest['users'].append(dict(source, stem=stem, username=username,
+                                      first=len(manifest['samples']), count=len(samples)))
+        for sample in samples:
+            for field in ('hold_times', 'flight_times', 'down_down_times'):
+                values = sample.get(field) or []
+                columns[field].append(np.asarray(values, dtype=np.float32))
+                lengths[field].append(len(values))
+            times, keys, down = keystroke_arrays(sample) or ([], [], [])
+            columns['timing_time'].append(np.asarray(times, dtype=np.float32))
+            columns['timing_key'].append(np.asarray(keys, dtype=np.uint32))
+            columns['timing_down'].append(np.asarray(down, dtype=np.uint8))
+            lengths['timings'].append(len(times))
+            manifest['samples'].append({'text': sample.get('text') or '',
+                                        'ngram_data': sample.get('ngram_data') or {}})
+
+    out_dir = os.path.join(data_dir, COLUMNAR_DIRNAME)
+    tmp_dir = f'{out_dir}.tmp-{os.getpid()}'
+    os.makedirs(tmp_dir)
+    for name, (dtype, _) in COLUMNAR_FIELDS.items():
+        parts = columns[name] or [np.empty(0, dtype=dtype)]
+        np.concatenate(parts).astype(dtype).tofile(os.path.join(tmp_dir, f'{name}.{dtype}'))
+    for group, group_lengths in lengths.items():
+        offsets = np.zeros(len(group_lengths) + 1, dtype=np.int64)
+        np.cumsum(group_lengths, out=offsets[1:])
+        offsets.tofile(os.path.join(tmp_dir, f'{group}.idx'))
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    # Swap directories; processes with the old columns mapped keep reading them
+    old_dir = f'{out_dir}.old-{os.getpid()}'
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(manifest['samples'])
+
+PROFILE_STORE = ProfileStore(DATA_DIR, refresh_interval=PROFILE_REFRESH_INTERVAL)
+
 # ===== STATISTICAL METHOD (Original) =====
+# Per-user mean/std summary vectors stacked row-wise, users[i] owns row i
+StatisticalIndex = namedtuple('StatisticalIndex', ['users', 'means', 'stds'])
+
 def summary_vector(sample):
     # Returns [mean_hold, std_hold, mean_flight, std_flight, mean_dd, std_dd]
+    # Accumulate in float64 so float32 columnar timings give the same result
     return np.array([
-        np.mean(sample['hold']),
-        np.std(sample['hold']),
-        np.mean(sample['flight']),
-        np.std(sample['flight']),
-        np.mean(sample['dd']),
-        np.std(sample['dd'])
+        np.mean(sample['hold'], dtype=float),
+        np.std(sample['hold'], dtype=float),
+        np.mean(sample['flight'], dtype=float),
+        np.std(sample['flight'], dtype=float),
+        np.mean(sample['dd'], dtype=float),
+        np.std(sample['dd'], dtype=float)
     ])
 
-def load_profiles_statistical():
-    profiles = {}
-    for fname in os.listdir(DATA_DIR):
-        if fname.endswith('.json'):
-            with open(os.path.join(DATA_DIR, fname), 'r') as f:
-                data = json.load(f)
-                summary_vecs = []
-                for sample in data.get('samples', []):
-                    hold = sample.get('hold_times', [])
-                    flight = sample.get('flight_times', [])
-                    dd = sample.get('down_down_times', [])
-                    if hold and flight and dd:
-                        summary_vecs.append(summary_vector({
-                            'hold': np.array(hold),
-                            'flight': np.array(flight),
-                            'dd': np.array(dd)
-                        }))
-                if summary_vecs:
-                    profiles[data['username']] = np.vstack(summary_vecs)
-    return profiles
+def load_profiles_statistical(store=None):
+    """Return {username: SufficientStats of the summary vectors} from the profile store"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        return {entry['username']: entry['profile'].summary
+                for entry in entries if entry['profile'].summary.count}
+
+    return store.derived('statistical', build)
+
+def build_statistical_index(profiles):
+    """Stack each user's mean and std summary vectors into (n_users, 6) arrays
+
+    profiles maps users to SufficientStats or to (n_samples, 6) summary matrices.
+    """
+    users = list(profiles)
+    if not users:
+        empty = np.empty((0, 6))
+        return StatisticalIndex(users, empty, empty)
+    stats = [profiles[user] if isinstance(profiles[user], SufficientStats)
+             else SufficientStats.from_rows(profiles[user]) for user in users]
+    means = np.vstack([s.mean for s in stats])
+    stds = np.vstack([s.std for s in stats])
+    return StatisticalIndex(users, means, stds)
+
+def load_statistical_index(store=None):
+    """Return the stacked statistical profiles, rebuilt only when profiles change"""
+    store = store or PROFILE_STORE
+    return store.derived('statistical_index',
+                         lambda entries: build_statistical_index(load_profiles_statistical(store)))
 
 def acceptance_percentage(sample_vec, mean_vec, std_vec, multiplier=2):
-    # Returns the percentage of features within mean ± multiplier * std
+    # Returns the percentage of features within mean ± multiplier * std.
+    # Inputs broadcast: stacked (n_users, 6) profiles give one value per user,
+    # and (n_samples, 1, 6) samples against them a (samples x users) matrix.
     within = np.abs(sample_vec - mean_vec) <= multiplier * std_vec
-    return np.sum(within) / len(sample_vec)
+    return np.sum(within, axis=-1) / np.shape(sample_vec)[-1]
 
-def compare_sample_to_profiles_statistical(sample_vec, profiles, multiplier=2, threshold=0.7):
+def top_k_indices(scores, k=5):
+    """Indices of the k highest scores, best first, ties broken by position"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=int)
+    kth = -np.partition(-scores, k - 1)[k - 1]
+    # Keep every score tied with the k-th so ties resolve by position
+    idx = np.flatnonzero(scores >= kth)
+    return idx[np.lexsort((idx, -scores[idx]))][:k]
+
+def statistical_result(sample_vec, accepts, users, multiplier=2, threshold=0.7):
+    """Turn one sample's per-user acceptances into (user, acceptance, analysis, top matches)"""
     best_user = None
     best_accept = 0
     best_analysis = {}
-    all_matches = []
-    for user, user_mat in profiles.items():
-        mean_vec = np.mean(user_mat, axis=0)
-        std_vec = np.std(user_mat, axis=0)
-        accept = acceptance_percentage(sample_vec, mean_vec, std_vec, multiplier)
-        all_matches.append({
-            'user': user,
-            'acceptance': accept,
-            'method': f"Acceptance % within {multiplier} std: {accept*100:.1f}%"
-        })
-        if accept > best_accept:
-            best_accept = accept
-            best_user = user
-            best_analysis = {
-                'avg_hold': float(sample_vec[0]),
-                'std_hold': float(sample_vec[1]),
-                'avg_flight': float(sample_vec[2]),
-                'std_flight': float(sample_vec[3]),
-                'avg_dd': float(sample_vec[4]),
-                'std_dd': float(sample_vec[5]),
-                'acceptance_percentage': accept
-            }
-    all_matches.sort(key=lambda x: x['acceptance'], reverse=True)
+    if len(accepts) and accepts.max() > 0:
+        best = int(np.argmax(accepts))
+        best_accept = float(accepts[best])
+        best_user = users[best]
+        best_analysis = {
+            'avg_hold': float(sample_vec[0]),
+            'std_hold': float(sample_vec[1]),
+            'avg_flight': float(sample_vec[2]),
+            'std_flight': float(sample_vec[3]),
+            'avg_dd': float(sample_vec[4]),
+            'std_dd': float(sample_vec[5]),
+            'acceptance_percentage': best_accept
+        }
+    all_matches = [{
+        'user': users[i],
+        'acceptance': float(accepts[i]),
+        'method': f"Acceptance % within {multiplier} std: {accepts[i]*100:.1f}%"
+    } for i in top_k_indices(accepts)]
     # Only accept if above threshold
     if best_accept < threshold:
         best_user = 'Unknown User'
-    return best_user, best_accept, best_analysis, all_matches[:5]
+    return best_user, best_accept, best_analysis, all_matches
+
+def compare_sample_to_profiles_statistical(sample_vec, profiles, multiplier=2, threshold=0.7,
+                                           candidates=None):
+    # profiles may be a {user: summary matrix} dict or a prebuilt StatisticalIndex;
+    # with a candidate index only the profiles nearest the sample are scored
+    index = profiles if isinstance(profiles, StatisticalIndex) else build_statistical_index(profiles)
+    if candidates is not None:
+        index = statistical_subindex(index, candidates.query(sample_vec)[0])
+    accepts = acceptance_percentage(sample_vec, index.means, index.stds, multiplier)
+    return statistical_result(sample_vec, accepts, index.users, multiplier, threshold)
+
+def compare_samples_to_profiles_statistical(sample_vecs, profiles, multiplier=2, threshold=0.7,
+                                            candidates=None):
+    """Batch version of compare_sample_to_profiles_statistical.
+
+    Scores an (n_samples, 6) matrix against every user with one
+    (samples x users) broadcast, in row blocks that keep the temporary
+    comparison array under BROADCAST_MAX_ELEMENTS. With a candidate index
+    each sample is scored against its own candidates instead.
+    """
+    index = profiles if isinstance(profiles, StatisticalIndex) else build_statistical_index(profiles)
+    sample_vecs = np.asarray(sample_vecs, dtype=float).reshape(-1, 6)
+    if candidates is not None:
+        results = []
+        for sample_vec, rows in zip(sample_vecs, candidates.query(sample_vecs)):
+            sub = statistical_subindex(index, rows)
+            accepts = acceptance_percentage(sample_vec, sub.means, sub.stds, multiplier)
+            results.append(statistical_result(sample_vec, accepts, sub.users, multiplier, threshold))
+        return results
+    block = max(1, BROADCAST_MAX_ELEMENTS // max(1, len(index.users) * 6))
+    results = []
+    for start in range(0, len(sample_vecs), block):
+        vecs = sample_vecs[start:start + block]
+        accepts = acceptance_percentage(vecs[:, None, :], index.means, index.stds, multiplier)
+        for sample_vec, row in zip(vecs, accepts):
+            results.append(statistical_result(sample_vec, row, index.users, multiplier, threshold))
+    return results
 
 # ===== N-GRAM METHOD =====
+# Sparse user x n-gram layout of the n-gram profiles, see build_ngram_index
+NgramIndex = namedtuple('NgramIndex', ['vocab', 'users', 'entries', 'means', 'stds'])
+
 def extract_ngram_features(sample):
     """Extract n-gram timing features from a sample"""
+    return extract_ngram_features_bulk([sample])[0]
+
+def extract_ngram_features_bulk(samples):
+    """Extract n-gram timing features from many samples at once.
+
+    Samples with raw key events (columnar ``timing_arrays``, ``timings`` or
+    ``keystroke_sequence``) get their digraph and trigraph latencies from
+    them: the time from the first to the last key press of every run of
+    two or three consecutive letter key presses, with modifier keys
+    skipped. All such samples are processed together in a few NumPy passes.
+    Samples without events fall back to the client-built ``ngram_data``.
+    """
+    results = [None] * len(samples)
+    ids, times, keys = [], [], []
+    for i, sample in enumerate(samples):
+        arrays = keystroke_arrays(sample)
+        if arrays is None:
+            results[i] = client_ngram_features(sample)
+            continue
+        results[i] = {}
+        event_times, event_keys, down = arrays
+        pressed = np.asarray(down, dtype=bool) & ~np.isin(event_keys, MODIFIER_CODES)
+        ids.append(np.full(int(pressed.sum()), i))
+        times.append(np.asarray(event_times, dtype=float)[pressed])
+        keys.append(np.asarray(event_keys, dtype=np.int64)[pressed])
+    if not ids:
+        return results
+
+    ids = np.concatenate(ids)
+    times = np.concatenate(times)
+    letters = np.concatenate(keys) - ord('a')
+    is_letter = (letters >= 0) & (letters < 26)
+    for n, kind in ((2, 'digraph'), (3, 'trigraph')):
+        if len(ids) < n:
+            continue
+        # Runs of n letter presses within one sample
+        run = is_letter[:len(ids) - n + 1] & (ids[:len(ids) - n + 1] == ids[n - 1:])
+        for k in range(1, n):
+            run &= is_letter[k:len(ids) - n + 1 + k]
+        start = np.flatnonzero(run)
+        code = np.zeros(len(start), dtype=np.int64)
+        for k in range(n):
+            code = code * 26 + letters[start + k]
+        latency = times[start + n - 1] - times[start]
+
+        # One group per (sample, n-gram): mean and population std of its latencies
+        groups, group_of = np.unique(ids[start] * 26 ** n + code, return_inverse=True)
+        counts = np.bincount(group_of)
+        means = np.bincount(group_of, weights=latency) / counts
+        stds = np.sqrt(np.bincount(group_of, weights=(latency - means[group_of]) ** 2) / counts)
+        for group, mean, std in zip(groups.tolist(), means.tolist(), stds.tolist()):
+            sample_id, code = divmod(group, 26 ** n)
+            name = ''.join(chr(ord('a') + code // 26 ** (n - 1 - k) % 26) for k in range(n))
+            results[sample_id][f'{kind}_{name}_mean'] = mean
+            results[sample_id][f'{kind}_{name}_std'] = std
+    return results
+
+def client_ngram_features(sample):
+    """N-gram features from the client-built ngram_data of older samples"""
     ngram_features = {}
-    
-    # Extract digraphs and trigraphs from the text
-    text = sample.get('text', '').lower()
-    digraphs = [text[i:i+2] for i in range(len(text)-1) if text[i:i+2].isalpha()]
-    trigraphs = [text[i:i+3] for i in range(len(text)-2) if text[i:i+3].isalpha()]
-    
-    # Get n-gram data
-    ngram_data = sample.get('ngram_data', {})
-    digraph_timings = ngram_data.get('digraphs', {})
-    trigraph_timings = ngram_data.get('trigraphs', {})
-    
-    # Calculate features for each n-gram
-    for digraph in digraph_timings:
-        timings = digraph_timings[digraph]
-        if timings:
-            ngram_features[f'digraph_{digraph}_mean'] = np.mean(timings)
-            ngram_features[f'digraph_{digraph}_std'] = np.std(timings)
-    
-    for trigraph in trigraph_timings:
-        timings = trigraph_timings[trigraph]
-        if timings:
-            ngram_features[f'trigraph_{trigraph}_mean'] = np.mean(timings)
-            ngram_features[f'trigraph_{trigraph}_std'] = np.std(timings)
-    
+    ngram_data = sample.get('ngram_data') or {}
+    for kind, timings_by_ngram in (('digraph', ngram_data.get('digraphs', {})),
+                                   ('trigraph', ngram_data.get('trigraphs', {}))):
+        for ngram, timings in timings_by_ngram.items():
+            if timings:
+                ngram_features[f'{kind}_{ngram}_mean'] = float(np.mean(timings))
+                ngram_features[f'{kind}_{ngram}_std'] = float(np.std(timings))
     return ngram_features
 
-def load_profiles_ngram():
-    """Load user profiles with n-gram features"""
-    profiles = {}
-    for fname in os.listdir(DATA_DIR):
-        if fname.endswith('.json'):
-            with open(os.path.join(DATA_DIR, fname), 'r') as f:
-                data = json.load(f)
-                user_features = []
-                for sample in data.get('samples', []):
-                    features = extract_ngram_features(sample)
-                    if features:  # Only add if we have n-gram features
-                        user_features.append(features)
-                if user_features:
-                    profiles[data['username']] = user_features
-    return profiles
-
-def compare_sample_to_profiles_ngram(sample_features, profiles, threshold=0.6):
+def load_profiles_ngram(store=None):
+    """Return {username: {n-gram: SufficientStats of its per-sample [mean, std]}}"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        return {entry['username']: entry['profile'].ngrams
+                for entry in entries if entry['profile'].ngrams}
+
+    return store.derived('ngram', build)
+
+def ngram_statistics(feature_dicts):
+    """Fold per-sample n-gram feature dicts into per-n-gram SufficientStats"""
+    profile = UserProfile()
+    for features in feature_dicts:
+        profile.add_ngram_features(features)
+    return profile.ngrams
+
+def build_ngram_index(profiles):
+    """Index {user: n-gram statistics} by n-gram for matrix-based matching.
+
+    Profiles may also be given as {user: [per-sample feature dicts]}. Each
+    user is a row and each n-gram in the global vocabulary a column of a
+    sparse CSC matrix whose entries point into the flat ``means``/``stds``
+    arrays, the user's average per-sample mean and std for that n-gram;
+    its sparsity pattern is the presence mask. The CSC columns double as
+    the inverted index: the rows stored under an n-gram's column are
+    exactly the users that have it.
+    """
+    users = list(profiles)
+    vocab = {}
+    rows, cols, means, stds = [], [], [], []
+    for row, user in enumerate(users):
+        ngrams = profiles[user]
+        if isinstance(ngrams, list):
+            ngrams = ngram_statistics(ngrams)
+        for name, stats in ngrams.items():
+            mean, std = stats.mean
+            rows.append(row)
+            cols.append(vocab.setdefault(name, len(vocab)))
+            means.append(mean)
+            stds.append(std)
+
+    entries = sparse.csc_matrix(
+        (np.arange(1, len(rows) + 1), (rows, cols)),
+        shape=(len(users), len(vocab))
+    )
+    return NgramIndex(vocab, users, entries,
+                      np.array(means, dtype=float), np.array(stds, dtype=float))
+
+def load_ngram_index(store=None):
+    """Return the n-gram index, rebuilt only when profiles change"""
+    store = store or PROFILE_STORE
+    return store.derived('ngram_index',
+                         lambda entries: build_ngram_index(load_profiles_ngram(store)))
+
+def ngram_similarity(sample_vals, user_vals):
+    # Relative closeness of timings, 1 for identical and 0 when off by 100% or more
+    diff = np.abs(sample_vals - user_vals) / np.maximum(np.abs(user_vals), 1)
+    return np.maximum(0, 1 - diff)
+
+def ngram_user_scores(sample_features, index):
+    """Similarity of a sample to every user sharing an n-gram with it.
+
+    Returns the index rows of those users and their scores.
+    """
+    # Map the sample onto the vocabulary; unknown n-grams cannot overlap anything
+    cols, sample_means, sample_stds = [], [], []
+    for key, value in sample_features.items():
+        name, stat = key.rsplit('_', 1)
+        if stat == 'mean' and name in index.vocab:
+            cols.append(index.vocab[name])
+            sample_means.append(value)
+            sample_stds.append(sample_features.get(f'{name}_std', 0.0))
+    if not cols:
+        return np.empty(0, dtype=int), np.empty(0)
+
+    # Only users posted under the sample's n-grams are visited
+    hits = index.entries[:, cols].tocoo()
+    ids = hits.data - 1
+    similarity = (ngram_similarity(np.array(sample_means)[hits.col], index.means[ids]) +
+                  ngram_similarity(np.array(sample_stds)[hits.col], index.stds[ids]))
+
+    # Average over each user's common n-grams (mean and std both count)
+    user_ids, user_of_hit = np.unique(hits.row, return_inverse=True)
+    user_scores = np.bincount(user_of_hit, weights=similarity) / (2 * np.bincount(user_of_hit))
+    return user_ids, user_scores
+
+def compare_sample_to_profiles_ngram(sample_features, profiles, threshold=0.6, candidates=None):
     """Compare sample n-gram features to user profiles"""
+    # profiles may be anything build_ngram_index takes or a prebuilt NgramIndex;
+    # with a candidate index only the profiles nearest the sample are scored
+    index = profiles if isinstance(profiles, NgramIndex) else build_ngram_index(profiles)
+    if candidates is not None:
+        index = ngram_subindex(index, candidates.rows, candidates.query(sample_features)[0])
+    user_ids, user_scores = ngram_user_scores(sample_features, index)
+
     best_user = None
     best_score = 0
-    all_matches = []
-    
-    for user, user_features_list in profiles.items():
-        if not user_features_list:
-            continue
-            
-        # Calculate similarity for each user sample
-        similarities = []
-        for user_features in user_features_list:
-            # Find common n-grams
-            common_keys = set(sample_features.keys()) & set(user_features.keys())
-            if not common_keys:
-                continue
-                
-            # Calculate similarity for common n-grams
-            total_similarity = 0
-            count = 0
-            for key in common_keys:
-                sample_val = sample_features[key]
-                user_val = user_features[key]
-                
-                # Simple similarity: how close are the values?
-                if 'mean' in key:
-                    # For means, use relative difference
-                    diff = abs(sample_val - user_val) / max(abs(user_val), 1)
-                    similarity = max(0, 1 - diff)
-                else:
-                    # For std, use similar approach
-                    diff = abs(sample_val - user_val) / max(abs(user_val), 1)
-                    similarity = max(0, 1 - diff)
-                
-                total_similarity += similarity
-                count += 1
-            
-            if count > 0:
-                avg_similarity = total_similarity / count
-                similarities.append(avg_similarity)
-        
-        if similarities:
-            user_score = np.mean(similarities)
-            all_matches.append({
-                'user': user,
-                'acceptance': user_score,
-                'method': f"N-gram similarity: {user_score*100:.1f}%"
-            })
-            
-            if user_score > best_score:
-                best_score = user_score
-                best_user = user
-    
-    all_matches.sort(key=lambda x: x['acceptance'], reverse=True)
+    if len(user_scores) and user_scores.max() > 0:
+        best = int(np.argmax(user_scores))
+        best_score = float(user_scores[best])
+        best_user = index.users[user_ids[best]]
+
+    all_matches = [{
+        'user': index.users[user_ids[i]],
+        'acceptance': float(user_scores[i]),
+        'method': f"N-gram similarity: {user_scores[i]*100:.1f}%"
+    } for i in top_k_indices(user_scores)]
     
     if best_score < threshold:
         best_user = 'Unknown User'
     
-    return best_user, best_score, {}, all_matches[:5]
+    return best_user, best_score, {}, all_matches
+
+# ===== CANDIDATE INDEX =====
+# Exact scoring is linear in the number of users. For large populations a
+# nearest-neighbor index over the profiles' mean vectors first picks the
+# CANDIDATE_K most similar users and only those are scored; the answer is
+# exact whenever the true best matches are among the candidates, which
+# candidate_recall() measures against exhaustive search.
+
+class CandidateIndex:
+    """Top-K nearest rows of a dense vector matrix.
+
+    ``kdtree`` uses sklearn's KDTree and is exact in Euclidean distance.
+    ``ivf`` partitions the rows into about sqrt(n) lists with a few k-means
+    iterations and only searches the ``n_probe`` lists whose centroids are
+    nearest the query; recall grows with ``n_probe``.
+    """
+
+    def __init__(self, vectors, kind='auto', n_probe=16, seed=0):
+        self.vectors = np.asarray(vectors, dtype=float)
+        if kind == 'auto':
+            kind = 'kdtree' if self.vectors.shape[1] <= 16 else 'ivf'
+        self.kind = kind
+        self.n_probe = n_probe
+        if kind == 'kdtree':
+            self.tree = neighbors.KDTree(self.vectors)
+        elif kind == 'ivf':
+            self._build_ivf(seed)
+        else:
+            raise ValueError(f'Unknown candidate index: {kind}')
+
+    @staticmethod
+    def _sq_distances(vectors, centroids):
+        # |x - c|^2 via one matrix product instead of an (n, lists, dims) broadcast
+        return (np.square(vectors).sum(axis=1)[:, None] - 2 * vectors @ centroids.T
+                + np.square(centroids).sum(axis=1)[None, :])
+
+    def _build_ivf(self, seed, iterations=10):
+        n = len(self.vectors)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(n, n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmin(self._sq_distances(self.vectors, centroids), axis=1)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.centroids = centroids
+        order = np.argsort(assign, kind='stable')
+        self.lists = np.split(order, np.cumsum(np.bincount(assign, minlength=n_lists))[:-1])
+
+    def search(self, queries, k):
+        """Sorted row indices of the k nearest vectors to each query"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=float))
+        k = min(k, len(self.vectors))
+        if self.kind == 'kdtree':
+            return [np.sort(rows) for rows in self.tree.query(queries, k=k, return_distance=False)]
+        probes = np.argsort(self._sq_distances(queries, self.centroids), axis=1)[:, :self.n_probe]
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([self.lists[i] for i in lists])
+            dist = np.square(self.vectors[rows] - query).sum(axis=1)
+            if len(rows) > k:
+                rows = rows[np.argpartition(dist, k - 1)[:k]]
+            results.append(np.sort(rows))
+        return results
+
+class StatisticalCandidates:
+    """Candidate index over the statistical profiles' mean summary vectors"""
+
+    def __init__(self, index, k=None, kind=None, n_probe=None):
+        self.k = k or CANDIDATE_K
+        # Put the six features on a common scale before measuring distance
+        self.scale = np.maximum(index.means.std(axis=0), 1e-9)
+        self.index = CandidateIndex(index.means / self.scale, kind or CANDIDATE_INDEX,
+                                    n_probe or CANDIDATE_N_PROBE)
+
+    def query(self, sample_vecs):
+        vecs = np.atleast_2d(np.asarray(sample_vecs, dtype=float)) / self.scale
+        return self.index.search(vecs, self.k)
+
+def statistical_subindex(index, rows):
+    return StatisticalIndex([index.users[i] for i in rows], index.means[rows], index.stds[rows])
+
+class NgramCandidates:
+    """Candidate index over the n-gram profiles' mean timings.
+
+    Profiles are projected onto the ``dims`` n-grams most users share, as
+    log timings so that distance tracks relative differences like
+    ngram_similarity does. An n-gram a user (or sample) lacks is filled
+    with its population mean shifted by how much slower or faster than
+    the population that user types the n-grams they do have.
+    """
+
+    def __init__(self, index, k=None, kind=None, n_probe=None, dims=64):
+        self.k = k or CANDIDATE_K
+        self.rows = index.entries.tocsr()  # row slicing for the scored subset
+        presence = np.diff(index.entries.indptr)
+        self.columns = np.sort(np.argsort(-presence, kind='stable')[:dims])
+        names = {col: name for name, col in index.vocab.items()}
+        self.names = [names[col] for col in self.columns]
+
+        sub = self.rows[:, self.columns].tocoo()
+        values = np.log(np.maximum(index.means[sub.data - 1], 1))
+        dims = len(self.columns)
+        self.fill = (np.bincount(sub.col, weights=values, minlength=dims) /
+                     np.maximum(np.bincount(sub.col, minlength=dims), 1))
+        n_users = len(index.users)
+        offsets = (np.bincount(sub.row, weights=values - self.fill[sub.col], minlength=n_users) /
+                   np.maximum(np.bincount(sub.row, minlength=n_users), 1))
+        dense = self.fill + offsets[:, None]
+        dense[sub.row, sub.col] = values
+        self.scale = np.maximum(dense.std(axis=0), 1e-9)
+        self.index = CandidateIndex(dense / self.scale, kind or CANDIDATE_INDEX,
+                                    n_probe or CANDIDATE_N_PROBE)
+
+    def vector(self, sample_features):
+        values = np.array([sample_features.get(f'{name}_mean', np.nan) for name in self.names],
+                          dtype=float)
+        present = ~np.isnan(values)
+        values[present] = np.log(np.maximum(values[present], 1))
+        offset = np.mean(values[present] - self.fill[present]) if present.any() else 0.0
+        values[~present] = self.fill[~present] + offset
+        return values / self.scale
+
+    def query(self, sample_features):
+        if isinstance(sample_features, dict):
+            sample_features = [sample_features]
+        return self.index.search([self.vector(f) for f in sample_features], self.k)
+
+def ngram_subindex(index, index_rows, rows):
+    """The n-gram index restricted to some users; index_rows is its entries as CSR"""
+    return NgramIndex(index.vocab, [index.users[i] for i in rows],
+                      index_rows[rows].tocsc(), index.means, index.stds)
+
+def load_statistical_candidates(store=None):
+    """Candidate index for the statistical profiles, or None below CANDIDATE_MIN_USERS"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        index = load_statistical_index(store)
+        return StatisticalCandidates(index) if len(index.users) >= CANDIDATE_MIN_USERS else None
+
+    return store.derived('statistical_candidates', build)
+
+def load_ngram_candidates(store=None):
+    """Candidate index for the n-gram profiles, or None below CANDIDATE_MIN_USERS"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        index = load_ngram_index(store)
+        if not index.vocab or len(index.users) < CANDIDATE_MIN_USERS:
+            return None
+        return NgramCandidates(index)
+
+    return store.derived('ngram_candidates', build)
+
+def candidate_recall(method, index, candidates, n_queries=200, k=5, seed=0):
+    """Fraction of the exhaustive top-k matches that are among the candidates.
+
+    Queries are synthetic samples drawn around randomly chosen profiles:
+    their mean vector jittered by their own spread.
+    """
+    rng = np.random.default_rng(seed)
+    users = rng.choice(len(index.users), min(n_queries, len(index.users)), replace=False)
+    names = {col: name for name, col in getattr(index, 'vocab', {}).items()}
+    found = total = 0
+    for u in users:
+        if method == 'statistical':
+            query = index.means[u] + rng.normal(size=6) * index.stds[u]
+            matches = compare_sample_to_profiles_statistical(query, index)[3]
+        else:
+            row = candidates.rows[u]
+            ids = row.data - 1
+            jitter = 1 + rng.normal(0, 0.1, len(ids))
+            query = {}
+            for col, mean, std in zip(row.indices, index.means[ids] * jitter, index.stds[ids]):
+                query[f'{names[col]}_mean'] = mean
+                query[f'{names[col]}_std'] = std
+            matches = compare_sample_to_profiles_ngram(query, index)[3]
+        expected = {m['user'] for m in matches[:k] if m['acceptance'] > 0}
+        shortlist = {index.users[i] for i in candidates.query(query)[0]}
+        found += len(expected & shortlist)
+        total += len(expected)
+    return found / total if total else 1.0
+
+def candidate_report(store=None):
+    """Candidate index settings and measured recall for each method"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        report = {}
+        for method, index, candidates in (
+                ('statistical', load_statistical_index(store), load_statistical_candidates(store)),
+                ('ngram', load_ngram_index(store), load_ngram_candidates(store))):
+            report[method] = {
+                'users': len(index.users),
+                'active': candidates is not None,
+                'index': candidates.index.kind if candidates is not None else None,
+                'recall': candidate_recall(method, index, candidates) if candidates is not None else None
+            }
+        return report
+
+    return {
+        'k': CANDIDATE_K,
+        'min_users': CANDIDATE_MIN_USERS,
+        'n_probe': CANDIDATE_N_PROBE,
+        'methods': store.derived('candidate_report', build)
+    }
 
 # ===== MACHINE LEARNING METHOD =====
-def prepare_ml_data():
-    """Prepare data for machine learning models"""
-    X = []  # Features
-    y = []  # Labels
-    
-    for fname in os.listdir(DATA_DIR):
-        if fname.endswith('.json'):
-            with open(os.path.join(DATA_DIR, fname), 'r') as f:
-                data = json.load(f)
-                username = data['username']
-                
-                for sample in data.get('samples', []):
-                    # Extract n-gram features
-                    features = extract_ngram_features(sample)
-                    if features:
-                        # Convert to feature vector
-                        feature_vector = []
-                        for key in sorted(features.keys()):
-                            feature_vector.append(features[key])
-                        
-                        X.append(feature_vector)
-                        y.append(username)
-    
-    return np.array(X), np.array(y)
+class RowBuffer:
+    """Append-only CSR rows: appending a row costs O(row), not O(rows)"""
+
+    __slots__ = ('indptr', 'indices', 'data')
+
+    def __init__(self):
+        self.indptr = array('q', [0])
+        self.indices = array('q')
+        self.data = array('d')
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def append(self, columns, values):
+        self.indices.extend(columns)
+        self.data.extend(values)
+        self.indptr.append(len(self.indices))
+
+    def rows_from(self, start):
+        """(row lengths, column indices, values) of the rows from ``start`` on"""
+        indptr = np.frombuffer(self.indptr, dtype=np.int64)[start:]
+        first, last = indptr[0], indptr[-1]
+        return (np.diff(indptr), np.frombuffer(self.indices, dtype=np.int64)[first:last],
+                np.frombuffer(self.data)[first:last])
+
+class TrainingRows(UserFileCache):
+    """Per-sample n-gram feature rows of every user, for ML training.
+
+    Owned by the training path, so the profile store keeps only sufficient
+    statistics. It follows the same files the store does, parses only log
+    lines appended since the last refresh, and appends each sample's row to
+    its user's RowBuffer, over one growing vocabulary of feature names. A
+    user's rows are rebuilt only when their profile file is rewritten.
+    """
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.names = []  # column -> feature name
+        self.columns = {}  # feature name -> column
+
+    def _new_entry(self):
+        return {'rows': RowBuffer()}
+
+    def _add_samples(self, entry, samples):
+        for features in extract_ngram_features_bulk(samples):
+            if not features:
+                continue
+            columns = []
+            for name in features:
+                column = self.columns.get(name)
+                if column is None:
+                    column = self.columns[name] = len(self.names)
+                    self.names.append(name)
+                columns.append(column)
+            entry['rows'].append(columns, features.values())
+
+    def _extend_entry(self, cached):
+        # Rows are only appended, and readers copy the rows they use under
+        # the lock, so the buffer is shared with the cached entry
+        return dict(cached)
+
+    def counts(self):
+        """Refresh and return {username: rows}"""
+        return {entry['username']: len(entry['rows']) for entry in self.entries() if len(entry['rows'])}
+
+    def feature_names(self):
+        """Sorted names of the features the current rows use"""
+        with self._lock:
+            used = set()
+            for entry in self._entries.values():
+                used.update(np.unique(entry['rows'].rows_from(0)[1]).tolist())
+            return sorted(self.names[column] for column in used)
+
+    def matrix(self, vocabulary, skip=None):
+        """CSR rows in ``vocabulary``'s columns and their labels, as of the last refresh
+
+        ``skip`` maps users to the number of their oldest rows to leave
+        out. Features missing from the vocabulary are dropped, as
+        DictVectorizer.transform drops them.
+        """
+        skip = skip or {}
+        with self._lock:
+            column_map = np.array([vocabulary.get(name, -1) for name in self.names], dtype=np.int64)
+            lengths, indices, data, labels = [], [], [], []
+            for stem in sorted(self._entries):
+                entry = self._entries[stem]
+                start = min(skip.get(entry['username'], 0), len(entry['rows']))
+                row_lengths, row_indices, row_data = entry['rows'].rows_from(start)
+                lengths.append(row_lengths)
+                indices.append(column_map[row_indices])
+                data.append(row_data.copy())
+                labels.extend([entry['username']] * len(row_lengths))
+        lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+        columns = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(data) if data else np.zeros(0)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        keep = columns >= 0
+        X = sparse.csr_matrix((values[keep], (rows[keep], columns[keep])),
+                              shape=(len(lengths), len(vocabulary)))
+        return X, np.array(labels)
+
+_training_rows = None
+_training_rows_lock = threading.Lock()
+
+def training_rows(store=None):
+    """The TrainingRows of the profile store's data directory"""
+    global _training_rows
+    data_dir = (store or PROFILE_STORE).data_dir
+    with _training_rows_lock:
+        if _training_rows is None or _training_rows.data_dir != data_dir:
+            _training_rows = TrainingRows(data_dir)
+        return _training_rows
+
+def prepare_ml_data(store=None, vectorizer=None):
+    """Prepare data for machine learning models
+
+    Returns a sparse CSR feature matrix, the labels and the vectorizer that
+    fixes the column of every n-gram feature. A new vectorizer is fitted on
+    the data unless one is given.
+    """
+    rows = training_rows(store)
+    rows.refresh()
+    if vectorizer is None:
+        # One dict naming every feature gives the sorted columns fitting on
+        # all the samples would
+        vectorizer = feature_extraction.DictVectorizer(sparse=True)
+        vectorizer.fit([dict.fromkeys(rows.feature_names(), 1.0)])
+    X, y = rows.matrix(vectorizer.vocabulary_)
+    return X, y, vectorizer
+
+# A trained model set; version numbers increase with every training or
+# incremental update. ``reference`` holds the unscaled (X, y) the KNN
+# searches, so incremental updates can append to it and rescale.
+MODEL_NAMES = ('vectorizer', 'scaler', 'knn', 'classifier', 'reference')
+ModelSet = namedtuple('ModelSet', ['version', 'trained_at', 'loaded_at', 'sample_counts',
+                                   'full_trained_at', 'training'] + list(MODEL_NAMES))
+
+class ModelRegistry:
+    """Process-wide holder of the live ML model set.
+
+    Model sets are saved under ``models/v<version>/`` and ``current.json``
+    names the live one, so readers never see a half-written set. The live
+    set is unpickled once and kept resident; publishing a new set swaps a
+    single reference, so requests already holding the previous set finish
+    with it undisturbed. If another process publishes a newer version on
+    disk, it is picked up on the next ``current()`` call.
+    """
+
+    KEEP_VERSIONS = 2
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+        self._current = None
+        self._pointer_stamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def pointer_path(self):
+        return os.path.join(self.models_dir, 'current.json')
+
+    def _version_dir(self, version):
+        return os.path.join(self.models_dir, f'v{version:04d}')
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.pointer_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def current(self):
+        """Return the live ModelSet, or None if no models have been trained"""
+        stamp = self._stamp()
+        if stamp == self._pointer_stamp:
+            return self._current
+        with self._lock:
+            stamp = self._stamp()
+            if stamp != self._pointer_stamp:
+                model_set = self._load() if stamp is not None else None
+                if model_set is not None or stamp is None:
+                    self._current = model_set
+                    self._pointer_stamp = stamp
+            return self._current
+
+    def _load(self):
+        try:
+            with open(self.pointer_path, 'r') as f:
+                pointer = json.load(f)
+            models = {}
+            version_dir = self._version_dir(pointer['version'])
+            for name in MODEL_NAMES:
+                with open(os.path.join(version_dir, f'{name}.pkl'), 'rb') as f:
+                    models[name] = pickle.load(f)
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            return None
+        return ModelSet(pointer['version'], pointer.get('trained_at'), utc_now(),
+                        pointer.get('sample_counts'), pointer.get('full_trained_at'),
+                        pointer.get('training'), **models)
+
+    def publish(self, models, sample_counts=None, full_trained_at=None, training=None):
+        """Save a model set and make it the live one
+
+        ``models`` maps every name in MODEL_NAMES to its fitted object.
+        ``sample_counts`` records {username: samples} the set was trained on,
+        which tells whether newer enrollments call for a retrain,
+        ``full_trained_at`` when its last full (non-incremental) training ran
+        and ``training`` what that training measured (see train_ml_models).
+        """
+        with self._lock:
+            live = self._current
+            version = (live.version if live else self._disk_version()) + 1
+            version_dir = self._version_dir(version)
+            os.makedirs(version_dir, exist_ok=True)
+            for name in MODEL_NAMES:
+                with open(os.path.join(version_dir, f'{name}.pkl'), 'wb') as f:
+                    pickle.dump(models[name], f)
+
+            trained_at = utc_now()
+            full_trained_at = full_trained_at or trained_at
+            tmp_path = self.pointer_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': version, 'trained_at': trained_at,
+                           'full_trained_at': full_trained_at,
+                           'training': training,
+                           'sample_counts': sample_counts}, f)
+            os.replace(tmp_path, self.pointer_path)
+
+            self._current = ModelSet(version, trained_at, trained_at, sample_counts,
+                                     full_trained_at, training, **models)
+            self._pointer_stamp = self._stamp()
+            self._prune(version)
+            return self._current
+
+    def live_version(self):
+        """Version of the live model set, 0 if none, without unpickling it"""
+        if self._stamp() == self._pointer_stamp and self._current is not None:
+            return self._current.version
+        return self._disk_version()
+
+    def _disk_version(self):
+        try:
+            with open(self.pointer_path, 'r') as f:
+                return int(json.load(f)['version'])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _prune(self, version):
+        for old in range(version - self.KEEP_VERSIONS, 0, -1):
+            old_dir = self._version_dir(old)
+            if not os.path.isdir(old_dir):
+                break
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def status(self):
+        model_set = self.current()
+        if model_set is None:
+            return {'version': None, 'trained_at': None, 'loaded_at': None,
+                    'full_trained_at': None, 'classifier': None, 'training': None}
+        return {
+            'version': model_set.version,
+            'trained_at': model_set.trained_at,
+            'loaded_at': model_set.loaded_at,
+            'full_trained_at': model_set.full_trained_at,
+            'classifier': type(model_set.classifier).__name__,
+            'training': model_set.training
+        }
+
+MODEL_REGISTRY = ModelRegistry(MODELS_DIR)
+
+def training_data_counts(store=None):
+    """Return {username: n-gram samples}, the data the ML models train on"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        return {entry['username']: entry['profile'].ngram_samples
+                for entry in entries if entry['profile'].ngram_samples}
+
+    return store.derived('sample_counts', build)
+
+def make_classifier(kind=None):
+    """Return an unfitted classifier for the ensemble's second vote
+
+    ``svc`` is the batch RBF SVM; its training grows roughly quadratically
+    with the sample count and Platt scaling refits it five more times for
+    probabilities. ``sgd`` is a logistic-loss linear model that supports
+    ``partial_fit``, so incremental updates can train it on new samples
+    instead of leaving it as of the last full training.
+
+    The fast modes train in time linear in the sample count and get their
+    probabilities from the logistic loss itself. ``linear`` fits one binary
+    logistic regression per class, one class per core; each lbfgs fit has a
+    looser tolerance and a higher iteration cap, so it converges on the
+    n-gram features instead of stopping at the default 100 iterations.
+    ``rff`` maps the
+    features through random Fourier features approximating the SVM's RBF
+    kernel and fits an online logistic model on them, one class per core.
+    """
+    kind = kind or ML_CLASSIFIER
+    if kind == 'svc':
+        return svm.SVC(probability=True, random_state=42)
+    if kind == 'sgd':
+        return linear_model.SGDClassifier(loss='log_loss', n_jobs=ML_N_JOBS, random_state=42)
+    if kind == 'linear':
+        # LogisticRegression ignores n_jobs; one-vs-rest spreads the classes over cores
+        return multiclass.OneVsRestClassifier(
+            linear_model.LogisticRegression(solver='lbfgs', tol=1e-3, max_iter=500), n_jobs=ML_N_JOBS)
+    if kind == 'rff':
+        return pipeline.make_pipeline(
+            kernel_approximation.RBFSampler(gamma='scale', n_components=ML_RFF_COMPONENTS,
+                                            random_state=42),
+            linear_model.SGDClassifier(loss='log_loss', n_jobs=ML_N_JOBS, random_state=42))
+    raise ValueError(f'Unknown ML classifier: {kind}')
+
+def fit_classifier(classifier, X, y):
+    """Fit an unfitted classifier and return the model to predict with
+
+    A one-vs-rest fit is folded into a single LogisticRegression holding
+    every class's coefficients, so predicting costs one sparse product
+    instead of a predict_proba call per class. Its probabilities are the
+    softmax of the per-class decisions.
+    """
+    classifier.fit(X, y)
+    if not hasattr(classifier, 'estimators_'):
+        return classifier
+    folded = copy.deepcopy(classifier.estimator)
+    # Two classes share one binary model, positive for classes_[1] as in LogisticRegression
+    folded.coef_ = np.vstack([estimator.coef_ for estimator in classifier.estimators_])
+    folded.intercept_ = np.concatenate([estimator.intercept_ for estimator in classifier.estimators_])
+    folded.n_iter_ = np.array([estimator.n_iter_[0] for estimator in classifier.estimators_])
+    folded.classes_ = classifier.classes_
+    folded.n_features_in_ = classifier.n_features_in_
+    return folded
+
+def partial_fit_classifier(classifier, X, y):
+    """Return a copy of ``classifier`` trained further on (X, y)
+
+    Returns None for batch classifiers. In a pipeline the fitted feature
+    map is kept and only its final online step is updated.
+    """
+    steps = classifier[:-1] if hasattr(classifier, 'steps') else None
+    final = classifier[-1] if steps is not None else classifier
+    if not hasattr(final, 'partial_fit'):
+        return None
+    classifier = copy.deepcopy(classifier)
+    if steps is not None:
+        classifier[-1].partial_fit(steps.transform(X), y)
+    else:
+        classifier.partial_fit(X, y)
+    return classifier
+
+def fit_knn(X_scaled, y):
+    knn = neighbors.KNeighborsClassifier(n_neighbors=min(3, X_scaled.shape[0]))
+    knn.fit(X_scaled, y)
+    return knn
 
 def train_ml_models():
-    """Train ML models and save them"""
-    X, y = prepare_ml_data()
+    """Train ML models from scratch and publish them to the model registry
+
+    The held-out 20% split scores the result: the published set records
+    the classifier kind, its fit time and the accuracy of the classifier
+    alone and of the KNN ensemble on the held-out samples.
+    """
+    X, y, vectorizer = prepare_ml_data()
     
-    if len(X) < 10:  # Need sufficient data
+    if X.shape[0] < 10:  # Need sufficient data
         return False
     
     # Split data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_test, y_train, y_test = model_selection.train_test_split(X, y, test_size=0.2, random_state=42)
     
-    # Scale features
-    scaler = StandardScaler()
+    # Scale features; centering would densify the sparse matrix
+    scaler = preprocessing.StandardScaler(with_mean=False)
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
     
     # Train KNN
-    knn = KNeighborsClassifier(n_neighbors=3)
-    knn.fit(X_train_scaled, y_train)
+    knn = fit_knn(X_train_scaled, y_train)
     
-    # Train SVM
-    svm = SVC(probability=True, random_state=42)
-    svm.fit(X_train_scaled, y_train)
+    # Train SVM (or the configured alternative)
+    start = time.perf_counter()
+    classifier = fit_classifier(make_classifier(), X_train_scaled, y_train)
+    fit_s = time.perf_counter() - start
+    
+    predicted, _ = ensemble_vote(knn, classifier, X_test_scaled)
+    training = {
+        'classifier': ML_CLASSIFIER,
+        'samples': int(X_train.shape[0]),
+        'fit_s': round(fit_s, 4),
+        'classifier_accuracy': round(float(np.mean(classifier.predict(X_test_scaled) == y_test)), 4),
+        'ensemble_accuracy': round(float(np.mean(predicted == y_test)), 4)
+    }
     
     # Save models
-    with open(os.path.join(MODELS_DIR, 'scaler.pkl'), 'wb') as f:
-        pickle.dump(scaler, f)
-    with open(os.path.join(MODELS_DIR, 'knn.pkl'), 'wb') as f:
-        pickle.dump(knn, f)
-    with open(os.path.join(MODELS_DIR, 'svm.pkl'), 'wb') as f:
-        pickle.dump(svm, f)
+    sample_counts = dict(Counter(y.tolist()))
+    MODEL_REGISTRY.publish({
+        'vectorizer': vectorizer,
+        'scaler': scaler,
+        'knn': knn,
+        'classifier': classifier,
+        'reference': (X_train, y_train)
+    }, sample_counts, training=training)
     
     return True
 
+def full_retrain_due(model_set):
+    if model_set.full_trained_at is None:
+        return True
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(model_set.full_trained_at)
+    return age.total_seconds() >= ML_FULL_RETRAIN_INTERVAL
+
+def update_ml_models(full=False):
+    """Bring the ML models up to date with the profile store
+
+    Samples added since the live set was trained are folded in
+    incrementally: TrainingRows parses only the log lines appended since
+    its last refresh, only the rows past each user's trained count are
+    taken from it and appended to the KNN reference set, the scaler
+    statistics are updated online (unless the classifier is a batch one,
+    which depends on the original scaling) and an online classifier is
+    trained on them with ``partial_fit``. A full retrain runs instead when
+    forced, when it is due by ML_FULL_RETRAIN_INTERVAL, or when the change
+    is not a pure append (new or removed users, users with fewer samples).
+    """
+    model_set = load_ml_models()
+    if full or model_set is None or full_retrain_due(model_set):
+        return train_ml_models()
+
+    known_users = set(model_set.classifier.classes_)
+    trained_counts = model_set.sample_counts or {}
+    rows = training_rows()
+    sample_counts = rows.counts()
+    for user, count in sample_counts.items():
+        seen = trained_counts.get(user, 0)
+        if count < seen or (count > seen and user not in known_users):
+            return train_ml_models()
+    if set(trained_counts) - set(sample_counts):
+        return train_ml_models()
+    if sample_counts == trained_counts:
+        return True
+
+    # Never mutate the live set: requests may be using it right now
+    X_new, y_new = rows.matrix(model_set.vectorizer.vocabulary_, skip=trained_counts)
+    scaler = model_set.scaler
+    classifier = model_set.classifier
+    updated_scaler = copy.deepcopy(scaler)
+    updated_scaler.partial_fit(X_new)
+    updated = partial_fit_classifier(classifier, updated_scaler.transform(X_new), y_new)
+    if updated is not None:
+        scaler, classifier = updated_scaler, updated
+
+    X_ref, y_ref = model_set.reference
+    X_ref = sparse.vstack([X_ref, X_new]).tocsr()
+    y_ref = np.concatenate([y_ref, y_new])
+    knn = fit_knn(scaler.transform(X_ref), y_ref)
+
+    MODEL_REGISTRY.publish({
+        'vectorizer': model_set.vectorizer,
+        'scaler': scaler,
+        'knn': knn,
+        'classifier': classifier,
+        'reference': (X_ref, y_ref)
+    }, sample_counts, model_set.full_trained_at, model_set.training)
+    return True
+
 def load_ml_models():
-    """Load trained ML models"""
-    try:
-        with open(os.path.join(MODELS_DIR, 'scaler.pkl'), 'rb') as f:
-            scaler = pickle.load(f)
-        with open(os.path.join(MODELS_DIR, 'knn.pkl'), 'rb') as f:
-            knn = pickle.load(f)
-        with open(os.path.join(MODELS_DIR, 'svm.pkl'), 'rb') as f:
-            svm = pickle.load(f)
-        return scaler, knn, svm
-    except:
-        return None, None, None
-
-def predict_ml(sample_features):
-    """Predict user using ML models"""
-    scaler, knn, svm = load_ml_models()
-    if scaler is None:
-        return 'Unknown User', 0, {}, []
-    
-    # Prepare feature vector
-    feature_vector = []
-    for key in sorted(sample_features.keys()):
-        feature_vector.append(sample_features[key])
+    """Return the live ModelSet, or None if no models have been trained"""
+    return MODEL_REGISTRY.current()
+
+def ensemble_vote(knn, classifier, X_scaled):
+    """Return (predicted users, confidences) of the KNN + classifier ensemble"""
+    # Get predictions from both models
+    knn_pred = knn.predict(X_scaled)
+    clf_pred = classifier.predict(X_scaled)
+    knn_conf = knn.predict_proba(X_scaled).max(axis=1)
+    clf_conf = classifier.predict_proba(X_scaled).max(axis=1)
     
-    X_sample = np.array([feature_vector])
-    X_sample_scaled = scaler.transform(X_sample)
+    # Use ensemble (majority vote); if models disagree, use the one with
+    # higher confidence
+    agree = knn_pred == clf_pred
+    predicted = np.where(agree | (knn_conf > clf_conf), knn_pred, clf_pred)
+    confidence = np.where(agree, (knn_conf + clf_conf) / 2, np.maximum(knn_conf, clf_conf))
+    return predicted, confidence
+
+def predict_ml_batch(features_list, model_set=None):
+    """Predict users for many n-gram feature dicts with one pass per model"""
+    model_set = model_set or load_ml_models()
+    if model_set is None:
+        return [('Unknown User', 0, {}, [])] * len(features_list)
     
-    # Get predictions from both models
-    knn_pred = knn.predict(X_sample_scaled)[0]
-    svm_pred = svm.predict(X_sample_scaled)[0]
-    knn_prob = knn.predict_proba(X_sample_scaled)[0]
-    svm_prob = svm.predict_proba(X_sample_scaled)[0]
+    # Prepare feature vectors in the training-time column layout;
+    # n-grams never seen during training are dropped
+    X = model_set.vectorizer.transform(features_list)
+    X_scaled = model_set.scaler.transform(X)
+    predicted, confidence = ensemble_vote(model_set.knn, model_set.classifier, X_scaled)
     
-    # Use ensemble (majority vote)
-    if knn_pred == svm_pred:
-        predicted_user = knn_pred
-        confidence = (np.max(knn_prob) + np.max(svm_prob)) / 2
-    else:
-        # If models disagree, use the one with higher confidence
-        knn_conf = np.max(knn_prob)
-        svm_conf = np.max(svm_prob)
-        if knn_conf > svm_conf:
-            predicted_user = knn_pred
-            confidence = knn_conf
+    return [(str(user), float(conf), {}, []) for user, conf in zip(predicted, confidence)]
+
+def predict_ml(sample_features, model_set=None):
+    """Predict user using ML models"""
+    return predict_ml_batch([sample_features], model_set)[0]
+
+# ===== BACKGROUND TRAINING =====
+class TrainingWorker:
+    """Daemon thread that retrains the ML models off the request path.
+
+    ``request()`` only flags that a retrain is wanted; ``train_fn(full=...)``
+    is told whether the request was forced. Requests arriving
+    within ``debounce`` seconds of the first one are coalesced into a single
+    job, and a job is skipped when the training data fingerprint equals
+    either the live model's or the last attempted one. While idle the worker
+    polls the fingerprint every ``poll_interval`` seconds, so new enrollments
+    schedule a retrain without any request asking for it. The live model
+    keeps serving until ``train_fn`` publishes its replacement.
+    """
+
+    def __init__(self, train_fn, fingerprint_fn, live_fingerprint_fn,
+                 debounce=2.0, poll_interval=10.0):
+        self.train_fn = train_fn
+        self.fingerprint_fn = fingerprint_fn
+        self.live_fingerprint_fn = live_fingerprint_fn
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pending_since = None
+        self._forced = False
+        self._last_attempt = None
+        self._status = {
+            'state': 'idle',
+            'runs': 0,
+            'requests': 0,
+            'last_started': None,
+            'last_finished': None,
+            'last_result': None,
+            'last_error': None
+        }
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='training-worker', daemon=True)
+                self._thread.start()
+
+    def request(self, force=False):
+        """Ask for a retrain; bursts of requests collapse into one job"""
+        self.start()
+        with self._cond:
+            self._status['requests'] += 1
+            self._forced = self._forced or force
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._status['state'] = 'scheduled'
+                self._cond.notify_all()
+
+    def needs_training(self):
+        """True if the training data changed since the live model and the last attempt"""
+        fingerprint = self.fingerprint_fn()
+        return fingerprint != self._last_attempt and fingerprint != self.live_fingerprint_fn()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending_since is None:
+                    self._cond.wait(self.poll_interval)
+                    if self._pending_since is None and self.needs_training():
+                        self._pending_since = time.monotonic()
+                        self._status['state'] = 'scheduled'
+                # Let the rest of a burst arrive before training once
+                while True:
+                    remaining = self._pending_since + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                forced = self._forced
+                self._pending_since = None
+                self._forced = False
+
+            if not forced and not self.needs_training():
+                with self._cond:
+                    self._status['state'] = 'idle'
+                    self._cond.notify_all()
+                continue
+
+            with self._cond:
+                self._status['state'] = 'training'
+                self._status['last_started'] = utc_now()
+            self._last_attempt = self.fingerprint_fn()
+            try:
+                result = 'published' if self.train_fn(full=forced) else 'insufficient_data'
+                error = None
+            except Exception as e:
+                result, error = 'error', str(e)
+            with self._cond:
+                self._status.update({
+                    'state': 'scheduled' if self._pending_since is not None else 'idle',
+                    'runs': self._status['runs'] + 1,
+                    'last_finished': utc_now(),
+                    'last_result': result,
+                    'last_error': error
+                })
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until no job is scheduled or running; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._pending_since is None and self._status['state'] == 'idle', timeout)
+
+    def status(self):
+        with self._cond:
+            status = dict(self._status)
+        status['running'] = self._thread is not None and self._thread.is_alive()
+        return status
+
+def live_model_counts():
+    model_set = load_ml_models()
+    return model_set.sample_counts if model_set is not None else None
+
+TRAINING_WORKER = TrainingWorker(update_ml_models, training_data_counts, live_model_counts)
+
+# ===== CASCADE METHOD =====
+# Cheapest method first: statistical scoring shortlists CASCADE_SHORTLIST
+# users, n-gram similarity re-ranks the shortlist, and the ML ensemble only
+# runs when the shortlist is still ambiguous. A stage whose best score
+# reaches its exit score with the required lead over the runner-up ends
+# the cascade early.
+CASCADE_SHORTLIST = 20
+# stage -> (minimum best score, minimum lead over the second best)
+CASCADE_EXIT = {'statistical': (1.0, 0.5), 'ngram': (0.85, 0.1)}
+# stage -> acceptance needed for the final answer, as in the single methods
+CASCADE_THRESHOLDS = {'statistical': 0.7, 'ngram': 0.6, 'ml': 0.0}
+
+def ngram_row_lookup(store=None):
+    """{user: n-gram index row} and the index entries as CSR, for scoring subsets"""
+    store = store or PROFILE_STORE
+
+    def build(entries):
+        index = load_ngram_index(store)
+        return {user: row for row, user in enumerate(index.users)}, index.entries.tocsr()
+
+    return store.derived('ngram_rows', build)
+
+def ranked_users(users, scores, k):
+    """[(user, score)] of the k best scores, best first"""
+    scores = np.asarray(scores, dtype=float)
+    return [(users[i], float(scores[i])) for i in top_k_indices(scores, k)]
+
+def cascade_confident(stage, ranked):
+    if stage not in CASCADE_EXIT or not ranked:
+        return False
+    min_score, min_lead = CASCADE_EXIT[stage]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return ranked[0][1] >= min_score and ranked[0][1] - runner_up >= min_lead
+
+def cascade_stage(stage, start, scored, ranked):
+    elapsed = time.perf_counter() - start
+    record_stage(stage, elapsed, 'cascade')
+    return {
+        'stage': stage,
+        'ms': round(elapsed * 1000, 3),
+        'candidates': scored,
+        'shortlist': len(ranked),
+        'best_user': ranked[0][0] if ranked else None,
+        'best_score': ranked[0][1] if ranked else 0.0,
+        'confident': cascade_confident(stage, ranked)
+    }
+
+def compare_sample_cascade(sample_vec, sample_features, shortlist_size=None):
+    """Identify one sample with the statistical -> n-gram -> ML cascade
+
+    Either input may be missing (None), in which case its stage is skipped.
+    The analysis holds one entry per stage run, with its time, the number
+    of users it scored and its shortlist, and the stage that decided.
+    """
+    shortlist_size = shortlist_size or CASCADE_SHORTLIST
+    stages = []
+    ranked = []  # [(user, score)] best first, from the deciding stage
+    decided_by = None
+    shortlist = None  # users still in the running; None means everyone
+
+    if sample_vec is not None:
+        start = time.perf_counter()
+        index = load_statistical_index()
+        candidates = load_statistical_candidates()
+        if candidates is not None:
+            index = statistical_subindex(index, candidates.query(sample_vec)[0])
+        if index.users:
+            accepts = acceptance_percentage(sample_vec, index.means, index.stds)
+            ranked = ranked_users(index.users, accepts, shortlist_size)
+            shortlist = [user for user, _ in ranked]
+            decided_by = 'statistical'
+            stages.append(cascade_stage('statistical', start, len(index.users), ranked))
+
+    if sample_features and not cascade_confident(decided_by, ranked):
+        start = time.perf_counter()
+        index = load_ngram_index()
+        if shortlist is not None:
+            row_of, index_rows = ngram_row_lookup()
+            index = ngram_subindex(index, index_rows,
+                                   sorted(row_of[user] for user in shortlist if user in row_of))
         else:
-            predicted_user = svm_pred
-            confidence = svm_conf
-    
-    return predicted_user, confidence, {}, []
+            candidates = load_ngram_candidates()
+            if candidates is not None:
+                index = ngram_subindex(index, candidates.rows, candidates.query(sample_features)[0])
+        user_ids, scores = ngram_user_scores(sample_features, index)
+        ngram_ranked = ranked_users([index.users[i] for i in user_ids], scores, shortlist_size)
+        stages.append(cascade_stage('ngram', start, len(index.users), ngram_ranked))
+        # Keep the statistical ranking if no shortlisted user shares an n-gram
+        if ngram_ranked:
+            ranked = ngram_ranked
+            shortlist = [user for user, _ in ranked]
+            decided_by = 'ngram'
+
+    if sample_features and ranked and not cascade_confident(decided_by, ranked):
+        model_set = load_ml_models()
+        if model_set is None:
+            stages.append({'stage': 'ml', 'skipped': 'no live model'})
+        else:
+            start = time.perf_counter()
+            X = model_set.scaler.transform(model_set.vectorizer.transform([sample_features]))
+            proba = Counter()
+            for model in (model_set.knn, model_set.classifier):
+                for user, p in zip(model.classes_, model.predict_proba(X)[0]):
+                    proba[str(user)] += p / 2
+            users = [user for user in shortlist if user in proba]
+            ml_ranked = ranked_users(users, [proba[user] for user in users], shortlist_size)
+            stages.append(cascade_stage('ml', start, len(users), ml_ranked))
+            if ml_ranked:
+                ranked = ml_ranked
+                decided_by = 'ml'
+
+    analysis = {'stages': stages, 'decided_by': decided_by}
+    if not ranked:
+        return 'Unknown User', 0, analysis, []
+    best_user, best_score = ranked[0]
+    all_matches = [{
+        'user': user,
+        'acceptance': score,
+        'method': f"Cascade ({decided_by}): {score*100:.1f}%"
+    } for user, score in ranked[:5]]
+    if best_score < CASCADE_THRESHOLDS[decided_by]:
+        best_user = 'Unknown User'
+    return best_user, best_score, analysis, all_matches
+
+# ===== RESULT CACHE =====
+# Results of recently identified samples, for client retries and audit
+# jobs that re-score the same sessions. Keys combine a digest of the
+# sample's normalized features (what the method actually scores, so
+# resubmitting with a new timestamp still hits), the method, and the
+# profile and model versions the result was computed against. A new
+# enrollment bumps the profile version, which empties the cache, so a
+# result is never served against profiles other than its own.
+
+def sample_digest(sample_vec, sample_features):
+    digest = hashlib.blake2b(digest_size=16)
+    if sample_vec is not None:
+        digest.update(np.asarray(sample_vec, dtype=float).tobytes())
+    digest.update(b'|')
+    if sample_features:
+        digest.update(json.dumps(sorted(sample_features.items())).encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    """Bounded LRU of identification results with a time-to-live.
+
+    ``key()`` reads the current profile store and version (and, for
+    model-based methods, the model version); entries computed against other
+    profiles are dropped the first time newer ones are seen.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires at, result)
+        self._profiles = None  # (profile store, version) of the entries
+        self._lock = threading.Lock()
+
+    def key(self, method, sample_vec, sample_features):
+        profiles = (PROFILE_STORE, PROFILE_STORE.refresh())
+        model_version = 0
+        if method in ('ml', 'cascade'):
+            model_set = load_ml_models()
+            model_version = model_set.version if model_set is not None else 0
+        return (profiles, model_version, method, sample_digest(sample_vec, sample_features))
+
+    def _invalidate(self, profiles):
+        # Caller holds the lock
+        if profiles != self._profiles:
+            if self._entries:
+                METRICS.inc('identify_cache_evictions_total', len(self._entries), reason='invalidated')
+            self._entries.clear()
+            self._profiles = profiles
+
+    def get(self, key):
+        """Return a copy of the cached result marked ``cached``, or None"""
+        with self._lock:
+            self._invalidate(key[0])
+            item = self._entries.get(key)
+            if item is not None and item[0] <= time.monotonic():
+                del self._entries[key]
+                METRICS.inc('identify_cache_evictions_total', reason='expired')
+                item = None
+            METRICS.inc('identify_cache_requests_total', method=key[2],
+                        result='miss' if item is None else 'hit')
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return dict(copy.deepcopy(item[1]), cached=True)
+
+    def put(self, key, result):
+        if self.max_size <= 0:
+            return
+        result = copy.deepcopy(result)
+        if 'analysis' in result:
+            # The cascade's stage timings and candidate counts describe the
+            # computation that ran, not a later cache hit
+            result['analysis'].pop('stages', None)
+        with self._lock:
+            if key[0] != self._profiles:
+                return  # profiles changed while computing; the result is already superseded
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                METRICS.inc('identify_cache_evictions_total', reason='size')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+# ===== BINARY UPLOADS =====
+# Clients may post a sample as application/x-keystrokes instead of JSON,
+# the compact format defined in common/keystrokes.py that typing_game's
+# /submit accepts as well. The events decode straight into the
+# timing_arrays of a sample, with hold, flight and down-down times derived
+# from them.
+
+def request_sample():
+    """The posted sample: a decoded binary upload, else the JSON body
+
+    Raises ValueError for a malformed upload or a body that is not a JSON object.
+    """
+    if request.mimetype == KEYSTROKES_MIMETYPE:
+        return decode_keystrokes(request.get_data())
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('expected a JSON object')
+    return data
+
+def malformed_upload(error):
+    return jsonify({'error': f'Malformed upload: {error}'}), 400
 
 # ===== MAIN IDENTIFICATION ENDPOINT =====
+IDENTIFY_METHODS = ('statistical', 'ngram', 'ml', 'cascade')
+
+def request_summary_vector(data):
+    """Summary vector of a submitted sample, or None if it is too short"""
+    # Binary uploads carry NumPy arrays, which have no truth value
+    hold, flight, dd = ([] if data.get(field) is None else data.get(field)
+                        for field in ('hold_times', 'flight_times', 'down_down_times'))
+    if len(hold) < 5 or len(flight) < 4 or len(dd) < 4:
+        return None
+    return summary_vector({
+        'hold': np.array(hold),
+        'flight': np.array(flight),
+        'dd': np.array(dd)
+    })
+
+def match_result(match, method):
+    user, acceptance, analysis, all_matches = match
+    return {
+        'user': user,
+        'acceptance': float(acceptance),
+        'analysis': analysis,
+        'all_matches': all_matches,
+        'method': method
+    }
+
+def live_model_or_error():
+    """Return (model_set, None), or (None, error result) if no model is live yet"""
+    # Training runs in the background; new enrollments are picked up
+    # there while the live model keeps serving
+    TRAINING_WORKER.start()
+    model_set = load_ml_models()
+    if model_set is not None:
+        return model_set, None
+    status = TRAINING_WORKER.status()
+    if status['last_result'] == 'insufficient_data' and not TRAINING_WORKER.needs_training():
+        return None, {'error': 'Insufficient training data for ML models', 'status': 400}
+    TRAINING_WORKER.request()
+    return None, {'error': 'ML models are being trained, try again shortly',
+                  'training': TRAINING_WORKER.status(), 'status': 503}
+
+def identify_samples(samples, method):
+    """Identify a list of submitted samples with one method.
+
+    Returns one result per sample, in order. Failed samples get an
+    ``error`` result carrying the HTTP ``status`` /identify would use.
+    """
+    if not method_loaded(method):
+        with timed_stage('method_load', method):
+            load_method(method)
+    with timed_stage('feature_extraction', method):
+        inputs = extract_sample_inputs(samples, method)
+    results = [None] * len(samples)
+    keys = [RESULT_CACHE.key(method, vec, features) for vec, features in zip(*inputs)]
+    misses = []
+    for i, key in enumerate(keys):
+        results[i] = RESULT_CACHE.get(key)
+        if results[i] is None:
+            misses.append(i)
+    if misses:
+        computed = run_identification([samples[i] for i in misses], method,
+                                      tuple([values[i] for i in misses] for values in inputs))
+        for i, result in zip(misses, computed):
+            results[i] = result
+            # Errors (no live model yet, too little data) are not worth keeping
+            if 'error' not in result:
+                RESULT_CACHE.put(keys[i], result)
+
+    for result in results:
+        if 'error' in result:
+            outcome = 'error'
+        elif result.get('user') in ('Unknown User', 'No profiles found'):
+            outcome = 'unknown'
+        else:
+            outcome = 'match'
+        METRICS.inc('identify_results_total', method=method, outcome=outcome)
+    return results
+
+def extract_sample_inputs(samples, method):
+    """(summary vectors, n-gram features) of submitted samples, one each per sample.
+
+    Only what the method scores is extracted; the rest is None or empty.
+    """
+    if method in ('statistical', 'cascade'):
+        vecs = [request_summary_vector(data) for data in samples]
+    else:
+        vecs = [None] * len(samples)
+    if method == 'statistical':
+        features = [{} for _ in samples]
+    else:
+        features = extract_ngram_features_bulk(samples)
+    return vecs, features
+
+def run_identification(samples, method, inputs=None):
+    """Identify samples without the result cache; inputs are their extract_sample_inputs()"""
+    if inputs is None:
+        with timed_stage('feature_extraction', method):
+            inputs = extract_sample_inputs(samples, method)
+    vecs, features = inputs
+    results = [None] * len(samples)
+    no_profiles = {'user': 'No profiles found', 'acceptance': 0}
+
+    if method == 'cascade':
+        for i, (sample_vec, sample_features) in enumerate(zip(vecs, features)):
+            if sample_vec is None and not sample_features:
+                results[i] = {'error': 'Insufficient typing data', 'status': 400}
+            else:
+                results[i] = match_result(compare_sample_cascade(sample_vec, sample_features), method)
+        return results
+
+    if method == 'statistical':
+        valid = [i for i, vec in enumerate(vecs) if vec is not None]
+        for i in set(range(len(samples))) - set(valid):
+            results[i] = {'error': 'Insufficient typing data', 'status': 400}
+        with timed_stage('profile_load', method):
+            index = load_statistical_index()
+            candidates = load_statistical_candidates()
+        if valid and not index.users:
+            for i in valid:
+                results[i] = dict(no_profiles)
+        elif valid:
+            with timed_stage('scoring', method):
+                matches = compare_samples_to_profiles_statistical(
+                    [vecs[i] for i in valid], index, candidates=candidates)
+            for i, match in zip(valid, matches):
+                results[i] = match_result(match, method)
+        return results
+
+    valid = [i for i, sample_features in enumerate(features) if sample_features]
+    for i in set(range(len(samples))) - set(valid):
+        results[i] = {'error': 'No n-gram features found', 'status': 400}
+    if not valid:
+        return results
+
+    if method == 'ngram':
+        with timed_stage('profile_load', method):
+            index = load_ngram_index()
+            candidates = load_ngram_candidates()
+        with timed_stage('scoring', method):
+            for i in valid:
+                if not index.users:
+                    results[i] = dict(no_profiles)
+                else:
+                    match = compare_sample_to_profiles_ngram(features[i], index, candidates=candidates)
+                    results[i] = match_result(match, method)
+
+    elif method == 'ml':
+        with timed_stage('model_load', method):
+            model_set, error = live_model_or_error()
+        if error is not None:
+            for i in valid:
+                results[i] = dict(error)
+            return results
+        with timed_stage('scoring', method):
+            matches = predict_ml_batch([features[i] for i in valid], model_set)
+        for i, match in zip(valid, matches):
+            results[i] = dict(match_result(match, method), model_version=model_set.version)
+
+    else:
+        raise ValueError(f'Invalid method: {method}')
+    return results
+
+def iter_identify_batch(samples, method='statistical', chunk_size=None):
+    """Yield identification results for many samples, in order, chunk by chunk"""
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    if method not in IDENTIFY_METHODS:
+        raise ValueError(f'Invalid method: {method}')
+    for start in range(0, len(samples), chunk_size):
+        yield from identify_samples(samples[start:start + chunk_size], method)
+
+def identify_batch(samples, method='statistical'):
+    """Identify many samples at once; returns one result dict per sample"""
+    return list(iter_identify_batch(samples, method))
+
 @app.route('/identify', methods=['POST'])
 def identify():
-    data = request.get_json()
+    try:
+        data = request_sample()
+    except ValueError as e:
+        return malformed_upload(e)
     method = data.get('method', 'statistical')
+    if method not in IDENTIFY_METHODS:
+        return jsonify({'error': 'Invalid method'}), 400
     
-    if method == 'statistical':
-        # Original statistical method
-        hold = data.get('hold_times', [])
-        flight = data.get('flight_times', [])
-        dd = data.get('down_down_times', [])
-        
-        if len(hold) < 5 or len(flight) < 4 or len(dd) < 4:
-            return jsonify({'error': 'Insufficient typing data'}), 400
-        
-        sample_vec = summary_vector({
-            'hold': np.array(hold), 
-            'flight': np.array(flight), 
-            'dd': np.array(dd)
-        })
-        
-        profiles = load_profiles_statistical()
-        if not profiles:
-            return jsonify({'user': 'No profiles found', 'acceptance': 0})
-        
-        user, acceptance, analysis, all_matches = compare_sample_to_profiles_statistical(sample_vec, profiles)
-        
-        return jsonify({
-            'user': user,
-            'acceptance': float(acceptance),
-            'analysis': analysis,
-            'all_matches': all_matches,
-            'method': 'statistical'
-        })
-    
-    elif method == 'ngram':
-        # N-gram method
-        sample_features = extract_ngram_features(data)
-        if not sample_features:
-            return jsonify({'error': 'No n-gram features found'}), 400
-        
-        profiles = load_profiles_ngram()
-        if not profiles:
-            return jsonify({'user': 'No profiles found', 'acceptance': 0})
-        
-        user, acceptance, analysis, all_matches = compare_sample_to_profiles_ngram(sample_features, profiles)
-        
-        return jsonify({
-            'user': user,
-            'acceptance': float(acceptance),
-            'analysis': analysis,
-            'all_matches': all_matches,
-            'method': 'ngram'
-        })
+    result = identify_samples([data], method)[0]
+    if 'error' in result:
+        status = result.pop('status', 400)
+        return jsonify(result), status
+    return jsonify(result)
+
+@app.route('/identify/batch', methods=['POST'])
+def identify_batch_endpoint():
+    """Identify a list of samples; {"stream": true} streams NDJSON results in order"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    method = data.get('method', 'statistical')
+    samples = data.get('samples')
+    if method not in IDENTIFY_METHODS:
+        return jsonify({'error': 'Invalid method'}), 400
+    if not isinstance(samples, list):
+        return jsonify({'error': 'No samples provided'}), 400
+    if not all(isinstance(sample, dict) for sample in samples):
+        return jsonify({'error': 'Every sample must be a JSON object'}), 400
     
-    elif method == 'ml':
-        # Machine learning method
-        sample_features = extract_ngram_features(data)
-        if not sample_features:
-            return jsonify({'error': 'No n-gram features found'}), 400
-        
-        # Try to train models if they don't exist
-        scaler, knn, svm = load_ml_models()
-        if scaler is None:
-            if train_ml_models():
-                scaler, knn, svm = load_ml_models()
+    if data.get('stream'):
+        def generate():
+            for result in iter_identify_batch(samples, method):
+                yield json.dumps(result) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    return jsonify({'method': method, 'results': identify_batch(samples, method)})
+
+# ===== VERIFICATION =====
+# 1:1 verification of a claimed identity. Only the claimed user's profile
+# is read and scored, so the cost does not grow with the population: the
+# profile store refreshes just that user's files, and serve-mode workers
+# look the user's rows up in the shared indexes. The ML method evaluates
+# only the claimed user's KNN reference rows and decision function.
+VERIFY_METHODS = ('statistical', 'ngram', 'ml')
+
+# The claimed user's mean/std summary vectors (None without timing data)
+# and {n-gram: (mean, std)} of their n-gram timings
+VerifyProfile = namedtuple('VerifyProfile', ['summary', 'ngrams'])
+
+class ThresholdFile:
+    """Per-user verification thresholds, re-read when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._thresholds = {}
+        self._lock = threading.Lock()
+
+    def threshold(self, username, method):
+        with self._lock:
+            try:
+                stamp = file_stamp(os.stat(self.path))
+            except FileNotFoundError:
+                stamp = None
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._thresholds = {}
+                if stamp is not None:
+                    try:
+                        with open(self.path, 'r') as f:
+                            self._thresholds = json.load(f)
+                    except (OSError, ValueError):
+                        pass
+            user = self._thresholds.get(username)
+        if isinstance(user, dict) and method in user:
+            return float(user[method])
+        return VERIFY_THRESHOLDS[method]
+
+VERIFY_USER_THRESHOLDS = ThresholdFile(VERIFY_THRESHOLDS_FILE)
+
+def verify_rows(store):
+    """Row lookups into the shared indexes, for stores without per-user entries"""
+
+    def build(entries):
+        statistical = load_statistical_index(store)
+        ngram = load_ngram_index(store)
+        ngram_row_of, ngram_rows = ngram_row_lookup(store)
+        return {
+            'statistical': statistical,
+            'statistical_row_of': {user: row for row, user in enumerate(statistical.users)},
+            'ngram': ngram,
+            'ngram_row_of': ngram_row_of,
+            'ngram_rows': ngram_rows,
+            'ngram_names': sorted(ngram.vocab, key=ngram.vocab.get)
+        }
+
+    return store.derived('verify_rows', build)
+
+def load_verify_profile(username, store=None):
+    """The claimed user's VerifyProfile, or None if they are not enrolled"""
+    store = store or PROFILE_STORE
+    if isinstance(store, ProfileStore):
+        entry = store.user_entry(username)
+        if entry is None:
+            return None
+        profile = entry['profile']
+        summary = (profile.summary.mean, profile.summary.std) if profile.summary.count else None
+        ngrams = {name: tuple(stats.mean) for name, stats in profile.ngrams.items()}
+    else:
+        rows = verify_rows(store)
+        row = rows['statistical_row_of'].get(username)
+        summary = None
+        if row is not None:
+            summary = (rows['statistical'].means[row], rows['statistical'].stds[row])
+        ngrams = {}
+        row = rows['ngram_row_of'].get(username)
+        if row is not None:
+            matrix = rows['ngram_rows']
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            for col, entry_id in zip(matrix.indices[start:end], matrix.data[start:end]):
+                ngrams[rows['ngram_names'][col]] = (rows['ngram'].means[entry_id - 1],
+                                                    rows['ngram'].stds[entry_id - 1])
+    if summary is None and not ngrams:
+        return None
+    return VerifyProfile(summary, ngrams)
+
+def verify_score_statistical(sample_vec, profile):
+    if profile.summary is None:
+        return None
+    mean_vec, std_vec = profile.summary
+    return float(acceptance_percentage(sample_vec, mean_vec, std_vec))
+
+def verify_score_ngram(sample_features, profile):
+    """The n-gram similarity ngram_user_scores would give this one user
+
+    None if the user has no n-gram profile; 0.0 if the sample shares none
+    of their n-grams, which /identify would score the same way.
+    """
+    if not profile.ngrams:
+        return None
+    sample_vals, user_vals = [], []
+    for key, value in sample_features.items():
+        name, stat = key.rsplit('_', 1)
+        if stat == 'mean' and name in profile.ngrams:
+            user_mean, user_std = profile.ngrams[name]
+            sample_vals += [value, sample_features.get(f'{name}_std', 0.0)]
+            user_vals += [user_mean, user_std]
+    if not sample_vals:
+        return 0.0
+    return float(np.mean(ngram_similarity(np.array(sample_vals), np.array(user_vals))))
+
+def row_sq_norms(A):
+    return np.asarray(A.multiply(A).sum(axis=1)).ravel()
+
+def sparse_distances(A, B, sq_b=None):
+    """Euclidean distances between the rows of two sparse matrices
+
+    ``sq_b`` are B's squared row norms, when they are kept around.
+    """
+    sq_b = row_sq_norms(B) if sq_b is None else sq_b
+    cross = (A @ B.T).toarray()
+    return np.sqrt(np.maximum(row_sq_norms(A)[:, None] + sq_b[None, :] - 2 * cross, 0))
+
+class SVCPairs:
+    """An RBF SVC's one-vs-one SVMs, evaluated for one class at a time
+
+    libsvm's decision for the pair (i, j), i < j, weighs class i's support
+    vectors by dual_coef_ row j - 1 and class j's by row i, and its
+    intercept sits at the pair's position in (0, 1), (0, 2), ... Evaluating
+    only the k - 1 pairs of one class skips the other pairs and the
+    probability coupling predict_proba runs over all of them.
+    """
+
+    def __init__(self, svc):
+        self.svc = svc
+        self.n = len(svc.classes_)
+        self.sv_class = np.repeat(np.arange(self.n), svc.n_support_)
+        self.support_vectors = sparse.csr_matrix(svc.support_vectors_)
+        self.sv_norms = row_sq_norms(self.support_vectors)
+        self.dual_rows = sparse.csr_matrix(svc.dual_coef_)
+        self.dual_cols = sparse.csc_matrix(svc.dual_coef_)
+
+    def decisions(self, X, index):
+        """Decisions of the pairs between ``index`` and each other class, positive favouring ``index``"""
+        n, sv_class = self.n, self.sv_class
+        distances = sparse_distances(X, self.support_vectors, self.sv_norms)[0]
+        kernel = np.exp(-self.svc._gamma * distances ** 2)  # _gamma: the value gamma='scale' resolved to
+        own = sv_class == index
+        own_terms = self.dual_cols[:, np.flatnonzero(own)] @ kernel[own]
+        above = self.dual_rows[[min(index, n - 2)]].toarray()[0]
+        below = self.dual_rows[[max(index - 1, 0)]].toarray()[0]
+        other_terms = np.where(own, 0, np.where(sv_class > index, above, below) * kernel)
+        other_sums = np.bincount(sv_class, weights=other_terms, minlength=n)
+
+        others = np.delete(np.arange(n), index)
+        i, j = np.minimum(index, others), np.maximum(index, others)
+        pairs = i * (2 * n - i - 1) // 2 + (j - i - 1)
+        values = (own_terms[np.where(others > index, others - 1, others)] + other_sums[others]
+                  + self.svc.intercept_[pairs])
+        # Multiclass decisions favour i when positive; the binary one favours classes_[1]
+        return np.where((i == index) != (n == 2), values, -values)
+
+class MLVerifier:
+    """Scores samples against one claimed user of a ModelSet
+
+    Built once per model set: it maps every user to their rows of the KNN
+    reference set and to their classifier class, so a verification only
+    measures the sample against the claimed user's reference rows and
+    evaluates that user's decision function.
+
+    The KNN score takes the user's k reference rows nearest the sample and
+    counts those the sample is closer to than any other user's reference
+    row is, a one-user version of the KNN's neighbour vote. Each row's
+    distance to the nearest other user is computed once per model set, when
+    the user is first verified. The classifier score is the logistic of the
+    user's row of a linear model's decision function and, for an SVC, of
+    the smallest margin among the user's one-vs-one SVMs.
+    """
+
+    def __init__(self, model_set):
+        self.model_set = model_set
+        _, y_ref = model_set.reference
+        order = np.argsort(y_ref, kind='stable')
+        users, starts = np.unique(y_ref[order], return_index=True)
+        self.reference_rows = {str(user): rows for user, rows in zip(users, np.split(order, starts[1:]))}
+        self.class_index = {str(user): i for i, user in enumerate(model_set.classifier.classes_)}
+        classifier = model_set.classifier
+        self.final = classifier[-1] if hasattr(classifier, 'steps') else classifier
+        self.svc_pairs = SVCPairs(self.final) if not hasattr(self.final, 'coef_') else None
+        self._scaled_reference = None
+        # username -> (scaled rows, their squared norms, distance of each to the nearest other user)
+        self._references = {}
+        self._lock = threading.Lock()
+
+    def _reference(self, username):
+        with self._lock:
+            reference = self._references.get(username)
+            if reference is None:
+                if self._scaled_reference is None:
+                    self._scaled_reference = self.model_set.scaler.transform(self.model_set.reference[0]).tocsr()
+                own = np.zeros(self._scaled_reference.shape[0], dtype=bool)
+                own[self.reference_rows[username]] = True
+                rows = self._scaled_reference[np.flatnonzero(own)]
+                radius = np.full(rows.shape[0], np.inf)
+                if not own.all():
+                    radius = sparse_distances(rows, self._scaled_reference[np.flatnonzero(~own)]).min(axis=1)
+                reference = self._references[username] = (rows, row_sq_norms(rows), radius)
+        return reference
+
+    def knn_score(self, X, username):
+        rows, norms, radius = self._reference(username)
+        distances = sparse_distances(X, rows, norms)[0]
+        nearest = np.argsort(distances)[:self.model_set.knn.n_neighbors]
+        return float(np.mean(distances[nearest] < radius[nearest]))
+
+    def classifier_score(self, X, username):
+        index = self.class_index[username]
+        if self.svc_pairs is not None:
+            decision = self.svc_pairs.decisions(X, index).min()
+        else:
+            if self.final is not self.model_set.classifier:
+                X = self.model_set.classifier[:-1].transform(X)
+            coef, intercept = self.final.coef_, self.final.intercept_
+            if coef.shape[0] == 1:
+                # Two classes share one decision, positive for classes_[1]
+                decision = (np.asarray(X @ coef[0]).ravel()[0] + intercept[0]) * (1 if index == 1 else -1)
             else:
-                return jsonify({'error': 'Insufficient training data for ML models'}), 400
-        
-        user, acceptance, analysis, all_matches = predict_ml(sample_features)
-        
-        return jsonify({
-            'user': user,
-            'acceptance': float(acceptance),
-            'analysis': analysis,
-            'all_matches': all_matches,
-            'method': 'ml'
-        })
-    
+                decision = np.asarray(X @ coef[index]).ravel()[0] + intercept[index]
+        return float(0.5 * (1 + np.tanh(decision / 2)))
+
+_ml_verifier = None
+_ml_verifier_lock = threading.Lock()
+
+def ml_verifier(model_set):
+    """The MLVerifier of the model set, rebuilt only when the live version changes"""
+    global _ml_verifier
+    with _ml_verifier_lock:
+        if _ml_verifier is None or _ml_verifier.model_set is not model_set:
+            _ml_verifier = MLVerifier(model_set)
+        return _ml_verifier
+
+def verify_score_ml(sample_features, username, model_set):
+    """Mean KNN and classifier score of the claimed user, None if the models do not know them"""
+    verifier = ml_verifier(model_set)
+    if username not in verifier.class_index:
+        return None
+    X = model_set.scaler.transform(model_set.vectorizer.transform([sample_features]))
+    return (verifier.knn_score(X, username) + verifier.classifier_score(X, username)) / 2
+
+def verify_sample(username, data, method='statistical'):
+    """Verify that a submitted sample was typed by the claimed user.
+
+    Returns a result dict; failures carry an ``error`` and the HTTP
+    ``status`` /verify would use.
+    """
+    if not method_loaded(method):
+        with timed_stage('method_load', method):
+            load_method(method)
+    with timed_stage('feature_extraction', method):
+        vecs, features = extract_sample_inputs([data], method)
+    sample_vec, sample_features = vecs[0], features[0]
+    if method == 'statistical' and sample_vec is None:
+        return {'error': 'Insufficient typing data', 'status': 400}
+    if method != 'statistical' and not sample_features:
+        return {'error': 'No n-gram features found', 'status': 400}
+
+    if method == 'ml':
+        with timed_stage('model_load', method):
+            model_set, error = live_model_or_error()
+        if error is not None:
+            return dict(error)
+        with timed_stage('scoring', method):
+            score = verify_score_ml(sample_features, username, model_set)
     else:
+        with timed_stage('profile_load', method):
+            profile = load_verify_profile(username)
+        if profile is None:
+            return {'error': f'Unknown user: {username}', 'status': 404}
+        with timed_stage('scoring', method):
+            if method == 'statistical':
+                score = verify_score_statistical(sample_vec, profile)
+            else:
+                score = verify_score_ngram(sample_features, profile)
+    if score is None:
+        return {'error': f'No {method} profile for {username}', 'status': 404}
+
+    threshold = VERIFY_USER_THRESHOLDS.threshold(username, method)
+    return {
+        'user': username,
+        'method': method,
+        'score': score,
+        'threshold': threshold,
+        'accepted': score >= threshold
+    }
+
+@app.route('/verify', methods=['POST'])
+def verify():
+    """Accept or reject a sample as typed by the claimed ``username``"""
+    try:
+        data = request_sample()
+    except ValueError as e:
+        return malformed_upload(e)
+    username = data.get('username')
+    method = data.get('method', 'statistical')
+    if method not in VERIFY_METHODS:
+        return jsonify({'error': 'Invalid method'}), 400
+    if not valid_username(username):
+        return jsonify({'error': 'Invalid username'}), 400
+
+    result = verify_sample(username, data, method)
+    if 'error' in result:
+        METRICS.inc('identify_verify_total', method=method, outcome='error')
+        status = result.pop('status', 400)
+        return jsonify(result), status
+    METRICS.inc('identify_verify_total', method=method,
+                outcome='accept' if result['accepted'] else 'reject')
+    return jsonify(result)
+
+# ===== STREAMING IDENTIFICATION =====
+class RunningStats:
+    """Welford running mean and population std, O(1) per value"""
+
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return (self.m2 / self.n) ** 0.5 if self.n else 0.0
+
+class StreamSession:
+    """Keystroke-by-keystroke identification state for one typing session.
+
+    Events are folded into running statistics as they arrive: hold, flight
+    and down-down times as the client computes them, and down-to-down
+    latencies of consecutive letter keys per digraph and trigraph. Every
+    ``update_every`` key presses a new ranking is computed from those
+    statistics alone, so the work per keystroke never grows with the
+    length of the session. Chunks posted concurrently to one session are
+    applied one at a time. ``updates`` holds only the newest ranking not
+    yet sent to an SSE subscriber, so it stays small when nobody listens.
+    """
+
+    def __init__(self, method='statistical', update_every=5):
+        self.method = method
+        self.update_every = update_every
+        self.hold = RunningStats()
+        self.flight = RunningStats()
+        self.dd = RunningStats()
+        self.ngrams = {}  # 'digraph_th' -> RunningStats
+        self.key_down_times = {}
+        self.last_key_up = None
+        self.last_key_down = None
+        self.recent_letters = []  # (letter, time) of the last key presses
+        self.keystrokes = 0
+        self.ranking = None
+        self.last_active = time.monotonic()
+        self.updates = queue.Queue(maxsize=1)
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add_events(self, events):
+        """Ingest keystroke events; returns the rankings produced on the way"""
+        with self._lock:
+            self.last_active = time.monotonic()
+            rankings = []
+            for event in events:
+                if self._add_event(event) and self.keystrokes % self.update_every == 0:
+                    ranking = self._rank()
+                    if ranking is not None:
+                        rankings.append(ranking)
+            return rankings
+
+    def _add_event(self, event):
+        key = event.get('key') or ''
+        code = event.get('code') or key
+        now = float(event.get('time', 0))
+        if event.get('type') == 'down':
+            self.key_down_times[code] = now
+            if self.last_key_down is not None:
+                self.dd.add(now - self.last_key_down)
+            self.last_key_down = now
+            self._add_ngram_timing(key.lower(), now)
+            self.keystrokes += 1
+            return True
+
+        down = self.key_down_times.pop(code, None)
+        if down is not None:
+            self.hold.add(now - down)
+            if self.last_key_up is not None:
+                self.flight.add(down - self.last_key_up)
+            self.last_key_up = now
+        return False
+
+    def _add_ngram_timing(self, key, now):
+        if encode_key(key) in MODIFIER_CODES:
+            return
+        if len(key) != 1 or not 'a' <= key <= 'z':
+            self.recent_letters = []
+            return
+        self.recent_letters = (self.recent_letters + [(key, now)])[-3:]
+        if len(self.recent_letters) >= 2:
+            (a, t_a), (b, _) = self.recent_letters[-2], self.recent_letters[-1]
+            self.ngrams.setdefault(f'digraph_{a}{b}', RunningStats()).add(now - t_a)
+        if len(self.recent_letters) == 3:
+            (a, t_a), (b, _), (c, _) = self.recent_letters
+            self.ngrams.setdefault(f'trigraph_{a}{b}{c}', RunningStats()).add(now - t_a)
+
+    def summary_vector(self):
+        if self.hold.n < 5 or self.flight.n < 4 or self.dd.n < 4:
+            return None
+        return np.array([self.hold.mean, self.hold.std, self.flight.mean,
+                         self.flight.std, self.dd.mean, self.dd.std])
+
+    def ngram_features(self):
+        features = {}
+        for name, stats in self.ngrams.items():
+            features[f'{name}_mean'] = stats.mean
+            features[f'{name}_std'] = stats.std
+        return features
+
+    def rank(self):
+        """Rank users from the running statistics, or None if too little is known"""
+        with self._lock:
+            return self._rank()
+
+    def _rank(self):
+        if self.method == 'cascade':
+            sample_vec = self.summary_vector()
+            features = self.ngram_features()
+            if sample_vec is None and not features:
+                return None
+            match = compare_sample_cascade(sample_vec, features)
+        elif self.method == 'statistical':
+            sample_vec = self.summary_vector()
+            index = load_statistical_index()
+            if sample_vec is None or not index.users:
+                return None
+            match = compare_sample_to_profiles_statistical(
+                sample_vec, index, candidates=load_statistical_candidates())
+        else:
+            features = self.ngram_features()
+            if not features:
+                return None
+            if self.method == 'ngram':
+                index = load_ngram_index()
+                if not index.users:
+                    return None
+                match = compare_sample_to_profiles_ngram(features, index,
+                                                         candidates=load_ngram_candidates())
+            else:
+                model_set = load_ml_models()
+                if model_set is None:
+                    return None
+                match = predict_ml(features, model_set)
+        self.ranking = dict(match_result(match, self.method), keystrokes=self.keystrokes)
+        self._publish(self.ranking)
+        return self.ranking
+
+    def _publish(self, item):
+        """Offer item to the SSE feed, replacing a ranking it has not sent yet"""
+        while True:
+            try:
+                self.updates.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.updates.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.closed = True
+        self._publish(None)
+
+    def __getstate__(self):
+        # SharedStreamSessions pickles sessions; the lock and feed stay behind
+        state = dict(self.__dict__)
+        del state['_lock'], state['updates']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.updates = queue.Queue(maxsize=1)
+
+class StreamSessions:
+    """The open streaming sessions of this process, by session id"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_expiry = 0.0
+
+    def create(self, session):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = session
+        return session_id
+
+    def get(self, session_id):
+        self.expire()
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def add_events(self, session_id, events):
+        """Feed events to a session; returns (session, rankings), or None if unknown"""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        return session, session.add_events(events)
+
+    def close(self, session_id):
+        """Drop a session; returns (session, final ranking), or None if unknown"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        ranking = session.rank() or session.ranking
+        session.close()
+        return session, ranking
+
+    def rankings(self, session_id, keep_alive=15):
+        """Yield a session's new rankings until it closes, None every idle keep_alive seconds"""
+        session = self.get(session_id)
+        while session is not None and not session.closed:
+            try:
+                ranking = session.updates.get(timeout=keep_alive)
+            except queue.Empty:
+                yield None
+                continue
+            if ranking is None:
+                return
+            yield ranking
+
+    def expire(self, force=False):
+        """Close sessions idle for STREAM_SESSION_TTL seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_expiry < STREAM_EXPIRY_INTERVAL:
+                return
+            self._last_expiry = now
+            for session_id, session in list(self._sessions.items()):
+                if session.last_active < now - STREAM_SESSION_TTL:
+                    session.close()
+                    del self._sessions[session_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+class SharedStreamSessions:
+    """Streaming sessions kept in files, so any serve-mode worker can serve any session.
+
+    A session is pickled to ``<root>/<id>.pkl``, replaced atomically after
+    every change, and an flock on ``<id>.lock`` makes the read-modify-write
+    of concurrent chunks, from any process, apply one at a time. Idle time
+    is the pickle's age. SSE subscribers poll the pickle for new rankings.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._last_expiry = 0.0
+
+    def _path(self, session_id, ext):
+        return os.path.join(self.root, f'{session_id}.{ext}')
+
+    @contextmanager
+    def _locked(self, session_id):
+        fd = os.open(self._path(session_id, 'lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # also releases the lock
+
+    def _load(self, session_id):
+        # Ids come from the URL; anything but our hex ids names no session
+        if len(session_id) != 32 or not all(c in '0123456789abcdef' for c in session_id):
+            return None
+        try:
+            with open(self._path(session_id, 'pkl'), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _save(self, session_id, session):
+        path = self._path(session_id, 'pkl')
+        tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(session, f)
+        os.replace(tmp_path, path)
+
+    def _remove(self, session_id):
+        # The lock file goes last; a waiter that then finds no pickle gives up
+        for ext in ('pkl', 'lock'):
+            try:
+                os.remove(self._path(session_id, ext))
+            except FileNotFoundError:
+                pass
+
+    def create(self, session):
+        session_id = uuid.uuid4().hex
+        self._save(session_id, session)
+        return session_id
+
+    def get(self, session_id):
+        self.expire()
+        return self._load(session_id)
+
+    def add_events(self, session_id, events):
+        self.expire()
+        if self._load(session_id) is None:
+            return None
+        with self._locked(session_id):
+            session = self._load(session_id)
+            if session is None:
+                return None
+            rankings = session.add_events(events)
+            self._save(session_id, session)
+        return session, rankings
+
+    def close(self, session_id):
+        if self._load(session_id) is None:
+            return None
+        with self._locked(session_id):
+            session = self._load(session_id)
+            if session is None:
+                return None
+            ranking = session.rank() or session.ranking
+            self._remove(session_id)
+        session.close()
+        return session, ranking
+
+    def rankings(self, session_id, keep_alive=15):
+        last_sent = time.monotonic()
+        keystrokes = None
+        while True:
+            session = self._load(session_id)
+            if session is None:
+                return
+            if session.ranking is not None and session.ranking['keystrokes'] != keystrokes:
+                keystrokes = session.ranking['keystrokes']
+                last_sent = time.monotonic()
+                yield session.ranking
+            elif time.monotonic() - last_sent >= keep_alive:
+                last_sent = time.monotonic()
+                yield None
+            time.sleep(self.POLL_INTERVAL)
+
+    def expire(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_expiry < STREAM_EXPIRY_INTERVAL:
+            return
+        self._last_expiry = now
+        cutoff = time.time() - STREAM_SESSION_TTL
+        for entry in os.listdir(self.root):
+            if not entry.endswith('.pkl'):
+                continue
+            session_id = entry[:-len('.pkl')]
+            try:
+                if os.stat(self._path(session_id, 'pkl')).st_mtime >= cutoff:
+                    continue
+                with self._locked(session_id):
+                    if os.stat(self._path(session_id, 'pkl')).st_mtime < cutoff:
+                        self._remove(session_id)
+            except FileNotFoundError:
+                continue
+
+    def __len__(self):
+        return sum(entry.endswith('.pkl') for entry in os.listdir(self.root))
+
+STREAM_SESSIONS = StreamSessions()
+
+@app.route('/stream', methods=['POST'])
+def stream_start():
+    """Open a streaming identification session"""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    method = data.get('method', 'statistical')
+    if method not in IDENTIFY_METHODS:
         return jsonify({'error': 'Invalid method'}), 400
+    update_every = data.get('update_every', 5)
+    if not isinstance(update_every, int) or isinstance(update_every, bool):
+        return jsonify({'error': 'update_every must be an integer'}), 400
+    session = StreamSession(method, max(1, update_every))
+    session_id = STREAM_SESSIONS.create(session)
+    return jsonify({'session_id': session_id, 'method': method,
+                    'update_every': session.update_every}), 201
+
+@app.route('/stream/<session_id>/events', methods=['POST'])
+def stream_events(session_id):
+    """Feed keystroke events; answers with the latest ranking"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    events = data.get('events', [])
+    if not isinstance(events, list):
+        return jsonify({'error': 'events must be a list'}), 400
+    if not all(valid_key_event(event) and isinstance(event.get('code', ''), (str, type(None)))
+               for event in events):
+        return jsonify({'error': 'Every event needs a string key and a numeric time'}), 400
+    added = STREAM_SESSIONS.add_events(session_id, events)
+    if added is None:
+        return jsonify({'error': 'Unknown session'}), 404
+    session, rankings = added
+    return jsonify({
+        'keystrokes': session.keystrokes,
+        'updated': bool(rankings),
+        'ranking': session.ranking
+    })
+
+@app.route('/stream/<session_id>/updates', methods=['GET'])
+def stream_updates(session_id):
+    """Server-Sent Events feed of the session's rankings as they change"""
+    if STREAM_SESSIONS.get(session_id) is None:
+        return jsonify({'error': 'Unknown session'}), 404
+
+    def generate():
+        for ranking in STREAM_SESSIONS.rankings(session_id):
+            if ranking is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f'data: {json.dumps(ranking)}\n\n'
+        yield 'event: end\ndata: {}\n\n'
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/stream/<session_id>', methods=['DELETE'])
+def stream_close(session_id):
+    """Close a session and return its final ranking"""
+    closed = STREAM_SESSIONS.close(session_id)
+    if closed is None:
+        return jsonify({'error': 'Unknown session'}), 404
+    session, ranking = closed
+    return jsonify({'keystrokes': session.keystrokes, 'ranking': ranking})
+
+@app.route('/candidates', methods=['GET'])
+def candidates_status():
+    """Candidate index settings and recall against exhaustive search"""
+    return jsonify(candidate_report())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: request and stage latencies, profile and model state"""
+    STREAM_SESSIONS.expire()
+    sessions = len(STREAM_SESSIONS)
+    gauges = [
+        ('identify_profiles', 'Enrolled users in the profile store', len(PROFILE_STORE.users())),
+        ('identify_profile_version', 'Profile store version', PROFILE_STORE.version),
+        ('identify_model_version', 'Version of the live ML model set, 0 if none',
+         MODEL_REGISTRY.live_version()),
+        ('identify_stream_sessions', 'Open streaming identification sessions', sessions),
+        ('identify_cache_entries', 'Results held in the result cache', len(RESULT_CACHE)),
+        ('identify_profiler_running', '1 while the sampling profiler runs', int(PROFILER.running)),
+    ]
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile/start', methods=['POST'])
+def profile_start():
+    """Start sampling all threads' stacks (PROFILER_ENABLED=1 only)"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler disabled'}), 404
+    started = PROFILER.start()
+    return jsonify({'status': 'started' if started else 'already running'})
+
+@app.route('/debug/profile/stop', methods=['POST'])
+def profile_stop():
+    """Stop the sampling profiler and return its collapsed stacks"""
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler disabled'}), 404
+    return Response(PROFILER.stop(), mimetype='text/plain')
+
+@app.route('/models', methods=['GET'])
+def models_status():
+    """Report which ML model version is live and when it was loaded"""
+    return jsonify(MODEL_REGISTRY.status())
+
+@app.route('/train', methods=['POST'])
+def train():
+    """Queue a full retrain of the ML models"""
+    TRAINING_WORKER.request(force=True)
+    return jsonify(TRAINING_WORKER.status()), 202
+
+@app.route('/enrollments', methods=['POST'])
+def enrollments():
+    """Notification from typing_game that new samples were stored"""
+    PROFILE_STORE.refresh(force=True)
+    TRAINING_WORKER.request()
+    return jsonify({'profile_version': PROFILE_STORE.version}), 202
+
+@app.route('/train/status', methods=['GET'])
+def train_status():
+    status = TRAINING_WORKER.status()
+    status['model'] = MODEL_REGISTRY.status()
+    return jsonify(status)
+
+# ===== PRODUCTION SERVING =====
+# `python app.py serve` pre-forks SERVE_WORKERS worker processes that all
+# accept on one listening socket, so requests spread over every core
+# instead of queuing behind one interpreter lock. The parent process is
+# the coordinator: it alone reads the data directory and trains models.
+# Every profile version it sees is published as a generation, a
+# directory of the precomputed index arrays in tmpfs, and workers map
+# the latest one read-only with numpy, so N workers share a single copy
+# of the population and pick up new generations without restarting.
+# New ML models already reach the workers through the model registry.
+# Workers are forked, and re-forked when they die, by a supervisor
+# process that the coordinator forks before it starts any thread, so no
+# worker can inherit a lock that another thread held at fork time.
+#
+#   <root>/g<version>/     one .npy file per index array, plus meta.json
+#                          with the users and the n-gram vocabulary
+#   <root>/current.json    the generation workers should serve
+#   <root>/training.json   the coordinator's training status
+#   <root>/streams/        streaming sessions, shared by all workers
+GENERATION_KEEP = 2
+
+def write_json_atomic(path, value):
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def generation_arrays(store):
+    """The index arrays and metadata to publish for the store's profiles"""
+    statistical = load_statistical_index(store)
+    ngram = load_ngram_index(store)
+    _, ngram_rows = ngram_row_lookup(store)
+    arrays = {
+        'statistical_means': statistical.means,
+        'statistical_stds': statistical.stds,
+        'ngram_means': ngram.means,
+        'ngram_stds': ngram.stds,
+    }
+    for prefix, matrix in (('ngram_cols', ngram.entries), ('ngram_rows', ngram_rows)):
+        for part in ('data', 'indices', 'indptr'):
+            arrays[f'{prefix}_{part}'] = getattr(matrix, part)
+    meta = {
+        'version': store.version,
+        'users': store.users(),
+        'statistical_users': list(statistical.users),
+        'ngram_users': list(ngram.users),
+        'vocab': sorted(ngram.vocab, key=ngram.vocab.get)
+    }
+    return arrays, meta
+
+def publish_generation(store, root):
+    """Write the store's current profiles as a new generation; returns its version"""
+    arrays, meta = generation_arrays(store)
+    name = f"g{meta['version']:06d}"
+    tmp_dir = os.path.join(root, f'{name}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for key, values in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{key}.npy'), np.ascontiguousarray(values))
+    write_json_atomic(os.path.join(tmp_dir, 'meta.json'), meta)
+    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    os.rename(tmp_dir, os.path.join(root, name))
+    write_json_atomic(os.path.join(root, 'current.json'),
+                      {'version': meta['version'], 'generation': name})
+
+    # Workers still serving an older generation keep its files mapped
+    generations = sorted(entry for entry in os.listdir(root)
+                         if entry.startswith('g') and not entry.endswith('.tmp'))
+    for old in generations[:-GENERATION_KEEP]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return meta['version']
+
+def load_generation(path):
+    """Map a published generation's arrays read-only; returns (arrays, metadata)"""
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    arrays = {entry[:-len('.npy')]: np.load(os.path.join(path, entry), mmap_mode='r')
+              for entry in os.listdir(path) if entry.endswith('.npy')}
+    return arrays, meta
+
+def shared_ngram_matrix(arrays, meta, prefix, matrix_type):
+    shape = (len(meta['ngram_users']), len(meta['vocab']))
+    return matrix_type((arrays[f'{prefix}_data'], arrays[f'{prefix}_indices'],
+                        arrays[f'{prefix}_indptr']), shape=shape)
+
+# Derived values a generation provides, built over its mapped arrays on
+# first use, so a worker only loads scipy once n-grams are scored
+SHARED_INDEXES = {
+    'statistical_index': lambda arrays, meta: StatisticalIndex(
+        meta['statistical_users'], arrays['statistical_means'], arrays['statistical_stds']),
+    'ngram_index': lambda arrays, meta: NgramIndex(
+        {name: col for col, name in enumerate(meta['vocab'])}, meta['ngram_users'],
+        shared_ngram_matrix(arrays, meta, 'ngram_cols', sparse.csc_matrix),
+        arrays['ngram_means'], arrays['ngram_stds']),
+    'ngram_rows': lambda arrays, meta: (
+        {user: row for row, user in enumerate(meta['ngram_users'])},
+        shared_ngram_matrix(arrays, meta, 'ngram_rows', sparse.csr_matrix)),
+}
+# Derived values workers build themselves from the shared indexes. All
+# others are built from per-user entries, which only the coordinator holds.
+WORKER_DERIVED = ('statistical_candidates', 'ngram_candidates', 'candidate_report', 'verify_rows')
+
+class SharedProfileStore:
+    """Worker-side profile store serving the coordinator's generations.
+
+    It never reads the data directory: ``refresh()`` maps the generation
+    named by ``current.json`` whenever that changes, and ``derived()``
+    returns the shared indexes over its arrays, building the WORKER_DERIVED
+    values (like the candidate indexes) locally once per generation. Other
+    derived values need per-user entries and raise. ``version`` is the
+    coordinator's profile version.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.version = 0
+        self._arrays = {}
+        self._meta = {'users': []}
+        self._derived = {}
+        self._pointer_stamp = None
+        self._lock = threading.RLock()
+
+    def refresh(self, force=False):
+        """Switch to the latest published generation and return its version"""
+        with self._lock:
+            pointer = os.path.join(self.root, 'current.json')
+            try:
+                stamp = file_stamp(os.stat(pointer))
+            except FileNotFoundError:
+                return self.version
+            if stamp == self._pointer_stamp:
+                return self.version
+            try:
+                with open(pointer, 'r') as f:
+                    name = json.load(f)['generation']
+                arrays, meta = load_generation(os.path.join(self.root, name))
+            except (OSError, ValueError, KeyError):
+                # Replaced while we looked; the next call sees its successor
+                return self.version
+            self._pointer_stamp = stamp
+            self._arrays, self._meta = arrays, meta
+            self._derived = {}
+            self.version = meta['version']
+            return self.version
+
+    def users(self):
+        with self._lock:
+            self.refresh()
+            return self._meta['users']
+
+    def derived(self, name, builder):
+        with self._lock:
+            self.refresh()
+            if name not in self._derived:
+                if name in SHARED_INDEXES:
+                    self._derived[name] = SHARED_INDEXES[name](self._arrays, self._meta)
+                elif name in WORKER_DERIVED:
+                    self._derived[name] = builder(None)
+                else:
+                    raise ValueError(f"'{name}' is built from per-user profiles, "
+                                     'which serve-mode workers do not hold')
+            return self._derived[name]
+
+class CoordinatorTraining:
+    """Worker-side stand-in for TRAINING_WORKER; training runs in the coordinator"""
+
+    def __init__(self, requests, root):
+        self.requests = requests
+        self.root = root
+
+    def start(self):
+        pass
+
+    def request(self, force=False):
+        """Ask the coordinator to re-read the profiles and retrain"""
+        self.requests.put(force)
+
+    def needs_training(self):
+        return self.status().get('needs_training', False)
+
+    def status(self):
+        try:
+            with open(os.path.join(self.root, 'training.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'unknown', 'last_result': None, 'running': False}
+
+def run_worker(sock, root, requests):
+    """Serve requests on the inherited socket until terminated"""
+    global PROFILE_STORE, TRAINING_WORKER, MODEL_REGISTRY, STREAM_SESSIONS
+    global RESULT_CACHE, VERIFY_USER_THRESHOLDS
+    from werkzeug.serving import make_server
+
+    # Ctrl-C reaches the whole process group; the coordinator shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    PROFILE_STORE = SharedProfileStore(root)
+    TRAINING_WORKER = CoordinatorTraining(requests, root)
+    # Any worker may receive a session's next chunk
+    STREAM_SESSIONS = SharedStreamSessions(os.path.join(root, 'streams'))
+    # Everything else holding a lock starts afresh in the worker too
+    MODEL_REGISTRY = ModelRegistry(MODELS_DIR)
+    RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+    VERIFY_USER_THRESHOLDS = ThresholdFile(VERIFY_THRESHOLDS_FILE)
+    METRICS.reset_lock()
+    parent = os.getppid()
+
+    def watch_supervisor():
+        # Nothing would stop this worker once its supervisor is gone
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch_supervisor, name='supervisor-watch', daemon=True).start()
+    host, port = sock.getsockname()[:2]
+    make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+def supervise_workers(sock, root, requests, workers):
+    """Fork the workers and replace any that die, until terminated
+
+    Runs in a process of its own that never starts a thread, so every
+    worker, including a replacement, is forked from a single thread.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, root, requests)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for _ in range(workers):
+            spawn()
+        while True:
+            pid, _ = os.wait()
+            children.discard(pid)
+            spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+def serve(workers=None, host=None, port=None):
+    """Run the coordinator and its pre-forked workers until interrupted"""
+    workers = workers or SERVE_WORKERS
+    root = tempfile.mkdtemp(prefix='identify-profiles-', dir=SERVE_SHM_DIR)
+    requests = multiprocessing.get_context('fork').Queue()
+    # Only the loop below re-reads the data directory, so every generation
+    # is built from a single profile version
+    PROFILE_STORE.refresh_interval = float('inf')
+    PROFILE_STORE.refresh(force=True)
+    version = publish_generation(PROFILE_STORE, root)
+    sock = socket.create_server((host or SERVE_HOST, port or SERVE_PORT), backlog=128)
+
+    # Fork the supervisor while this is still the only thread
+    supervisor = os.fork()
+    if supervisor == 0:
+        try:
+            supervise_workers(sock, root, requests, workers)
+        finally:
+            os._exit(0)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'Serving on http://{host or SERVE_HOST}:{port or SERVE_PORT} '
+          f'with {workers} workers, profiles in {root}')
+    training_status = None
+    try:
+        TRAINING_WORKER.start()
+        while True:
+            forced = None
+            try:
+                forced = requests.get(timeout=PROFILE_REFRESH_INTERVAL)
+                while True:
+                    forced = requests.get_nowait() or forced
+            except queue.Empty:
+                pass
+            if PROFILE_STORE.refresh(force=True) != version:
+                version = publish_generation(PROFILE_STORE, root)
+            if forced is not None:
+                TRAINING_WORKER.request(force=forced)
+
+            status = dict(TRAINING_WORKER.status(), needs_training=TRAINING_WORKER.needs_training())
+            if status != training_status:
+                write_json_atomic(os.path.join(root, 'training.json'), status)
+                training_status = status
+
+            # Without its supervisor nothing would replace dead workers;
+            # stop, rather than fork a new one from this threaded process
+            if os.waitpid(supervisor, os.WNOHANG)[0] != 0:
+                print('Worker supervisor exited; shutting down', file=sys.stderr)
+                supervisor = None
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if supervisor is not None:
+            os.kill(supervisor, signal.SIGTERM)
+            os.waitpid(supervisor, 0)
+        shutil.rmtree(root, ignore_errors=True)
+
+prewarm_methods()
 
 if __name__ == '__main__':
-    app.run(port=8001, debug=True) 
\ No newline at end of file
+    if sys.argv[1:] == ['convert-timings']:
+        print(f'Converted {build_columnar_store()} samples')
+        sys.exit(0)
+    if sys.argv[1:] == ['serve']:
+        serve()
+        sys.exit(0)
+    PROFILE_STORE.refresh(force=True)
+    app.run(host=SERVE_HOST, port=SERVE_PORT)
\ No newline at end of file
@@ -1,4 +1,43 @@
 const promptText = "The quick brown fox jumps over the lazy dog.";
+
+// Compact upload (application/x-keystrokes, see common/keystrokes.py,
+// whose NAMED_KEYS this mirrors): "KST1", the header length and header,
+// then per key event a uint32 time delta in 0.1 ms, a uint16 key code
+// and a uint8 down flag, all little-endian
+const NAMED_KEYS = ['Shift', 'Backspace', 'Enter', 'Tab', 'Control', 'Alt', 'Meta',
+                    'CapsLock', 'Escape', 'ArrowLeft', 'ArrowRight', 'ArrowUp', 'ArrowDown',
+                    'Delete', 'Home', 'End'];
+const WIRE_NAMED_BASE = 0xF000;
+
+function wireKeyCode(key) {
+    if (key.length === 1) {
+        const code = key.toLowerCase().charCodeAt(0);
+        return code < WIRE_NAMED_BASE ? code : 0;
+    }
+    const index = NAMED_KEYS.findIndex(name => name.toLowerCase() === key.toLowerCase());
+    return index >= 0 ? WIRE_NAMED_BASE + index : 0;
+}
+
+function encodeKeystrokes(fields, events) {
+    const n = events.length;
+    const header = new TextEncoder().encode(JSON.stringify(Object.assign({}, fields, { event_count: n })));
+    const buffer = new ArrayBuffer(8 + header.length + 7 * n);
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    bytes.set([0x4b, 0x53, 0x54, 0x31]);  // "KST1"
+    view.setUint32(4, header.length, true);
+    bytes.set(header, 8);
+    const offset = 8 + header.length;
+    let last = n ? Math.round(events[0].time * 10) : 0;
+    events.forEach((event, i) => {
+        const time = Math.max(last, Math.round(event.time * 10));
+        view.setUint32(offset + 4 * i, time - last, true);
+        view.setUint16(offset + 4 * n + 2 * i, wireKeyCode(event.key), true);
+        view.setUint8(offset + 6 * n + i, event.type === 'down' ? 1 : 0);
+        last = time;
+    });
+    return buffer;
+}
 document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('prompt').textContent = promptText;
     let holdTimes = [];
@@ -10,8 +49,7 @@ document.addEventListener('DOMContentLoaded', function() {
     let isGameActive = true;
     let input = document.getElementById('input');
     
-    // N-gram data collection (same as typing game)
-    let ngramData = { digraphs: {}, trigraphs: {} };
+    // Raw key events; the server derives n-gram timings from them
     let currentKeystrokeSequence = [];
     let lastKeystrokeTime = null;
 
@@ -22,100 +60,88 @@ document.addEventListener('DOMContentLoaded', function() {
     const methodDescriptions = {
         'statistical': 'Uses mean and standard deviation of hold, flight, and down-down times. Best for same text.',
         'ngram': 'Analyzes timing patterns between character pairs and triplets. Works well with different texts.',
-        'ml': 'Uses machine learning (KNN/SVM) on n-gram features. Most accurate but requires more training data.'
+        'ml': 'Uses machine learning (KNN/SVM) on n-gram features. Most accurate but requires more training data.',
+        'cascade': 'Statistical shortlist, re-ranked by n-grams, with machine learning only for close calls. Stops as soon as a stage is confident.'
     };
     
     methodSelect.addEventListener('change', function() {
         const selectedMethod = this.value;
         methodDescription.textContent = methodDescriptions[selectedMethod] || '';
+        resetLiveSession();
     });
 
-    // N-gram extraction functions (same as typing game)
-    function extractDigraphs(text) {
-        const digraphs = [];
-        for (let i = 0; i < text.length - 1; i++) {
-            const digraph = text.substring(i, i + 2).toLowerCase();
-            if (digraph.match(/[a-z]{2}/)) {
-                digraphs.push(digraph);
-            }
-        }
-        return digraphs;
-    }
+    // Live mode: keystrokes are streamed to the server in small chunks and
+    // the ranking is refreshed while the user is still typing. A chunk goes
+    // out once LIVE_CHUNK_SIZE events are pending or typing pauses for
+    // LIVE_IDLE_MS, and liveFlight settles once everything queued is sent.
+    const liveToggle = document.getElementById('liveToggle');
+    const LIVE_CHUNK_SIZE = 10;
+    const LIVE_IDLE_MS = 300;
+    let liveSession = null;
+    let livePending = [];
+    let liveSending = false;
+    let liveIdleTimer = null;
+    let liveFlight = Promise.resolve();
 
-    function extractTrigraphs(text) {
-        const trigraphs = [];
-        for (let i = 0; i < text.length - 2; i++) {
-            const trigraph = text.substring(i, i + 3).toLowerCase();
-            if (trigraph.match(/[a-z]{3}/)) {
-                trigraphs.push(trigraph);
-            }
+    function resetLiveSession() {
+        if (liveSession) {
+            liveSession.then(id => id && fetch(`/stream/${id}`, { method: 'DELETE' }));
         }
-        return trigraphs;
+        clearTimeout(liveIdleTimer);
+        liveSession = null;
+        livePending = [];
     }
 
-    function addNgramTiming(ngram, timing) {
-        if (!ngramData.digraphs[ngram]) {
-            ngramData.digraphs[ngram] = [];
-        }
-        ngramData.digraphs[ngram].push(timing);
+    function startLiveSession() {
+        liveSession = fetch('/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ method: methodSelect.value })
+        })
+        .then(res => res.json())
+        .then(res => res.session_id || null)
+        .catch(() => null);
     }
 
-    function addTrigraphTiming(trigraph, timing) {
-        if (!ngramData.trigraphs[trigraph]) {
-            ngramData.trigraphs[trigraph] = [];
+    function queueLiveEvent(event) {
+        if (!liveToggle.checked || !isGameActive) return;
+        if (!liveSession) startLiveSession();
+        livePending.push(event);
+        clearTimeout(liveIdleTimer);
+        if (livePending.length >= LIVE_CHUNK_SIZE) {
+            flushLiveEvents();
+        } else {
+            liveIdleTimer = setTimeout(flushLiveEvents, LIVE_IDLE_MS);
         }
-        ngramData.trigraphs[trigraph].push(timing);
     }
 
-    function processNgrams() {
-        // Process digraphs (2-grams)
-        const digraphs = extractDigraphs(promptText);
-        for (let i = 0; i < digraphs.length; i++) {
-            const digraph = digraphs[i];
-            const firstChar = digraph[0];
-            const secondChar = digraph[1];
-            
-            let timing = null;
-            for (let j = 0; j < currentKeystrokeSequence.length - 1; j++) {
-                if (currentKeystrokeSequence[j].key === firstChar && 
-                    currentKeystrokeSequence[j+1].key === secondChar &&
-                    currentKeystrokeSequence[j].type === 'down' &&
-                    currentKeystrokeSequence[j+1].type === 'down') {
-                    timing = currentKeystrokeSequence[j+1].time - currentKeystrokeSequence[j].time;
-                    break;
-                }
-            }
-            if (timing !== null) {
-                addNgramTiming(digraph, timing);
-            }
-        }
-        
-        // Process trigraphs (3-grams)
-        const trigraphs = extractTrigraphs(promptText);
-        for (let i = 0; i < trigraphs.length; i++) {
-            const trigraph = trigraphs[i];
-            const firstChar = trigraph[0];
-            const secondChar = trigraph[1];
-            const thirdChar = trigraph[2];
-            
-            let timing = null;
-            for (let j = 0; j < currentKeystrokeSequence.length - 2; j++) {
-                if (currentKeystrokeSequence[j].key === firstChar && 
-                    currentKeystrokeSequence[j+1].key === secondChar &&
-                    currentKeystrokeSequence[j+2].key === thirdChar &&
-                    currentKeystrokeSequence[j].type === 'down' &&
-                    currentKeystrokeSequence[j+1].type === 'down' &&
-                    currentKeystrokeSequence[j+2].type === 'down') {
-                    timing = currentKeystrokeSequence[j+2].time - currentKeystrokeSequence[j].time;
-                    break;
-                }
-            }
-            if (timing !== null) {
-                addTrigraphTiming(trigraph, timing);
-            }
-        }
+    function flushLiveEvents() {
+        clearTimeout(liveIdleTimer);
+        // A send in flight picks up the pending events when it finishes
+        if (liveSending || !liveSession || livePending.length === 0) return liveFlight;
+        const events = livePending;
+        livePending = [];
+        liveSending = true;
+        liveFlight = liveSession
+            .then(id => id && fetch(`/stream/${id}/events`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ events: events })
+            }))
+            .then(res => res && res.json())
+            .then(res => {
+                if (res && res.ranking) showResult(res.ranking);
+            })
+            .catch(() => {})
+            .finally(() => {
+                liveSending = false;
+                if (livePending.length) return flushLiveEvents();
+            });
+        return liveFlight;
     }
 
+    liveToggle.addEventListener('change', resetLiveSession);
+
     input.onkeydown = (e) => {
         if (!isGameActive) return;
         const now = performance.now();
@@ -131,6 +157,7 @@ document.addEventListener('DOMContentLoaded', function() {
             time: now,
             type: 'down'
         });
+        queueLiveEvent({ key: e.key, code: e.code, time: now, type: 'down' });
     };
     
     input.onkeyup = (e) => {
@@ -151,6 +178,7 @@ document.addEventListener('DOMContentLoaded', function() {
             time: now,
             type: 'up'
         });
+        queueLiveEvent({ key: e.key, code: e.code, time: now, type: 'up' });
     };
     
     document.getElementById('identifyBtn').onclick = () => {
@@ -164,27 +192,19 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        // Process n-grams
-        processNgrams();
-        
         const selectedMethod = methodSelect.value;
         
         document.getElementById('loading').style.display = 'block';
         document.getElementById('identifyBtn').disabled = true;
         
-        fetch('/identify', {
+        // Send the last live chunk first, so its ranking cannot replace the result
+        flushLiveEvents()
+        .then(() => fetch('/identify', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                method: selectedMethod,
-                hold_times: holdTimes,
-                flight_times: flightTimes,
-                down_down_times: downDownTimes,
-                text: promptText,
-                ngram_data: ngramData,
-                keystroke_sequence: currentKeystrokeSequence
-            })
-        })
+            headers: { 'Content-Type': 'application/x-keystrokes' },
+            body: encodeKeystrokes({ method: selectedMethod, text: promptText },
+                                   currentKeystrokeSequence)
+        }))
         .then(res => res.json())
         .then(res => {
             document.getElementById('loading').style.display = 'none';
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test of a running typing_game and identify_app.
+
+Replays typing sessions against both apps at once, mixing enrollment
+(/submit) and identification (/identify) requests at a fixed request rate
+and concurrency. Sessions are synthetic typists (see benchmark.py) or
+samples recorded in a data directory. For each endpoint it reports
+throughput, p50/p95/p99 latency and errors. Afterwards it reads the data
+directory and checks that every acknowledged /submit was stored exactly
+once (lost-write detection).
+
+Both apps default to port 8001, so start identify_app on another port
+(SERVE_PORT also applies to a plain `python app.py`):
+
+    cd typing_game && python app.py
+    cd identify_app && SERVE_PORT=8002 python app.py serve
+    python load_test.py --rate 50 --concurrency 16 --requests 2000
+    python load_test.py --sessions data --submit-fraction 0.2 --output load.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import numpy as np
+import identify_app.app as identify_module
+import benchmark
+from common.keystrokes import KEYSTROKES_MIMETYPE, decode_key, encode_keystrokes
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ('submit', 'identify')
+
+# ===== SESSIONS =====
+# A session is (username, sample) with the sample in the typing_game
+# format. Enrollment traffic is stored under load-test usernames, so real
+# profiles are never modified and the lost-write check only counts
+# samples written by this run.
+
+def synthetic_sessions(n_users, rng):
+    """Sample factories for n_users synthetic typists"""
+    typists = benchmark.make_population(n_users, rng)
+    return [(typist.name, lambda r, t=typist: t.sample(r, benchmark.TEXTS[r.integers(len(benchmark.TEXTS))],
+                                                       events=True))
+            for typist in typists]
+
+def recorded_sessions(data_dir):
+    """Sample factories replaying every sample stored in a data directory"""
+    sessions = []
+    stems = sorted({os.path.splitext(f)[0] for f in os.listdir(data_dir) if f.endswith(('.json', '.jsonl'))})
+    for stem in stems:
+        try:
+            username, samples, _ = identify_module.read_user_files(data_dir, stem)
+        except (OSError, ValueError):
+            continue
+        samples = [s for s in samples if s.get('hold_times')]
+        if samples:
+            sessions.append((username, lambda r, s=samples: s[r.integers(len(s))]))
+    return sessions
+
+def sample_events(sample):
+    """The sample's key events as [{'key', 'time', 'type'}], or None"""
+    arrays = identify_module.keystroke_arrays(sample)
+    if arrays is None:
+        return None
+    times, keys, down = arrays
+    return [{'key': decode_key(k), 'time': float(t), 'type': 'down' if d else 'up'}
+            for t, k, d in zip(times, keys, down)]
+
+def encode_request(fields, sample, fmt):
+    """(body, content type) of a request; samples without key events go as JSON"""
+    events = sample_events(sample) if fmt == 'binary' else None
+    if events:
+        scalars = {k: sample[k] for k in ('text', 'errors', 'totalTime', 'wpm', 'accuracy',
+                                          'difficulty', 'timestamp') if sample.get(k) is not None}
+        return encode_keystrokes(dict(scalars, **fields), events), KEYSTROKES_MIMETYPE
+    return json.dumps(dict(sample, **fields)).encode('utf-8'), 'application/json'
+
+def build_requests(sessions, args, run_id, rng):
+    """Pre-encode every request so payload generation stays off the timed path"""
+    requests = []
+    for _ in range(args.requests):
+        name, make_sample = sessions[rng.integers(len(sessions))]
+        sample = make_sample(rng)
+        if rng.random() < args.submit_fraction:
+            fields = {'username': f'{run_id}-{name}'}
+            requests.append(('submit', fields['username']) + encode_request(fields, sample, args.format))
+        else:
+            fields = {'method': args.method}
+            requests.append(('identify', None) + encode_request(fields, sample, args.format))
+    return requests
+
+# ===== LOAD GENERATION =====
+def post(url, body, content_type, timeout):
+    """POST a body; returns the HTTP status, or an exception class name"""
+    req = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError as e:
+        return type(e).__name__
+
+def run_load(requests, args):
+    """Send every request from args.concurrency threads; returns the records
+
+    With a rate, request i is due at start + i / rate and its latency is
+    measured from that moment, so a server that falls behind shows up as
+    growing latency instead of a lower send rate. Without a rate every
+    thread sends as fast as responses come back.
+    """
+    urls = {'submit': args.submit_url.rstrip('/') + '/submit',
+            'identify': args.identify_url.rstrip('/') + '/identify'}
+    records = [None] * len(requests)
+    next_index = iter(range(len(requests)))
+    lock = threading.Lock()
+    start = time.perf_counter() + 0.1
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            due = start + i / args.rate if args.rate else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint, username, body, content_type = requests[i]
+            status = post(urls[endpoint], body, content_type, args.timeout)
+            finished = time.perf_counter()
+            records[i] = (endpoint, username, status, finished - due, finished)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, start
+
+# ===== REPORTING =====
+def endpoint_stats(records, start):
+    """Throughput, latency percentiles and errors per endpoint"""
+    stats = {}
+    for endpoint in ENDPOINTS:
+        rows = [r for r in records if r[0] == endpoint]
+        if not rows:
+            continue
+        latencies = np.array([r[3] for r in rows]) * 1000
+        elapsed = max(r[4] for r in rows) - start
+        errors = {}
+        for r in rows:
+            if r[2] != 200:
+                errors[str(r[2])] = errors.get(str(r[2]), 0) + 1
+        stats[endpoint] = {
+            'requests': len(rows),
+            'throughput_rps': round(len(rows) / elapsed, 2),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+            'max_ms': round(float(latencies.max()), 2),
+            'error_rate': round(sum(errors.values()) / len(rows), 4),
+            'errors': errors
+        }
+    return stats
+
+def check_writes(records, data_dir):
+    """Compare acknowledged submits with the samples stored per load-test user
+
+    A user with fewer stored samples than acknowledged submits lost
+    writes; one with more than were sent stored something twice. Failed
+    submits may or may not have been stored, so they only widen the
+    accepted range.
+    """
+    acked, sent = {}, {}
+    for endpoint, username, status, _, _ in records:
+        if endpoint == 'submit':
+            sent[username] = sent.get(username, 0) + 1
+            acked[username] = acked.get(username, 0) + (status == 200)
+    lost, duplicated = {}, {}
+    for username in sent:
+        stored = len(identify_module.read_user_files(data_dir, username)[1])
+        if stored < acked[username]:
+            lost[username] = acked[username] - stored
+        elif stored > sent[username]:
+            duplicated[username] = stored - sent[username]
+    return {
+        'users': len(sent),
+        'acknowledged': sum(acked.values()),
+        'lost': sum(lost.values()),
+        'duplicated': sum(duplicated.values()),
+        'lost_by_user': lost,
+        'duplicated_by_user': duplicated
+    }
+
+def remove_run_data(data_dir, run_id):
+    for fname in os.listdir(data_dir):
+        if fname.startswith(run_id + '-'):
+            path = os.path.join(data_dir, fname)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+def print_summary(result):
+    print(f"\n🚦 {result['requests']} requests in {result['elapsed_s']:.2f}s "
+          f"({result['throughput_rps']:.1f} req/s, concurrency {result['args']['concurrency']})")
+    for endpoint, stats in result['endpoints'].items():
+        errors = ', '.join(f'{status}: {count}' for status, count in stats['errors'].items())
+        print(f"  {endpoint:<9} {stats['requests']:>6} req  {stats['throughput_rps']:7.1f} req/s  "
+              f"p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  "
+              f"errors {stats['error_rate']*100:5.1f}%{f' ({errors})' if errors else ''}")
+    writes = result.get('writes')
+    if writes:
+        print(f"  writes    {writes['acknowledged']} acknowledged for {writes['users']} users, "
+              f"{writes['lost']} lost, {writes['duplicated']} duplicated "
+              f"{'✅' if not writes['lost'] and not writes['duplicated'] else '❌'}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--submit-url', default='http://127.0.0.1:8001', help='typing_game base URL')
+    parser.add_argument('--identify-url', default='http://127.0.0.1:8002', help='identify_app base URL')
+    parser.add_argument('--requests', type=int, default=1000, help='total requests to send')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='requests per second across all threads (0: as fast as possible)')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--submit-fraction', type=float, default=0.5,
+                        help='share of requests that are /submit enrollments')
+    parser.add_argument('--method', default='statistical', choices=identify_module.IDENTIFY_METHODS,
+                        help='identification method of /identify requests')
+    parser.add_argument('--format', default='binary', choices=['binary', 'json'],
+                        help='request body format')
+    parser.add_argument('--sessions', help='data directory whose recorded samples are replayed '
+                                           '(default: synthetic typists)')
+    parser.add_argument('--users', type=int, default=50, help='synthetic typists')
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, 'data'),
+                        help="typing_game's data directory, for the lost-write check")
+    parser.add_argument('--keep-data', action='store_true', help='keep the samples this run enrolled')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sessions = recorded_sessions(args.sessions) if args.sessions else synthetic_sessions(args.users, rng)
+    if not sessions:
+        print(f"❌ No sessions with timing data in {args.sessions}")
+        sys.exit(1)
+    run_id = f'loadtest-{uuid.uuid4().hex[:8]}'
+    requests = build_requests(sessions, args, run_id, rng)
+
+    print(f"🚀 Replaying {len(sessions)} {'recorded' if args.sessions else 'synthetic'} sessions as {run_id}")
+    records, start = run_load(requests, args)
+    elapsed = max(r[4] for r in records) - start
+    result = {
+        'run_id': run_id,
+        'created': identify_module.utc_now(),
+        'args': vars(args),
+        'requests': len(records),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(records) / elapsed, 2),
+        'endpoints': endpoint_stats(records, start)
+    }
+    if 'submit' in result['endpoints'] and os.path.isdir(args.data_dir):
+        result['writes'] = check_writes(records, args.data_dir)
+        if not args.keep_data:
+            remove_run_data(args.data_dir, run_id)
+    print_summary(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+    writes = result.get('writes') or {}
+    if writes.get('lost') or writes.get('duplicated'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,47 @@ This script tests all three identification methods: statistical, n-gram, and ML.
 """
 
 import os
+import sys
 import json
+import subprocess
+import copy
+import tempfile
+import time
+import warnings
 import numpy as np
+import typing_game.app as typing_game_app
+import identify_app.app as identify_module
+import benchmark
+from common.keystrokes import decode_key, encode_keystrokes
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
 from identify_app.app import (
+    ProfileStore,
+    ColumnarStore,
+    build_columnar_store,
+    ModelRegistry,
+    TrainingWorker,
+    SufficientStats,
+    UserProfile,
+    RunningStats,
+    StreamSession,
     load_profiles_statistical, 
     compare_sample_to_profiles_statistical,
+    compare_samples_to_profiles_statistical,
+    build_statistical_index,
+    StatisticalIndex,
+    CandidateIndex,
+    StatisticalCandidates,
+    NgramCandidates,
+    candidate_recall,
+    acceptance_percentage,
     load_profiles_ngram,
     compare_sample_to_profiles_ngram,
+    build_ngram_index,
     extract_ngram_features,
+    extract_ngram_features_bulk,
     train_ml_models,
+    prepare_ml_data,
     predict_ml
 )
 
@@ -41,6 +73,138 @@ def test_statistical_method():
     
     return True
 
+def test_statistical_index():
+    """Test that vectorized scoring matches per-user acceptance"""
+    print("\n=== Testing Statistical Index ===")
+
+    rng = np.random.default_rng(42)
+    profiles = {f'user{i}': rng.normal(100, 20, size=(3, 6)) for i in range(20)}
+    sample_vec = rng.normal(100, 20, size=6)
+
+    index = build_statistical_index(profiles)
+    assert index.means.shape == (20, 6) and index.stds.shape == (20, 6)
+
+    expected = {
+        user: acceptance_percentage(sample_vec, np.mean(mat, axis=0), np.std(mat, axis=0))
+        for user, mat in profiles.items()
+    }
+    user, acceptance, analysis, matches = compare_sample_to_profiles_statistical(sample_vec, index)
+    assert acceptance == max(expected.values())
+    assert len(matches) == 5
+    for match in matches:
+        assert match['acceptance'] == expected[match['user']]
+    assert [m['acceptance'] for m in matches] == sorted(expected.values(), reverse=True)[:5]
+
+    print("✅ Vectorized scores match per-user scores")
+    return True
+
+def test_batch_statistical():
+    """Test that batch scoring matches one-at-a-time scoring, and /identify/batch"""
+    print("\n=== Testing Batch Statistical Scoring ===")
+
+    rng = np.random.default_rng(7)
+    index = build_statistical_index({f'user{i}': rng.normal(100, 20, size=(4, 6)) for i in range(50)})
+    sample_vecs = rng.normal(100, 20, size=(30, 6))
+
+    batch = compare_samples_to_profiles_statistical(sample_vecs, index)
+    assert len(batch) == 30
+    for sample_vec, result in zip(sample_vecs, batch):
+        assert result == compare_sample_to_profiles_statistical(sample_vec, index)
+
+    original_store = identify_module.PROFILE_STORE
+    with tempfile.TemporaryDirectory() as data_dir:
+        for i, scale in enumerate((1.0, 1.5, 2.0)):
+            write_profile(data_dir, f'user{i}', [make_sample(scale), make_sample(scale * 1.02)])
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        try:
+            client = identify_module.app.test_client()
+            samples = [make_sample(2.0), make_sample(1.0)]
+            response = client.post('/identify/batch', json={'samples': samples})
+            assert response.status_code == 200
+            assert [r['user'] for r in response.get_json()['results']] == ['user2', 'user0']
+            streamed = client.post('/identify/batch', json={'samples': samples, 'stream': True})
+            assert [json.loads(line)['user'] for line in streamed.data.splitlines()] == ['user2', 'user0']
+
+            # Malformed bodies are rejected, not answered with a 500
+            for body in ([samples], 'samples', {'samples': {'a': 1}}, {'samples': [samples[0], 3]},
+                         {'samples': [[1, 2]]}, {'samples': samples, 'method': 'unknown'}):
+                response = client.post('/identify/batch', json=body)
+                assert response.status_code == 400 and 'error' in response.get_json()
+            assert client.post('/identify/batch', data=b'{not json',
+                               content_type='application/json').status_code == 400
+            assert client.post('/identify', json=[samples[0]]).status_code == 400
+        finally:
+            identify_module.PROFILE_STORE = original_store
+
+    print("✅ Batch results match single-sample results")
+    return True
+
+def test_sufficient_stats():
+    """Test that sufficient statistics match statistics of the raw samples"""
+    print("\n=== Testing Sufficient Statistics ===")
+
+    rng = np.random.default_rng(3)
+    rows = rng.normal(100, 20, size=(40, 6))
+    stats = SufficientStats(6)
+    for row in rows[:25]:
+        stats.add(row)
+    stats.merge(SufficientStats.from_rows(rows[25:]))
+    assert stats.count == 40
+    assert np.allclose(stats.mean, rows.mean(axis=0))
+    assert np.allclose(stats.std, rows.std(axis=0))
+
+    samples = [make_sample(1.0), make_sample(1.2), make_sample(0.9)]
+    merged = UserProfile()
+    merged.add_sample(samples[0])
+    other = UserProfile()
+    for sample in samples[1:]:
+        other.add_sample(sample)
+    merged.merge(other)
+    assert merged.summary.count == 3 and merged.ngram_samples == 3
+    # Memory follows the n-gram vocabulary, not the number of samples
+    assert set(merged.ngrams) == {'digraph_th', 'digraph_he', 'trigraph_the'}
+    th_means = [np.mean(s['ngram_data']['digraphs']['th']) for s in samples]
+    assert np.allclose(merged.ngrams['digraph_th'].mean[0], np.mean(th_means))
+
+    print("✅ Merged statistics match the raw samples")
+    return True
+
+def test_candidate_index():
+    """Test that candidate generation agrees with exhaustive search"""
+    print("\n=== Testing Candidate Index ===")
+
+    rng = np.random.default_rng(11)
+    vectors = rng.normal(size=(2000, 6))
+    exact = CandidateIndex(vectors, 'kdtree').search(vectors[:20], 10)
+    ivf = CandidateIndex(vectors, 'ivf', n_probe=1000).search(vectors[:20], 10)
+    for query, rows, ivf_rows in zip(vectors[:20], exact, ivf):
+        nearest = np.argsort(np.square(vectors - query).sum(axis=1))[:10]
+        assert list(rows) == sorted(nearest)
+        # Probing every list makes IVF exact too
+        assert list(ivf_rows) == list(rows)
+
+    users = [f'user{i}' for i in range(2000)]
+    index = StatisticalIndex(users, rng.normal(100, 20, (2000, 6)), np.abs(rng.normal(5, 2, (2000, 6))))
+    candidates = StatisticalCandidates(index, k=300, kind='kdtree')
+    sample_vec = index.means[42] + 1.0
+    assert compare_sample_to_profiles_statistical(sample_vec, index, candidates=candidates)[0] == 'user42'
+    # Scoring every user through the candidate path gives the exhaustive answer
+    everyone = StatisticalCandidates(index, k=len(users))
+    assert (compare_sample_to_profiles_statistical(sample_vec, index, candidates=everyone) ==
+            compare_sample_to_profiles_statistical(sample_vec, index))
+    assert candidate_recall('statistical', index, everyone, n_queries=20) == 1.0
+    assert 0 < candidate_recall('statistical', index, candidates, n_queries=20) <= 1
+
+    profiles = {f'user{i}': [extract_ngram_features(make_sample(1 + i / 100))] for i in range(200)}
+    ngram_index = build_ngram_index(profiles)
+    ngram_candidates = NgramCandidates(ngram_index, k=10)
+    sample = extract_ngram_features(make_sample(1.5))
+    assert 'user50' in [ngram_index.users[i] for i in ngram_candidates.query(sample)[0]]
+    assert compare_sample_to_profiles_ngram(sample, ngram_index, candidates=ngram_candidates)[0] == 'user50'
+
+    print("✅ Candidates contain the exhaustive best matches")
+    return True
+
 def test_ngram_method():
     """Test the n-gram identification method"""
     print("\n=== Testing N-Gram Method ===")
@@ -87,6 +251,87 @@ def test_ngram_method():
     
     return True
 
+def test_ngram_index():
+    """Test matrix-based n-gram matching against known profiles"""
+    print("\n=== Testing N-Gram Index ===")
+
+    alice = extract_ngram_features(make_sample(1.0))
+    profiles = {
+        'alice': [alice, extract_ngram_features(make_sample(1.1))],
+        'bob': [{'digraph_zz_mean': 80.0, 'digraph_zz_std': 5.0}],
+    }
+    index = build_ngram_index(profiles)
+    assert set(index.vocab) == {'digraph_th', 'digraph_he', 'digraph_zz', 'trigraph_the'}
+    assert index.entries.shape == (2, 4)
+
+    user, acceptance, analysis, matches = compare_sample_to_profiles_ngram(alice, index)
+    assert user == 'alice'
+    # Bob shares no n-gram with the sample, so he is never scored
+    assert [m['user'] for m in matches] == ['alice']
+
+    # Alice's profile averages her two samples, 5% slower than the sample
+    expected = np.mean([1 - abs(v - 1.05 * v) / max(1.05 * v, 1) for v in alice.values()])
+    assert np.isclose(acceptance, expected)
+
+    print("✅ N-gram index scores overlapping users only")
+    return True
+
+def test_ngram_extraction():
+    """Test that n-gram timings are derived from raw key events"""
+    print("\n=== Testing N-Gram Extraction ===")
+
+    def typed(text, start=0.0):
+        events, now = [], start
+        for char in text:
+            if char.isupper():
+                events.append({'key': 'Shift', 'code': 'ShiftLeft', 'time': now - 30, 'type': 'down'})
+            events.append({'key': char, 'code': f'Key{char}', 'time': now, 'type': 'down'})
+            events.append({'key': char, 'code': f'Key{char}', 'time': now + 80, 'type': 'up'})
+            now += 100 + 10 * (ord(char.lower()) % 5)
+        return events
+
+    sample = {'timings': typed('The then Tx')}
+    features = extract_ngram_features(sample)
+    # Shift does not break "Th"; the space does
+    assert features['digraph_th_mean'] == 110 and features['digraph_th_std'] == 0
+    assert features['digraph_he_mean'] == 140
+    assert features['trigraph_the_mean'] == 250
+    assert 'digraph_en_mean' in features and 'digraph_ex_mean' not in features
+    assert features['digraph_tx_mean'] == 110
+
+    # keystroke_sequence (lowercased keys) gives the same features
+    sequence = [dict(e, key=e['key'].lower()) for e in sample['timings']]
+    assert extract_ngram_features({'keystroke_sequence': sequence}) == features
+
+    # Samples without events fall back to the client's ngram_data
+    bulk = extract_ngram_features_bulk([sample, make_sample(1.0), {}, {'timings': typed('the', 5000)}])
+    assert bulk[0] == features
+    assert bulk[1] == extract_ngram_features(make_sample(1.0))
+    assert bulk[1]['digraph_th_mean'] == 51 and bulk[2] == {}
+    # Events of different samples never form an n-gram together
+    assert bulk[3] == extract_ngram_features({'timings': typed('the', 5000)})
+    assert sorted(bulk[3]) == ['digraph_he_mean', 'digraph_he_std', 'digraph_th_mean',
+                               'digraph_th_std', 'trigraph_the_mean', 'trigraph_the_std']
+
+    # Malformed events are skipped instead of failing the request
+    junk = [{'key': 5, 'time': 0, 'type': 'down'}, {'key': 'a', 'time': 'x', 'type': 'down'}, 1, None]
+    assert extract_ngram_features({'timings': junk + sample['timings']}) == features
+    assert extract_ngram_features({'timings': 7}) == {}
+    client = identify_module.app.test_client()
+    for method in ('ngram', 'ml', 'cascade'):
+        response = client.post('/identify', json={'method': method, 'timings': junk})
+        assert response.status_code == 400 and 'error' in response.get_json()
+
+    # The streaming session applies the same rules
+    session = StreamSession('ngram', update_every=1000)
+    session.add_events(sorted(sample['timings'], key=lambda event: event['time']))
+    streamed = session.ngram_features()
+    assert set(streamed) == set(features)
+    assert all(np.isclose(streamed[name], features[name]) for name in features)
+
+    print("✅ N-gram timings derived from key events")
+    return True
+
 def test_ml_method():
     """Test the machine learning identification method"""
     print("\n=== Testing Machine Learning Method ===")
@@ -128,6 +373,877 @@ def test_ml_method():
     
     return True
 
+def write_profile(data_dir, username, samples):
+    """Write a user profile file the way typing_game does"""
+    with open(os.path.join(data_dir, f'{username}.json'), 'w') as f:
+        json.dump({'username': username, 'samples': samples}, f)
+
+def make_sample(scale=1.0):
+    """Build a small synthetic sample with timing and n-gram data"""
+    return {
+        'text': 'the quick brown fox',
+        'hold_times': [100 * scale, 110 * scale, 95 * scale, 105 * scale, 98 * scale],
+        'flight_times': [50 * scale, 55 * scale, 45 * scale, 60 * scale],
+        'down_down_times': [150 * scale, 160 * scale, 140 * scale, 155 * scale],
+        'ngram_data': {
+            'digraphs': {'th': [50 * scale, 52 * scale], 'he': [45 * scale]},
+            'trigraphs': {'the': [120 * scale]}
+        }
+    }
+
+def test_profile_store():
+    """Test that the profile store only reloads changed files"""
+    print("\n=== Testing Profile Store ===")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_profile(data_dir, 'alice', [make_sample(1.0)])
+        store = ProfileStore(data_dir)
+
+        profiles = load_profiles_statistical(store)
+        assert list(profiles) == ['alice']
+        version = store.version
+        assert load_profiles_statistical(store) is profiles  # served from memory
+        assert store.refresh() == version
+
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.2)])
+        write_profile(data_dir, 'bob', [make_sample(2.0)])
+        assert store.refresh() > version
+        profiles = load_profiles_statistical(store)
+        assert profiles['alice'].count == 2
+        assert load_profiles_ngram(store)['bob']['digraph_th'].count == 1
+
+        os.remove(os.path.join(data_dir, 'bob.json'))
+        assert 'bob' not in load_profiles_statistical(store)
+
+    print("✅ Profile store reloads only on change")
+    return True
+
+def test_ml_feature_schema():
+    """Test that ML features share one sparse column layout"""
+    print("\n=== Testing ML Feature Schema ===")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.1)])
+        bob_sample = make_sample(2.0)
+        bob_sample['ngram_data']['digraphs']['qu'] = [70]
+        write_profile(data_dir, 'bob', [bob_sample])
+        store = ProfileStore(data_dir)
+
+        X, y, vectorizer = prepare_ml_data(store)
+        assert X.format == 'csr' and X.shape == (3, 8)
+        assert list(y) == ['alice', 'alice', 'bob']
+        # Alice never typed "qu", so her rows store nothing for it
+        qu = vectorizer.vocabulary_['digraph_qu_mean']
+        assert X[0, qu] == 0 and X[0].nnz == 6
+
+        # Unseen n-grams are dropped and the width stays fixed
+        sample = extract_ngram_features(make_sample(1.0))
+        sample['digraph_zz_mean'] = 10.0
+        X_sample = vectorizer.transform([sample])
+        assert X_sample.shape == (1, 8) and X_sample.nnz == 6
+
+    print("✅ Training and prediction vectors line up")
+    return True
+
+def test_model_registry():
+    """Test that model sets stay resident and swap atomically"""
+    print("\n=== Testing Model Registry ===")
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        registry = ModelRegistry(models_dir)
+        assert registry.current() is None
+
+        models = {'vectorizer': {'vocab': 1}, 'scaler': 'scaler', 'knn': 'knn',
+                  'classifier': 'classifier', 'reference': None}
+        first = registry.publish(models)
+        assert first.version == 1
+        assert registry.current() is first  # no unpickling on repeat calls
+
+        # Another process sees the same live version on disk
+        other = ModelRegistry(models_dir)
+        assert other.current().version == 1 and other.current().vectorizer == {'vocab': 1}
+
+        second = registry.publish(dict(models, vectorizer={'vocab': 2}))
+        assert second.version == 2 and registry.current() is second
+        assert first.vectorizer == {'vocab': 1}  # in-flight holders keep their set
+        assert other.current().version == 2
+        assert registry.status()['version'] == 2
+
+    print("✅ Model registry hot-swaps published models")
+    return True
+
+def test_fast_training():
+    """Test the linear and random-feature classifiers and their training report"""
+    print("\n=== Testing Fast Training Modes ===")
+
+    original = (identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY,
+                identify_module.ML_CLASSIFIER, identify_module.ML_RFF_COMPONENTS)
+    original_game_dir = typing_game_app.DATA_DIR
+    rng = np.random.default_rng(9)
+    typists = benchmark.make_population(6, rng)
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as models_dir:
+        benchmark.write_population(data_dir, typists, 6, rng, events=True)
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        identify_module.MODEL_REGISTRY = ModelRegistry(models_dir)
+        identify_module.ML_RFF_COMPONENTS = 64
+        try:
+            query = extract_ngram_features(typists[2].sample(rng, benchmark.TEXTS[0], events=True))
+            for kind in ('linear', 'rff'):
+                identify_module.ML_CLASSIFIER = kind
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    assert train_ml_models()
+                assert not [w for w in caught if w.category.__name__ == 'ConvergenceWarning']
+                training = identify_module.MODEL_REGISTRY.status()['training']
+                assert training['classifier'] == kind and training['samples'] == 28
+                assert 0 <= training['ensemble_accuracy'] <= 1 and training['fit_s'] >= 0
+                model_set = identify_module.load_ml_models()
+                X = model_set.scaler.transform(model_set.vectorizer.transform([query]))
+                proba = model_set.classifier.predict_proba(X)
+                assert proba.shape == (1, 6) and abs(proba.sum() - 1) < 1e-6
+                assert predict_ml(query)[0] in {typist.name for typist in typists}
+                if kind == 'linear':
+                    # Fitted one class per core, predicted from one stacked model
+                    assert identify_module.make_classifier(kind).n_jobs == identify_module.ML_N_JOBS
+                    assert model_set.classifier.coef_.shape[0] == 6 and len(model_set.classifier.n_iter_) == 6
+                    X_ref, y_ref = model_set.reference
+                    ovr = identify_module.make_classifier(kind).fit(model_set.scaler.transform(X_ref), y_ref)
+                    assert np.allclose(ovr.decision_function(X), model_set.classifier.decision_function(X))
+
+            # The random-feature pipeline keeps learning from new samples
+            live = identify_module.load_ml_models()
+            benchmark.write_population(data_dir, typists[:1], 8, rng, events=True)
+            identify_module.PROFILE_STORE.refresh(force=True)
+            assert identify_module.update_ml_models()
+            updated = identify_module.load_ml_models()
+            assert updated.version == live.version + 1
+            assert updated.full_trained_at == live.full_trained_at
+            assert updated.training == live.training
+            assert updated.classifier is not live.classifier
+            assert not np.array_equal(updated.classifier[-1].coef_, live.classifier[-1].coef_)
+
+            # Updates use the store's cached feature rows: appended log lines
+            # are parsed once and nothing else is re-read or re-extracted
+            typing_game_app.DATA_DIR = data_dir
+            typist = typists[3]
+            typing_game_app.append_sample(typist.name, typist.sample(rng, benchmark.TEXTS[1], events=True))
+            assert identify_module.update_ml_models()
+            live = identify_module.load_ml_models()
+            extracted, reads = [], []
+            bulk, read_files = identify_module.extract_ngram_features_bulk, identify_module.read_user_files
+            identify_module.extract_ngram_features_bulk = lambda samples: extracted.append(len(samples)) or bulk(samples)
+            identify_module.read_user_files = lambda *args: reads.append(args) or read_files(*args)
+            try:
+                for _ in range(2):
+                    typing_game_app.append_sample(typist.name, typist.sample(rng, benchmark.TEXTS[2], events=True))
+                assert identify_module.update_ml_models()
+            finally:
+                identify_module.extract_ngram_features_bulk = bulk
+                identify_module.read_user_files = read_files
+            assert sum(extracted) == 2 and not reads
+            # The profile store keeps statistics only; the rows live with training
+            assert all(set(entry) & {'rows', 'ngram_features'} == set()
+                       for entry in identify_module.PROFILE_STORE.entries())
+            updated = identify_module.load_ml_models()
+            assert updated.reference[0].shape[0] == live.reference[0].shape[0] + 2
+            assert updated.sample_counts[typist.name] == live.sample_counts[typist.name] + 2
+            assert identify_module.training_rows().counts() == updated.sample_counts
+        finally:
+            (identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY,
+             identify_module.ML_CLASSIFIER, identify_module.ML_RFF_COMPONENTS) = original
+            typing_game_app.DATA_DIR = original_game_dir
+
+    print("✅ Fast classifiers train, report held-out accuracy and update online")
+    return True
+
+def test_training_worker():
+    """Test that a burst of training requests runs a single job"""
+    print("\n=== Testing Training Worker ===")
+
+    data = {'alice': 3}
+    live = {'counts': None}
+    runs = []
+
+    def train(full=False):
+        runs.append(dict(data))
+        live['counts'] = dict(data)
+        return True
+
+    worker = TrainingWorker(train, lambda: data, lambda: live['counts'],
+                            debounce=0.2, poll_interval=0.05)
+    for _ in range(5):
+        worker.request()
+    assert worker.wait_idle(timeout=5)
+    assert runs == [{'alice': 3}]
+    assert worker.status()['last_result'] == 'published'
+
+    # A new enrollment is noticed by polling, without any request
+    data = {'alice': 3, 'bob': 1}
+    worker.fingerprint_fn = lambda: data
+    deadline = time.monotonic() + 5
+    while len(runs) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert worker.wait_idle(timeout=5)
+    assert runs[-1] == {'alice': 3, 'bob': 1} and len(runs) == 2
+
+    print("✅ Training requests are coalesced")
+    return True
+
+def test_sample_log():
+    """Test concurrent appends, compaction and incremental profile reads"""
+    print("\n=== Testing Sample Log ===")
+
+    original_dir = typing_game_app.DATA_DIR
+    with tempfile.TemporaryDirectory() as data_dir:
+        typing_game_app.DATA_DIR = data_dir
+        try:
+            write_profile(data_dir, 'alice', [make_sample(1.0)])
+            store = ProfileStore(data_dir)
+            assert load_profiles_statistical(store)['alice'].count == 1
+
+            # Concurrent submissions for one user must not lose samples
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda i: typing_game_app.append_sample('alice', make_sample(1.0 + i / 100)),
+                              range(40)))
+            assert load_profiles_statistical(store)['alice'].count == 41
+
+            # A log-only user shows up under the log's file name
+            typing_game_app.append_sample('carol', make_sample(2.0))
+            assert 'carol' in load_profiles_statistical(store)
+
+            assert typing_game_app.compact_user_log('alice') == 40
+            assert os.path.getsize(os.path.join(data_dir, 'alice.jsonl')) == 0
+            with open(os.path.join(data_dir, 'alice.json')) as f:
+                assert len(json.load(f)['samples']) == 41
+            typing_game_app.append_sample('alice', make_sample(1.5))
+            assert load_profiles_statistical(store)['alice'].count == 42
+
+            # A compaction that died before swapping the log counts nothing twice
+            samples = [make_sample(3.0), make_sample(3.1)]
+            for sample in samples:
+                typing_game_app.append_sample('dave', sample)
+            log_stat = os.stat(os.path.join(data_dir, 'dave.jsonl'))
+            with open(os.path.join(data_dir, 'dave.json'), 'w') as f:
+                json.dump({'username': 'dave', 'samples': samples,
+                           'compacted_log': {'inode': log_stat.st_ino, 'size': log_stat.st_size}}, f)
+            typing_game_app.append_sample('dave', make_sample(3.2))
+            assert load_profiles_statistical(store)['dave'].count == 3
+            assert typing_game_app.compact_user_log('dave') == 1
+            assert load_profiles_statistical(store)['dave'].count == 3
+
+            # Usernames that are not plain file names never reach the disk
+            game = typing_game_app.app.test_client()
+            for username in ('../escaped', 'a/b', '.hidden', 42):
+                response = game.post('/submit', json=dict(make_sample(1.0), username=username))
+                assert response.status_code == 400
+            assert not os.path.exists(os.path.join(data_dir, '..', 'escaped.jsonl'))
+            assert game.post('/submit', json=[1, 2]).status_code == 400
+        finally:
+            typing_game_app.DATA_DIR = original_dir
+
+    print("✅ Sample log keeps every submission")
+    return True
+
+def test_binary_upload():
+    """Test that binary keystroke uploads decode to the same sample as JSON"""
+    print("\n=== Testing Binary Uploads ===")
+
+    rng = np.random.default_rng(13)
+    typists = benchmark.make_population(4, rng)
+    sample = typists[1].sample(rng, benchmark.TEXTS[3], events=True)
+    events = [{'key': 'Shift', 'time': -5.0, 'type': 'down'}] + sample['timings']
+    events.insert(2, {'key': 'Shift', 'time': 3.0, 'type': 'up'})
+    body = encode_keystrokes({'text': sample['text'], 'method': 'ngram'}, events)
+    assert len(body) < len(json.dumps(dict(sample, keystroke_sequence=sample['timings']))) / 10
+
+    decoded = identify_module.decode_keystrokes(body)
+    assert decoded['method'] == 'ngram' and 'event_count' not in decoded
+    arrays = decoded['timing_arrays']
+    assert isinstance(arrays['time'], np.ndarray) and len(arrays['key']) == len(events)
+    assert decode_key(arrays['key'][0]) == 'Shift' and arrays['time'][0] == 0
+    # Hold, flight and down-down times match the client-measured ones
+    assert np.allclose(decoded['hold_times'][1:], sample['hold_times'], atol=0.11)
+    assert np.allclose(decoded['flight_times'][1:], sample['flight_times'], atol=0.21)
+    assert np.allclose(decoded['down_down_times'][1:], sample['down_down_times'], atol=0.21)
+    json_features = extract_ngram_features(sample)
+    binary_features = extract_ngram_features(decoded)
+    assert binary_features.keys() == json_features.keys()
+    assert all(abs(binary_features[k] - json_features[k]) < 0.2 for k in json_features)
+
+    for bad in (b'KST0' + body[4:], body[:-1], body[:12]):
+        try:
+            identify_module.decode_keystrokes(bad)
+            assert False, 'malformed upload decoded'
+        except ValueError:
+            pass
+
+    original = typing_game_app.DATA_DIR, identify_module.PROFILE_STORE
+    with tempfile.TemporaryDirectory() as data_dir:
+        typing_game_app.DATA_DIR = data_dir
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        try:
+            # /submit stores the events once, as columns identify_app reads
+            game = typing_game_app.app.test_client()
+            uploads = []
+            for typist in typists:
+                for text in benchmark.TEXTS[:3]:
+                    events = typist.sample(rng, text, events=True)['timings']
+                    history = [{'value': text[:i + 1], 'time': 100.0 * i} for i in range(len(text))]
+                    uploads.append(encode_keystrokes(
+                        {'username': typist.name, 'text': text, 'inputHistory': history}, events))
+                    response = game.post('/submit', data=uploads[-1],
+                                         content_type='application/x-keystrokes')
+                    assert response.status_code == 200
+            with open(os.path.join(data_dir, f'{typists[0].name}.jsonl')) as f:
+                stored = json.loads(f.readline())
+            assert 'timings' not in stored and len(stored['timing_arrays']['time']) == 2 * len(benchmark.TEXTS[0])
+            assert len(stored['hold_times']) == len(benchmark.TEXTS[0])
+            # The field values typed, corrections included, travel in the header
+            assert stored['inputHistory'][-1] == {'value': benchmark.TEXTS[0], 'time': 100.0 * (len(benchmark.TEXTS[0]) - 1)}
+            # Both apps decode the same payload to the same timings
+            decoded = identify_module.decode_keystrokes(uploads[0])
+            for field in ('hold_times', 'flight_times', 'down_down_times'):
+                assert stored[field] == decoded[field].tolist()
+            assert stored['timing_arrays'] == {k: v.tolist() for k, v in decoded['timing_arrays'].items()}
+            assert game.post('/submit', data=body[:-1],
+                             content_type='application/x-keystrokes').status_code == 400
+
+            # /identify gives the same answer for either encoding
+            client = identify_module.app.test_client()
+            query = typists[2].sample(rng, benchmark.TEXTS[0], events=True)
+            for method in ('statistical', 'ngram'):
+                binary = client.post('/identify', content_type='application/x-keystrokes',
+                                     data=encode_keystrokes(
+                                         {'text': query['text'], 'method': method}, query['timings']))
+                plain = client.post('/identify', json=dict(query, method=method))
+                assert binary.status_code == plain.status_code == 200
+                assert binary.get_json()['user'] == plain.get_json()['user'] == typists[2].name
+            assert client.post('/identify', data=body[:12],
+                               content_type='application/x-keystrokes').status_code == 400
+        finally:
+            typing_game_app.DATA_DIR, identify_module.PROFILE_STORE = original
+
+    print("✅ Binary uploads decode into the same timings as JSON")
+    return True
+
+def test_load_test():
+    """Test the load generator against both apps and its lost-write check"""
+    print("\n=== Testing Load Test Harness ===")
+
+    import argparse
+    import threading
+    import load_test
+    from werkzeug.serving import make_server
+
+    original = typing_game_app.DATA_DIR, identify_module.PROFILE_STORE
+    with tempfile.TemporaryDirectory() as data_dir:
+        typing_game_app.DATA_DIR = data_dir
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        servers = [make_server('127.0.0.1', 0, app, threaded=True)
+                   for app in (typing_game_app.app, identify_module.app)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            rng = np.random.default_rng(17)
+            args = argparse.Namespace(
+                submit_url=f'http://127.0.0.1:{servers[0].server_port}',
+                identify_url=f'http://127.0.0.1:{servers[1].server_port}',
+                requests=60, rate=200, concurrency=4, submit_fraction=0.5, method='statistical',
+                format='binary', timeout=10)
+            requests = load_test.build_requests(load_test.synthetic_sessions(5, rng), args, 'loadtest-t', rng)
+            records, start = load_test.run_load(requests, args)
+            stats = load_test.endpoint_stats(records, start)
+            assert sum(s['requests'] for s in stats.values()) == 60
+            assert stats['submit']['error_rate'] == 0 and stats['submit']['p50_ms'] > 0
+            # Identifies before the first enrollment are 400s, not lost requests
+            assert set(stats['identify']['errors']) <= {'400'}
+            writes = load_test.check_writes(records, data_dir)
+            assert writes['acknowledged'] == stats['submit']['requests']
+            assert writes['lost'] == writes['duplicated'] == 0
+
+            # A dropped and a doubled log line are both reported
+            submitted = sorted({r[1] for r in records if r[0] == 'submit'})
+            for username, change in zip(submitted, (lambda lines: lines[1:], lambda lines: lines + lines[:1])):
+                path = os.path.join(data_dir, f'{username}.jsonl')
+                with open(path) as f:
+                    lines = f.readlines()
+                with open(path, 'w') as f:
+                    f.writelines(change(lines))
+            writes = load_test.check_writes(records, data_dir)
+            assert writes['lost'] == 1 and writes['duplicated'] == 1
+            assert list(writes['lost_by_user']) == submitted[:1]
+            load_test.remove_run_data(data_dir, 'loadtest-t')
+            assert os.listdir(data_dir) == []
+        finally:
+            for server in servers:
+                server.shutdown()
+            typing_game_app.DATA_DIR, identify_module.PROFILE_STORE = original
+
+    print("✅ Load test measures both apps and catches lost writes")
+    return True
+
+def test_columnar_store():
+    """Test that the memory-mapped snapshot matches the JSON profiles"""
+    print("\n=== Testing Columnar Timing Store ===")
+
+    original_dir = typing_game_app.DATA_DIR
+    with tempfile.TemporaryDirectory() as data_dir:
+        typing_game_app.DATA_DIR = data_dir
+        try:
+            write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.3)])
+            typing_game_app.append_sample('alice', make_sample(1.1))
+            expected = load_profiles_statistical(ProfileStore(data_dir))['alice']
+
+            assert build_columnar_store(data_dir) == 3
+            columnar = ColumnarStore(os.path.join(data_dir, 'timings'))
+            samples = columnar.user_samples('alice')
+            assert isinstance(samples[0]['hold_times'], np.memmap)
+            assert samples[0]['hold_times'].dtype == np.float32
+
+            store = ProfileStore(data_dir)
+            stats = load_profiles_statistical(store)['alice']
+            assert np.allclose(stats.mean, expected.mean) and np.allclose(stats.std, expected.std)
+            assert store._columnar is not None
+
+            # Samples logged after the snapshot are read from the log
+            typing_game_app.append_sample('alice', make_sample(1.2))
+            assert load_profiles_statistical(store)['alice'].count == 4
+        finally:
+            typing_game_app.DATA_DIR = original_dir
+
+    print("✅ Columnar store loads the same profiles")
+    return True
+
+def test_stream_session():
+    """Test that streamed keystrokes give the same statistics as the batch path"""
+    print("\n=== Testing Streaming Identification ===")
+
+    rng = np.random.default_rng(0)
+    values = rng.normal(100, 20, 50)
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert np.isclose(stats.mean, np.mean(values))
+    assert np.isclose(stats.std, np.std(values))
+
+    text = 'the quick brown fox'
+    events = []
+    now = 0.0
+    for char in text:
+        down = now
+        events.append({'key': char, 'code': f'Key{char}', 'time': down, 'type': 'down'})
+        events.append({'key': char, 'code': f'Key{char}', 'time': down + 80, 'type': 'up'})
+        now += 150
+    events.sort(key=lambda event: event['time'])
+
+    session = StreamSession('statistical', update_every=1000)
+    for start in range(0, len(events), 7):
+        session.add_events(events[start:start + 7])
+    assert session.keystrokes == len(text)
+    assert np.allclose(session.summary_vector(), [80, 0, 70, 0, 150, 0])
+
+    features = session.ngram_features()
+    assert features['digraph_th_mean'] == 150
+    assert features['trigraph_the_mean'] == 300
+    # N-grams never span a space
+    assert not any(name.startswith('digraph_e') for name in features)
+
+    # Chunks posted concurrently to one session are all counted
+    session = StreamSession('statistical', update_every=1000)
+    chunks = [[{'key': 'a', 'time': t, 'type': 'down'}, {'key': 'a', 'time': t + 80, 'type': 'up'}]
+              for t in range(0, 400 * 200, 200)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(session.add_events, chunks))
+    assert session.keystrokes == session.hold.n == 400 and session.hold.mean == 80
+
+    # Without a subscriber only the newest ranking waits in the feed
+    for i in range(50):
+        session._publish({'keystrokes': i})
+    assert session.updates.qsize() == 1 and session.updates.get_nowait() == {'keystrokes': 49}
+
+    # Idle sessions are closed and dropped
+    sessions = identify_module.StreamSessions()
+    session_id = sessions.create(session)
+    session.last_active -= identify_module.STREAM_SESSION_TTL + 1
+    sessions.expire(force=True)
+    assert sessions.get(session_id) is None and session.closed and len(sessions) == 0
+
+    # Serve-mode workers share sessions through files: chunks posted to
+    # different workers, even concurrently, land in one session
+    with tempfile.TemporaryDirectory() as root:
+        workers = [identify_module.SharedStreamSessions(root) for _ in range(2)]
+        session_id = workers[0].create(StreamSession('statistical', update_every=1000))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: workers[i % 2].add_events(session_id, chunks[i]), range(len(chunks))))
+        shared = workers[1].get(session_id)
+        assert shared.keystrokes == shared.hold.n == 400 and shared.hold.mean == 80
+        assert workers[0].add_events('0' * 32, chunks[0]) is None and workers[1].get('../x') is None
+        closed, _ = workers[1].close(session_id)
+        assert closed.keystrokes == 400 and workers[0].get(session_id) is None and len(workers[0]) == 0
+        assert os.listdir(root) == []
+
+        session_id = workers[0].create(StreamSession('statistical'))
+        os.utime(os.path.join(root, f'{session_id}.pkl'), (0, 0))
+        workers[1].expire(force=True)
+        assert workers[0].get(session_id) is None
+
+    # Malformed bodies and events are rejected rather than failing mid-stream
+    client = identify_module.app.test_client()
+    assert client.post('/stream', json={'update_every': 'x'}).status_code == 400
+    assert client.post('/stream', json=[]).status_code == 400
+    session_id = client.post('/stream', json={'update_every': 2}).get_json()['session_id']
+    for body in ([], {'events': {}}, {'events': [1]},
+                 {'events': [{'key': 'a', 'time': 'x', 'type': 'down'}]},
+                 {'events': [{'key': 5, 'time': 0, 'type': 'down'}]}):
+        assert client.post(f'/stream/{session_id}/events', json=body).status_code == 400
+    response = client.post(f'/stream/{session_id}/events', json={'events': events[:4]})
+    assert response.status_code == 200 and response.get_json()['keystrokes'] == 2
+
+    print("✅ Streaming statistics match the batch computation")
+    return True
+
+def test_cascade():
+    """Test that the cascade narrows the population and exits early"""
+    print("\n=== Testing Cascade Method ===")
+
+    original = identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY, identify_module.CASCADE_EXIT
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as models_dir:
+        for i in range(30):
+            write_profile(data_dir, f'user{i:02d}', [make_sample(1 + i / 10), make_sample(1.02 + i / 10)])
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        identify_module.MODEL_REGISTRY = ModelRegistry(models_dir)
+        try:
+            sample = make_sample(2.01)
+            sample_vec = identify_module.request_summary_vector(sample)
+            features = extract_ngram_features(sample)
+
+            # The statistical stage alone is confident here
+            user, acceptance, analysis, matches = identify_module.compare_sample_cascade(sample_vec, features)
+            assert user == 'user10' and analysis['decided_by'] == 'statistical'
+            assert [stage['stage'] for stage in analysis['stages']] == ['statistical']
+
+            # Never confident: every stage runs, later ones on the shortlist only
+            identify_module.CASCADE_EXIT = {}
+            user, acceptance, analysis, matches = identify_module.compare_sample_cascade(
+                sample_vec, features, shortlist_size=5)
+            statistical, ngram, ml = analysis['stages']
+            assert statistical['candidates'] == 30 and statistical['shortlist'] == 5
+            assert ngram['candidates'] == 5
+            assert ml == {'stage': 'ml', 'skipped': 'no live model'}
+            assert user == 'user10' and analysis['decided_by'] == 'ngram'
+        finally:
+            (identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY,
+             identify_module.CASCADE_EXIT) = original
+
+    print("✅ Cascade shortlists and exits early")
+    return True
+
+def test_synthetic_typists():
+    """Test that benchmark typists produce consistent, identifiable samples"""
+    print("\n=== Testing Synthetic Typists ===")
+
+    rng = np.random.default_rng(5)
+    typists = benchmark.make_population(3, rng)
+    text = benchmark.TEXTS[0]
+    sample = typists[0].sample(rng, text, events=True)
+    assert len(sample['hold_times']) == len(text)
+    assert len(sample['flight_times']) == len(sample['down_down_times']) == len(text) - 1
+    assert len(sample['timings']) == 2 * len(text)
+    assert sample['ngram_data']['digraphs']['th'] and sample['ngram_data']['trigraphs']['the']
+    # The same seed gives the same population
+    again = benchmark.make_population(3, np.random.default_rng(5))[0]
+    assert again.sample(np.random.default_rng(1), text) == typists[0].sample(np.random.default_rng(1), text)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        benchmark.write_population(data_dir, typists, 6, rng)
+        index = build_ngram_index(load_profiles_ngram(ProfileStore(data_dir)))
+        query = extract_ngram_features(typists[1].sample(rng, text))
+        assert compare_sample_to_profiles_ngram(query, index)[3][0]['user'] == typists[1].name
+
+    print("✅ Synthetic typists are reproducible and distinguishable")
+    return True
+
+def test_metrics():
+    """Test the Prometheus metrics and per-stage timings"""
+    print("\n=== Testing Metrics ===")
+
+    metrics = identify_module.Metrics(buckets=(0.01, 0.1))
+    metrics.describe('latency_seconds', 'Test latency')
+    for seconds in (0.005, 0.05, 0.5):
+        metrics.observe('latency_seconds', seconds, stage='scoring')
+    metrics.inc('requests_total', method='ngram')
+    text = metrics.render([('profiles', 'Profiles', 3)])
+    assert 'latency_seconds_bucket{stage="scoring",le="0.01"} 1' in text
+    assert 'latency_seconds_bucket{stage="scoring",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{stage="scoring",le="+Inf"} 3' in text
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'requests_total{method="ngram"} 1' in text and 'profiles 3' in text
+
+    original = identify_module.PROFILE_STORE
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.1)])
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        try:
+            client = identify_module.app.test_client()
+            identify_module.SERVER_TIMING = True
+            response = client.post('/identify', json=dict(make_sample(1.0), method='ngram'))
+            stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+            assert stages == ['feature_extraction', 'profile_load', 'scoring', 'total']
+            text = client.get('/metrics').get_data(as_text=True)
+            assert 'identify_results_total{method="ngram",outcome="match"}' in text
+            assert 'identify_stage_duration_seconds_count{method="ngram",stage="scoring"}' in text
+            assert 'identify_profiles 1' in text
+        finally:
+            identify_module.SERVER_TIMING = False
+            identify_module.PROFILE_STORE = original
+
+    print("✅ Metrics and Server-Timing report every stage")
+    return True
+
+def test_result_cache():
+    """Test that repeated samples are served from the result cache until profiles change"""
+    print("\n=== Testing Result Cache ===")
+
+    original = identify_module.PROFILE_STORE, identify_module.RESULT_CACHE
+    calls = []
+    run_identification = identify_module.run_identification
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.1)])
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        identify_module.RESULT_CACHE = identify_module.ResultCache(max_size=2, ttl=60)
+        identify_module.run_identification = lambda samples, method, inputs: (
+            calls.append(len(samples)) or run_identification(samples, method, inputs))
+        try:
+            first = identify_module.identify_samples([make_sample(1.0)], 'ngram')[0]
+            # A resubmission with other metadata has the same features
+            again = identify_module.identify_samples([dict(make_sample(1.0), timestamp='later')], 'ngram')
+            assert again == [dict(first, cached=True)] and calls == [1]
+            assert 'cached' not in first
+            identify_module.identify_samples([make_sample(1.0)], 'statistical')
+            assert calls == [1, 1]
+
+            # Least recently used entries go first
+            identify_module.identify_samples([make_sample(1.3)], 'ngram')
+            assert len(identify_module.RESULT_CACHE) == 2
+            identify_module.identify_samples([make_sample(1.0)], 'ngram')
+            assert calls == [1, 1, 1, 1]
+
+            # A new enrollment invalidates everything
+            identify_module.identify_samples([make_sample(1.3)], 'ngram')
+            assert calls == [1, 1, 1, 1]
+            write_profile(data_dir, 'bob', [make_sample(1.3)])
+            identify_module.PROFILE_STORE.refresh(force=True)
+            result = identify_module.identify_samples([make_sample(1.3)], 'ngram')[0]
+            assert calls == [1, 1, 1, 1, 1] and result['user'] == 'bob'
+
+            # Expired entries are recomputed
+            identify_module.RESULT_CACHE.ttl = 0
+            identify_module.identify_samples([make_sample(1.4)], 'ngram')
+            identify_module.identify_samples([make_sample(1.4)], 'ngram')
+            assert calls == [1, 1, 1, 1, 1, 1, 1]
+
+            # Cascade hits do not replay the stage timings of the computation
+            identify_module.RESULT_CACHE.ttl = 60
+            computed = identify_module.identify_samples([make_sample(1.0)], 'cascade')[0]
+            hit = identify_module.identify_samples([make_sample(1.0)], 'cascade')[0]
+            assert computed['analysis']['stages'] and hit['cached'] and 'stages' not in hit['analysis']
+            assert hit['analysis']['decided_by'] == computed['analysis']['decided_by']
+            assert calls == [1, 1, 1, 1, 1, 1, 1, 1]
+        finally:
+            identify_module.run_identification = run_identification
+            identify_module.PROFILE_STORE, identify_module.RESULT_CACHE = original
+
+    print("✅ Result cache hits, evicts and invalidates")
+    return True
+
+def test_method_registry():
+    """Test that heavy dependencies load only with the methods that need them"""
+    print("\n=== Testing Method Registry ===")
+
+    # A fresh interpreter: importing the app loads neither scipy nor sklearn,
+    # a statistical request still does not, and prewarming ngram loads scipy
+    script = (
+        "import sys, identify_app.app as app\n"
+        "heavy = lambda: sorted({m.split('.')[0] for m in sys.modules} & {'scipy', 'sklearn'})\n"
+        "print(heavy())\n"
+        "sample = {'hold_times': [100] * 5, 'flight_times': [50] * 4, 'down_down_times': [150] * 4}\n"
+        "app.identify_samples([sample], 'statistical')\n"
+        "print(heavy(), app.method_loaded('statistical'), app.method_loaded('ngram'))\n"
+        "app.prewarm_methods(['ngram'])\n"
+        "print(heavy(), app.method_loaded('ngram'), app.method_loaded('ml'))\n"
+    )
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+    assert output.splitlines() == ['[]', '[] True False', "['scipy'] True False"]
+
+    try:
+        identify_module.prewarm_methods(['nonexistent'])
+        assert False, 'unknown methods must be rejected'
+    except ValueError:
+        pass
+
+    print("✅ Methods load their dependencies on first use")
+    return True
+
+def test_verification():
+    """Test 1:1 verification against the claimed user's profile only"""
+    print("\n=== Testing Verification ===")
+
+    original = identify_module.PROFILE_STORE, identify_module.VERIFY_USER_THRESHOLDS
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as root:
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.1)])
+        write_profile(data_dir, 'bob', [make_sample(3.0), make_sample(3.3)])
+        thresholds = os.path.join(root, 'thresholds.json')
+        identify_module.VERIFY_USER_THRESHOLDS = identify_module.ThresholdFile(thresholds)
+        store = identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        client = identify_module.app.test_client()
+        try:
+            sample = make_sample(1.05)
+            response = client.post('/verify', json=dict(sample, username='alice', method='ngram'))
+            result = response.get_json()
+            assert response.status_code == 200 and result['accepted'] and result['threshold'] == 0.6
+            # Only the claimed user's files were read
+            assert list(store._entries) == ['alice']
+
+            # Scores agree with what /identify gives the same user
+            for method in ('statistical', 'ngram'):
+                matches = client.post('/identify', json=dict(sample, method=method)).get_json()['all_matches']
+                expected = {m['user']: m['acceptance'] for m in matches}
+                for user in ('alice', 'bob'):
+                    score = identify_module.verify_sample(user, sample, method).get('score', 0.0)
+                    assert np.isclose(score, expected.get(user, 0.0))
+            assert not identify_module.verify_sample('bob', sample, 'statistical')['accepted']
+
+            # Serve-mode workers look the user up in the shared generation
+            identify_module.publish_generation(store, root)
+            shared = identify_module.SharedProfileStore(root)
+            assert (identify_module.load_verify_profile('bob', shared).ngrams.keys() ==
+                    identify_module.load_verify_profile('bob', store).ngrams.keys())
+            identify_module.PROFILE_STORE = shared
+            assert identify_module.verify_sample('alice', sample, 'ngram')['score'] == result['score']
+            identify_module.PROFILE_STORE = store
+
+            # Per-user thresholds
+            slower = dict(make_sample(1.15), username='alice', method='ngram')
+            assert client.post('/verify', json=slower).get_json()['accepted']
+            with open(thresholds, 'w') as f:
+                json.dump({'alice': {'ngram': 0.95}}, f)
+            result = client.post('/verify', json=slower).get_json()
+            assert result['threshold'] == 0.95 and not result['accepted']
+
+            assert client.post('/verify', json=dict(sample, username='carol')).status_code == 404
+            # A profile sharing no n-grams with the sample rejects it; only a
+            # user without an n-gram profile is unknown to the method
+            unrelated = dict(sample, ngram_data={'digraphs': {'zq': [50, 52]}, 'trigraphs': {}})
+            result = identify_module.verify_sample('alice', unrelated, 'ngram')
+            assert result['score'] == 0.0 and not result['accepted']
+            write_profile(data_dir, 'dave', [{k: v for k, v in sample.items() if k != 'ngram_data'}])
+            assert identify_module.verify_sample('dave', sample, 'ngram')['status'] == 404
+            assert client.post('/verify', json=dict(sample, username='../alice')).status_code == 400
+            assert client.post('/verify', json=dict(sample, username='alice', method='cascade')).status_code == 400
+        finally:
+            identify_module.PROFILE_STORE, identify_module.VERIFY_USER_THRESHOLDS = original
+
+    print("✅ Verification scores only the claimed user")
+    return True
+
+def test_ml_verification():
+    """Test that ML verification evaluates only the claimed user's rows and SVMs"""
+    print("\n=== Testing ML Verification ===")
+
+    original = identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY, identify_module.ML_CLASSIFIER
+    rng = np.random.default_rng(5)
+    typists = benchmark.make_population(6, rng)
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as models_dir:
+        benchmark.write_population(data_dir, typists, 10, rng, events=True)
+        identify_module.PROFILE_STORE = ProfileStore(data_dir)
+        identify_module.MODEL_REGISTRY = ModelRegistry(models_dir)
+        try:
+            for kind in ('svc', 'sgd', 'linear'):
+                identify_module.ML_CLASSIFIER = kind
+                assert train_ml_models()
+                model_set = identify_module.load_ml_models()
+                verifier = identify_module.ml_verifier(model_set)
+                assert identify_module.ml_verifier(model_set) is verifier
+
+                # The per-user decisions are the ones the full classifier computes
+                X_ref, y_ref = model_set.reference
+                X = model_set.scaler.transform(X_ref[:4])
+                classifier = model_set.classifier
+                if kind == 'svc':
+                    classifier = copy.deepcopy(classifier)
+                    classifier.decision_function_shape = 'ovo'
+                    pairs = list(combinations(range(len(classifier.classes_)), 2))
+                for row in range(4):
+                    index = verifier.class_index[y_ref[row]]
+                    if kind == 'svc':
+                        full = classifier.decision_function(X[row])[0]
+                        own = [full[p] if i == index else -full[p]
+                               for p, (i, j) in enumerate(pairs) if index in (i, j)]
+                        assert np.allclose(verifier.svc_pairs.decisions(X[row], index), own)
+                    else:
+                        decision = classifier.decision_function(X[row])[0][index]
+                        assert np.isclose(verifier.classifier_score(X[row], y_ref[row]), 1 / (1 + np.exp(-decision)))
+                    # A reference row is its own nearest neighbour
+                    assert verifier.knn_score(X[row], y_ref[row]) > 0
+
+                genuine, impostor = [], []
+                for i, typist in enumerate(typists * 3):
+                    sample = typist.sample(rng, benchmark.TEXTS[i % len(benchmark.TEXTS)], events=True)
+                    genuine.append(identify_module.verify_sample(typist.name, sample, 'ml')['score'])
+                    impostor.append(identify_module.verify_sample(typists[i % len(typists) - 1].name, sample, 'ml')['score'])
+                assert all(0 <= score <= 1 for score in genuine + impostor)
+                assert np.mean(genuine) > np.mean(impostor)
+            assert identify_module.verify_sample('carol', sample, 'ml')['status'] == 404
+        finally:
+            identify_module.PROFILE_STORE, identify_module.MODEL_REGISTRY, identify_module.ML_CLASSIFIER = original
+
+    print("✅ ML verification scores only the claimed user")
+    return True
+
+def test_shared_profiles():
+    """Test that workers serve the coordinator's published profile generations"""
+    print("\n=== Testing Shared Profile Generations ===")
+
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as root:
+        write_profile(data_dir, 'alice', [make_sample(1.0), make_sample(1.1)])
+        write_profile(data_dir, 'bob', [make_sample(2.0)])
+        store = ProfileStore(data_dir)
+        assert identify_module.publish_generation(store, root) == store.version
+        shared = identify_module.SharedProfileStore(root)
+        assert shared.refresh() == store.version and shared.users() == ['alice', 'bob']
+
+        # Same results as the worker's own store, from read-only mapped arrays
+        index = identify_module.load_statistical_index(shared)
+        assert isinstance(index.means, np.memmap) and not index.means.flags.writeable
+        assert np.array_equal(index.means, identify_module.load_statistical_index(store).means)
+        sample = make_sample(1.05)
+        features = extract_ngram_features(sample)
+        ngram_index = identify_module.load_ngram_index(shared)
+        assert not ngram_index.entries.data.flags.writeable
+        assert (compare_sample_to_profiles_ngram(features, ngram_index) ==
+                compare_sample_to_profiles_ngram(features, identify_module.load_ngram_index(store)))
+        assert identify_module.candidate_report(shared)['methods']['ngram']['users'] == 2
+        # Values built from per-user entries are refused, not built from nothing
+        for build in (identify_module.training_data_counts, identify_module.load_profiles_statistical):
+            try:
+                build(shared)
+                assert False, 'per-user value built in a worker'
+            except ValueError as e:
+                assert 'serve-mode workers' in str(e)
+
+        # A new generation is picked up without a restart; old ones are pruned
+        for i in range(3):
+            write_profile(data_dir, f'carol{i}', [make_sample(3.0 + i)])
+            store.refresh(force=True)
+            identify_module.publish_generation(store, root)
+        assert shared.refresh() == store.version and len(shared.users()) == 5
+        assert len(identify_module.load_statistical_index(shared).users) == 5
+        assert len([name for name in os.listdir(root) if name.startswith('g')]) == 2
+
+    print("✅ Workers map published generations read-only")
+    return True
+
 def main():
     """Run all tests"""
     print("🧪 Testing Multi-Method Typing Identification System")
@@ -140,7 +1256,7 @@ def main():
         return
     
     # Check if there are any user files
-    user_files = [f for f in os.listdir(data_dir) if f.endswith('.json')]
+    user_files = [f for f in os.listdir(data_dir) if f.endswith(('.json', '.jsonl'))]
     if not user_files:
         print("❌ No user data found. Please run the typing game first to collect data.")
         return
@@ -148,17 +1264,25 @@ def main():
     print(f"✅ Found {len(user_files)} user data files")
     
     # Run tests
-    stats_ok = test_statistical_method()
-    ngram_ok = test_ngram_method()
-    ml_ok = test_ml_method()
+    store_ok = all([test_profile_store(), test_sufficient_stats(), test_sample_log(),
+                    test_columnar_store(), test_synthetic_typists(), test_metrics(),
+                    test_shared_profiles(), test_result_cache(), test_method_registry(),
+                    test_binary_upload(), test_load_test()])
+    stats_ok = all([test_statistical_method(), test_statistical_index(), test_batch_statistical(),
+                    test_stream_session()])
+    ngram_ok = all([test_ngram_method(), test_ngram_index(), test_ngram_extraction(),
+                    test_candidate_index(), test_verification(), test_ml_verification()])
+    ml_ok = all([test_ml_method(), test_ml_feature_schema(), test_model_registry(),
+                 test_fast_training(), test_training_worker(), test_cascade()])
     
     print("\n" + "=" * 60)
     print("📊 Test Results Summary:")
+    print(f"Profile Store: {'✅ PASS' if store_ok else '❌ FAIL'}")
     print(f"Statistical Method: {'✅ PASS' if stats_ok else '❌ FAIL'}")
     print(f"N-Gram Method: {'✅ PASS' if ngram_ok else '❌ FAIL'}")
     print(f"ML Method: {'✅ PASS' if ml_ok else '❌ FAIL'}")
     
-    if stats_ok and ngram_ok and ml_ok:
+    if store_ok and stats_ok and ngram_ok and ml_ok:
         print("\n🎉 All methods are working correctly!")
     else:
         print("\n⚠️  Some methods failed. Check the data and implementation.")
@@ -1,34 +1,222 @@
 import os
 import json
-from flask import Flask, request, jsonify, render_template
+import sys
+import threading
+import time
+import urllib.request
+from flask import Flask, Response, request, jsonify, render_template
 from flask_cors import CORS
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# common/ at the repository root holds the code shared with identify_app
+ROOT_DIR = os.path.join(BASE_DIR, '..')
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.metrics import Metrics, instrument_app
+from common.sample_log import compacted_log_offset, read_log_samples, valid_username
+from common.keystrokes import KEYSTROKES_MIMETYPE, decode_keystrokes
+
 app = Flask(__name__)
 CORS(app)
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
 
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still atomic enough for one process
+    fcntl = None
+
+# Optional base URL of identify_app; it is told about every stored sample
+# so it can fold new samples into its ML models right away
+IDENTIFY_APP_URL = os.environ.get('IDENTIFY_APP_URL')
+
+# Seconds between compaction passes, and the log size worth compacting
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', 3600))
+COMPACT_MIN_BYTES = int(os.environ.get('COMPACT_MIN_BYTES', 256 * 1024))
+
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
+# ===== METRICS =====
+# Shared with identify_app, see common/metrics.py
+METRICS = Metrics()
+METRICS.describe('typing_game_stage_duration_seconds', 'Time spent in each storage stage')
+METRICS.describe('typing_game_samples_total', 'Samples appended to user logs')
+METRICS.describe('typing_game_compacted_samples_total', 'Samples moved from logs into profiles')
+instrument_app(app, METRICS, server_timing=lambda: SERVER_TIMING)
+
+def timed_stage(stage):
+    """Time a block for /metrics and Server-Timing"""
+    return METRICS.timed_stage('typing_game_stage_duration_seconds', stage)
+
+# ===== SAMPLE LOG =====
+# Every user has a compacted profile, <user>.json, and an append-only log
+# of newer samples, <user>.jsonl, holding one JSON sample per line. /submit
+# appends one line under an exclusive lock, so its cost does not depend on
+# how many samples the user already has. compact_user_log() folds the log
+# into the profile and records the inode and size of the log it absorbed
+# as "compacted_log"; readers skip those bytes, so nothing is counted twice
+# even if compaction dies before swapping in a fresh log. Readers share
+# common/sample_log.py with identify_app.
+
+def profile_path(username):
+    return os.path.join(DATA_DIR, f'{username}.json')
+
+def log_path(username):
+    return os.path.join(DATA_DIR, f'{username}.jsonl')
+
+def open_locked_log(path):
+    """Open the log for appending and hold its lock, following compactions"""
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            # Compaction may have swapped the log while we waited for the lock
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+def append_sample(username, sample):
+    """Append one sample to the user's log in O(1)"""
+    with timed_stage('serialize'):
+        line = (json.dumps(sample) + '\n').encode('utf-8')
+    with timed_stage('lock_wait'):
+        fd = open_locked_log(log_path(username))
+    try:
+        with timed_stage('write'):
+            while line:
+                line = line[os.write(fd, line):]
+    finally:
+        os.close(fd)  # also releases the lock
+    METRICS.inc('typing_game_samples_total')
+
+def load_profile(username):
+    try:
+        with open(profile_path(username), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'username': username, 'samples': []}
+
+def write_profile(username, profile):
+    tmp_path = profile_path(username) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, profile_path(username))
+
+def compact_user_log(username):
+    """Fold the user's log into their profile; returns the samples moved"""
+    path = log_path(username)
+    if not os.path.exists(path):
+        return 0
+    fd = open_locked_log(path)
+    try:
+        with timed_stage('compact'):
+            log_stat = os.fstat(fd)
+            profile = load_profile(username)
+            offset = compacted_log_offset(profile, log_stat)
+            if log_stat.st_size <= offset:
+                return 0
+            samples, end = read_log_samples(path, offset)
+            profile['samples'].extend(samples)
+            profile['compacted_log'] = {'inode': log_stat.st_ino, 'size': end}
+            write_profile(username, profile)
+
+            # Swap in an empty log; writers waiting on the old one will notice
+            tmp_path = path + '.tmp'
+            open(tmp_path, 'w').close()
+            os.replace(tmp_path, path)
+        METRICS.inc('typing_game_compacted_samples_total', len(samples))
+        return len(samples)
+    finally:
+        os.close(fd)
+
+def compact_all(min_bytes=0):
+    """Compact every user log of at least min_bytes"""
+    moved = 0
+    for fname in os.listdir(DATA_DIR):
+        if fname.endswith('.jsonl') and os.path.getsize(os.path.join(DATA_DIR, fname)) >= min_bytes:
+            moved += compact_user_log(fname[:-len('.jsonl')])
+    return moved
+
+_compactor = None
+_compactor_lock = threading.Lock()
+
+def start_compactor():
+    """Start the periodic compaction thread once per process"""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(COMPACT_INTERVAL)
+                try:
+                    compact_all(COMPACT_MIN_BYTES)
+                except OSError as e:
+                    app.logger.warning('Log compaction failed: %s', e)
+
+        _compactor = threading.Thread(target=run, name='log-compactor', daemon=True)
+        _compactor.start()
+
+def notify_identify_app():
+    """Fire-and-forget POST to identify_app's /enrollments"""
+    if not IDENTIFY_APP_URL:
+        return
+
+    def post():
+        try:
+            req = urllib.request.Request(IDENTIFY_APP_URL.rstrip('/') + '/enrollments',
+                                         data=b'', method='POST')
+            urllib.request.urlopen(req, timeout=2).close()
+        except OSError:
+            pass  # identify_app also picks up new files on its own
+
+    threading.Thread(target=post, daemon=True).start()
+
+# ===== BINARY UPLOADS =====
+# /submit also accepts a sample as application/x-keystrokes, the compact
+# format of common/keystrokes.py that identify_app's /identify reads. The
+# events are stored as the columnar "timing_arrays" identify_app reads, in
+# its key codes, next to the hold, flight and down-down times derived from
+# them.
+
+def decode_upload(body):
+    """Decode a binary upload into a sample that can be stored as JSON"""
+    data = decode_keystrokes(body)
+    for field in ('hold_times', 'flight_times', 'down_down_times'):
+        data[field] = data[field].tolist()
+    data['timing_arrays'] = {name: column.tolist() for name, column in data['timing_arrays'].items()}
+    return data
+
 @app.route('/')
 def serve_typing_game():
     return render_template('typing_game.html')
 
 @app.route('/submit', methods=['POST'])
 def submit():
-    data = request.get_json()
+    if request.mimetype == KEYSTROKES_MIMETYPE:
+        try:
+            data = decode_upload(request.get_data())
+        except ValueError as e:
+            return jsonify({'error': f'Malformed keystroke upload: {e}'}), 400
+    else:
+        data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
     username = data.get('username')
     if not username:
         return jsonify({'error': 'No username provided'}), 400
-    
-    user_file = os.path.join(DATA_DIR, f'{username}.json')
-    if os.path.exists(user_file):
-        with open(user_file, 'r') as f:
-            user_data = json.load(f)
-    else:
-        user_data = {'username': username, 'samples': []}
+    if not valid_username(username):
+        return jsonify({'error': 'Invalid username'}), 400
     
     # Store all data types for multi-method identification
     sample_data = {
@@ -48,13 +236,37 @@ def submit():
         'ngram_data': data.get('ngram_data', {}),
         'keystroke_sequence': data.get('keystroke_sequence', [])
     }
+    if 'timing_arrays' in data:
+        # Binary uploads carry each event once, as columns
+        sample_data['timing_arrays'] = data['timing_arrays']
+        for field in ('timings', 'ngram_data', 'keystroke_sequence'):
+            del sample_data[field]
     
-    user_data['samples'].append(sample_data)
-    
-    with open(user_file, 'w') as f:
-        json.dump(user_data, f, indent=2)
+    append_sample(username, sample_data)
+    start_compactor()
     
+    with timed_stage('notify'):
+        notify_identify_app()
     return jsonify({'status': 'success'})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: request and storage latencies, stored users and log backlog"""
+    users, log_bytes = set(), 0
+    for entry in os.scandir(DATA_DIR):
+        stem, ext = os.path.splitext(entry.name)
+        if ext in ('.json', '.jsonl'):
+            users.add(stem)
+        if ext == '.jsonl':
+            log_bytes += entry.stat().st_size
+    gauges = [
+        ('typing_game_users', 'Users with a stored profile or log', len(users)),
+        ('typing_game_log_bytes', 'Bytes in sample logs, compacted or not', log_bytes),
+    ]
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    if sys.argv[1:] == ['compact']:
+        print(f'Compacted {compact_all()} samples')
+        sys.exit(0)
     app.run(port=8001, debug=True) 
\ No newline at end of file
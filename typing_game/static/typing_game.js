@@ -36,49 +36,47 @@ let timerInterval;
 let currentCharIndex = 0;
 let totalChars = 0;
 
-// N-gram data collection
-let ngramData = {
-    digraphs: {}, // 2-grams: "th", "he", "qu", etc.
-    trigraphs: {} // 3-grams: "the", "qui", "bro", etc.
-};
+// Raw key events; the server derives n-gram timings from them
 let currentKeystrokeSequence = [];
 let lastKeystrokeTime = null;
 
-// N-gram extraction functions
-function extractDigraphs(text) {
-    const digraphs = [];
-    for (let i = 0; i < text.length - 1; i++) {
-        const digraph = text.substring(i, i + 2).toLowerCase();
-        if (digraph.match(/[a-z]{2}/)) { // Only alphabetic digraphs
-            digraphs.push(digraph);
-        }
-    }
-    return digraphs;
-}
+// Compact upload (application/x-keystrokes, see common/keystrokes.py,
+// whose NAMED_KEYS this mirrors): "KST1", the header length and header,
+// then per key event a uint32 time delta in 0.1 ms, a uint16 key code
+// and a uint8 down flag, all little-endian
+const NAMED_KEYS = ['Shift', 'Backspace', 'Enter', 'Tab', 'Control', 'Alt', 'Meta',
+                    'CapsLock', 'Escape', 'ArrowLeft', 'ArrowRight', 'ArrowUp', 'ArrowDown',
+                    'Delete', 'Home', 'End'];
+const WIRE_NAMED_BASE = 0xF000;
 
-function extractTrigraphs(text) {
-    const trigraphs = [];
-    for (let i = 0; i < text.length - 2; i++) {
-        const trigraph = text.substring(i, i + 3).toLowerCase();
-        if (trigraph.match(/[a-z]{3}/)) { // Only alphabetic trigraphs
-            trigraphs.push(trigraph);
-        }
+function wireKeyCode(key) {
+    if (key.length === 1) {
+        const code = key.toLowerCase().charCodeAt(0);
+        return code < WIRE_NAMED_BASE ? code : 0;
     }
-    return trigraphs;
+    const index = NAMED_KEYS.findIndex(name => name.toLowerCase() === key.toLowerCase());
+    return index >= 0 ? WIRE_NAMED_BASE + index : 0;
 }
 
-function addNgramTiming(ngram, timing) {
-    if (!ngramData.digraphs[ngram]) {
-        ngramData.digraphs[ngram] = [];
-    }
-    ngramData.digraphs[ngram].push(timing);
-}
-
-function addTrigraphTiming(trigraph, timing) {
-    if (!ngramData.trigraphs[trigraph]) {
-        ngramData.trigraphs[trigraph] = [];
-    }
-    ngramData.trigraphs[trigraph].push(timing);
+function encodeKeystrokes(fields, events) {
+    const n = events.length;
+    const header = new TextEncoder().encode(JSON.stringify(Object.assign({}, fields, { event_count: n })));
+    const buffer = new ArrayBuffer(8 + header.length + 7 * n);
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    bytes.set([0x4b, 0x53, 0x54, 0x31]);  // "KST1"
+    view.setUint32(4, header.length, true);
+    bytes.set(header, 8);
+    const offset = 8 + header.length;
+    let last = n ? Math.round(events[0].time * 10) : 0;
+    events.forEach((event, i) => {
+        const time = Math.max(last, Math.round(event.time * 10));
+        view.setUint32(offset + 4 * i, time - last, true);
+        view.setUint16(offset + 4 * n + 2 * i, wireKeyCode(event.key), true);
+        view.setUint8(offset + 6 * n + i, event.type === 'down' ? 1 : 0);
+        last = time;
+    });
+    return buffer;
 }
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -123,8 +121,6 @@ document.addEventListener('DOMContentLoaded', function() {
         keyDownTimestamps = {};
         lastKeyUpTime = null;
         lastKeyDownTime = null;
-        // Reset n-gram data
-        ngramData = { digraphs: {}, trigraphs: {} };
         currentKeystrokeSequence = [];
         lastKeystrokeTime = null;
         // Start timer
@@ -248,58 +244,6 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         currentCharIndex = input.length;
     }
-    function processNgrams() {
-        // Process digraphs (2-grams)
-        const digraphs = extractDigraphs(promptText);
-        for (let i = 0; i < digraphs.length; i++) {
-            const digraph = digraphs[i];
-            // Find timing for this digraph in the keystroke sequence
-            const firstChar = digraph[0];
-            const secondChar = digraph[1];
-            
-            // Find the timing between these two characters
-            let timing = null;
-            for (let j = 0; j < currentKeystrokeSequence.length - 1; j++) {
-                if (currentKeystrokeSequence[j].key === firstChar && 
-                    currentKeystrokeSequence[j+1].key === secondChar &&
-                    currentKeystrokeSequence[j].type === 'down' &&
-                    currentKeystrokeSequence[j+1].type === 'down') {
-                    timing = currentKeystrokeSequence[j+1].time - currentKeystrokeSequence[j].time;
-                    break;
-                }
-            }
-            if (timing !== null) {
-                addNgramTiming(digraph, timing);
-            }
-        }
-        
-        // Process trigraphs (3-grams)
-        const trigraphs = extractTrigraphs(promptText);
-        for (let i = 0; i < trigraphs.length; i++) {
-            const trigraph = trigraphs[i];
-            const firstChar = trigraph[0];
-            const secondChar = trigraph[1];
-            const thirdChar = trigraph[2];
-            
-            // Find the timing for this trigraph
-            let timing = null;
-            for (let j = 0; j < currentKeystrokeSequence.length - 2; j++) {
-                if (currentKeystrokeSequence[j].key === firstChar && 
-                    currentKeystrokeSequence[j+1].key === secondChar &&
-                    currentKeystrokeSequence[j+2].key === thirdChar &&
-                    currentKeystrokeSequence[j].type === 'down' &&
-                    currentKeystrokeSequence[j+1].type === 'down' &&
-                    currentKeystrokeSequence[j+2].type === 'down') {
-                    timing = currentKeystrokeSequence[j+2].time - currentKeystrokeSequence[j].time;
-                    break;
-                }
-            }
-            if (timing !== null) {
-                addTrigraphTiming(trigraph, timing);
-            }
-        }
-    }
-
     function finishGame() {
         isGameActive = false;
         clearInterval(timerInterval);
@@ -307,9 +251,6 @@ document.addEventListener('DOMContentLoaded', function() {
         const finalWpm = calculateWPM(totalTime);
         const finalAccuracy = calculateAccuracy();
         
-        // Process n-grams
-        processNgrams();
-        
         // Show results
         document.getElementById('game').style.display = 'none';
         document.getElementById('result').style.display = 'block';
@@ -340,24 +281,20 @@ document.addEventListener('DOMContentLoaded', function() {
             </div>
         `;
         document.getElementById('result').innerHTML = resultHTML;
-        // Send data
-        sendData({
+        // Send data; the server derives hold, flight and n-gram timings
+        // from the key events
+        sendData(encodeKeystrokes({
             username: document.getElementById('username').value.trim(),
             text: promptText,
-            hold_times: holdTimes,
-            flight_times: flightTimes,
-            down_down_times: downDownTimes,
-            timings,
-            inputHistory,
             errors,
             totalTime,
             wpm: finalWpm,
             accuracy: finalAccuracy,
             difficulty: currentDifficulty,
             timestamp: new Date().toISOString(),
-            ngram_data: ngramData,
-            keystroke_sequence: currentKeystrokeSequence
-        });
+            // Field values with corrections; key events cannot rebuild them
+            inputHistory
+        }, timings));
     }
     function getPerformanceMessage(wpm, accuracy) {
         if (wpm >= 80 && accuracy >= 95) return "🏆 Elite Typist!";
@@ -378,11 +315,11 @@ document.addEventListener('DOMContentLoaded', function() {
     function updateStats() {
         // Placeholder for future stats
     }
-    function sendData(data) {
+    function sendData(body) {
         fetch('/submit', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(data)
+            headers: { 'Content-Type': 'application/x-keystrokes' },
+            body
         })
         .then(res => res.json())
         .then(res => {